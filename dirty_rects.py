@@ -0,0 +1,73 @@
+import pygame
+
+# Key of regions that have not been drawn yet
+_UNDRAWN = object()
+
+
+class DirtyRegions:
+    # Redraws only what changed since the last frame. Every frame the game
+    # reports each region it shows (a grid cell, a sidebar panel) together
+    # with a key describing its content; a region is drawn again only when
+    # its key differs from the previous frame. Redrawn regions are first
+    # restored from a static background layer that is composited once, and
+    # present() pushes just their rectangles to the display.
+
+    def __init__(self, screen, draw_background):
+        self.screen = screen
+        self.draw_background = draw_background  # Paints the static layer onto a surface
+        self.background = None
+        self.keys = {}
+        self.rects = []
+        self.full = True
+
+    def invalidate(self):
+        # Redraw and push the whole screen next frame
+        self.full = True
+
+    def reset_background(self):
+        # The static layer itself changed (new level size, new theme)
+        self.background = None
+        self.full = True
+
+    def begin(self):
+        # Start a frame; a full frame starts from a clean background
+        if self.background is None:
+            self.background = pygame.Surface(self.screen.get_size()).convert()
+            self.draw_background(self.background)
+        if self.full:
+            self.screen.blit(self.background, (0, 0))
+            self.keys.clear()
+
+    def stale(self, region, key):
+        # True if the region's content differs from what is on screen
+        return self.keys.get(region, _UNDRAWN) != key
+
+    def changed(self, region, key, rect):
+        # True if the region has to be drawn this frame; its area has then
+        # been reset to the background already
+        if not self.stale(region, key):
+            return False
+        self.keys[region] = key
+        self.restore(rect)
+        return True
+
+    def forget(self, region):
+        # Make the region draw again this frame, e.g. because something
+        # drawn on top of it has to be composited again
+        self.keys.pop(region, None)
+
+    def restore(self, rect):
+        # Reset an area to the background and push it this frame
+        if not self.full:
+            rect = pygame.Rect(rect).clip(self.screen.get_rect())
+            self.screen.blit(self.background, rect, rect)
+            self.rects.append(rect)
+
+    def present(self):
+        # Push this frame's changes to the display
+        if self.full:
+            pygame.display.flip()
+            self.full = False
+        elif self.rects:
+            pygame.display.update(self.rects)
+        self.rects.clear()
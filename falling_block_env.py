@@ -0,0 +1,312 @@
+import random
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+import hands_and_squirrels
+import hands_and_squirrels_v2
+import puyopuyo
+import tetorisu
+import tetris
+
+# Actions shared by every game. Each step applies one action and then one
+# gravity tick, the same as one automatic fall interval in run().
+NOOP = 0
+LEFT = 1
+RIGHT = 2
+ROTATE = 3
+SOFT_DROP = 4
+HARD_DROP = 5
+ACTION_COUNT = 6
+
+# Observation planes: the settled board and the falling piece
+BOARD_PLANE = 0
+PIECE_PLANE = 1
+PLANE_COUNT = 2
+
+
+class FallingBlockEnv(ABC):
+    # Steps one headless game without the pygame loop. Observations are
+    # uint8 arrays of shape (PLANE_COUNT, grid_height, grid_width) holding a
+    # game-specific cell code (0 for empty). The array is a view on a buffer
+    # allocated once and rewritten in place, so it is only valid until the
+    # next step or reset; copy it to keep it.
+    #
+    # Subclasses set game_class and the grid size and fill in the cell codes.
+
+    game_class = None
+    grid_width = None
+    grid_height = None
+
+    def __init__(self, seed=None, buffer=None):
+        self.game = self.game_class(headless=True, seed=seed)
+        self.plane_size = self.grid_width * self.grid_height
+        size = PLANE_COUNT * self.plane_size
+        if buffer is None:
+            buffer = bytearray(size)
+
+        # Cells are written through the memoryview and read through the
+        # array; both share the same bytes. A batch passes in its own slice.
+        self.cells = memoryview(buffer).cast('B')
+        if len(self.cells) != size:
+            raise ValueError(f"observation buffer must be {size} bytes")
+        self.obs = np.frombuffer(self.cells, dtype=np.uint8).reshape(
+            PLANE_COUNT, self.grid_height, self.grid_width)
+        self.blank = bytes(size)
+        self.last_score = 0
+
+    @classmethod
+    def observation_shape(cls):
+        return (PLANE_COUNT, cls.grid_height, cls.grid_width)
+
+    def reset(self, seed=None):
+        # Start a new game; without a seed the piece stream just continues
+        self.game.reset_game(seed)
+        self.last_score = 0
+        return self.observation()
+
+    def step(self, action):
+        # Returns (observation, reward, done); the reward is the score gained
+        game = self.game
+        if not game.game_over:
+            if action == LEFT:
+                self.move(-1)
+            elif action == RIGHT:
+                self.move(1)
+            elif action == ROTATE:
+                self.rotate()
+            elif action == SOFT_DROP:
+                self.fall()
+            elif action == HARD_DROP:
+                while self.fall():
+                    pass
+
+            # Gravity tick (a piece that just locked has been replaced by a
+            # fresh one at the top, which falls one row like in run())
+            if not game.game_over:
+                self.fall()
+
+        reward = game.score - self.last_score
+        self.last_score = game.score
+        return self.observation(), reward, game.game_over
+
+    def observation(self):
+        self.cells[:] = self.blank
+        self.write_board(self.cells)
+        if not self.game.game_over:
+            self.write_piece(self.cells, self.plane_size)
+        return self.obs
+
+    # Piece control for games with a current_piece and Tetris-style helpers
+
+    def move(self, dx):
+        game = self.game
+        if game.valid_move(game.current_piece, x_offset=dx):
+            game.current_piece['x'] += dx
+
+    def rotate(self):
+        game = self.game
+        game.current_piece = game.rotate_piece(game.current_piece)
+
+    def fall(self):
+        # Move the piece down one row, or lock it if it has landed.
+        # Returns True if the piece moved.
+        game = self.game
+        if game.valid_move(game.current_piece, y_offset=1):
+            game.current_piece['y'] += 1
+            return True
+        game.lock_piece(game.current_piece)
+        return False
+
+    @abstractmethod
+    def write_board(self, cells):
+        # Write the settled board into the first plane
+        pass
+
+    @abstractmethod
+    def write_piece(self, cells, offset):
+        # Write the falling piece into the plane starting at offset
+        pass
+
+
+class TetrisEnv(FallingBlockEnv):
+    # Cell code: shape index + 1
+
+    game_class = tetris.Tetris
+    grid_width = tetris.GRID_WIDTH
+    grid_height = tetris.GRID_HEIGHT
+
+    COLOR_CODES = {color: shape_idx + 1 for shape_idx, color in enumerate(tetris.SHAPE_COLORS)}
+
+    def write_board(self, cells):
+        codes = self.COLOR_CODES
+        width = self.grid_width
+        colors = self.game.colors
+        for y, row in enumerate(self.game.rows):
+            if row:
+                color_row = colors[y]
+                base = y * width
+                for x in range(width):
+                    if row >> x & 1:
+                        cells[base + x] = codes[color_row[x]]
+
+    def write_piece(self, cells, offset):
+        piece = self.game.current_piece
+        code = piece['type'] + 1
+        width = self.grid_width
+        for i, mask in enumerate(tetris.PIECE_MASKS[piece['type']][piece['rotation']]):
+            y = piece['y'] + i
+            if y >= 0:
+                mask <<= piece['x']
+                base = offset + y * width
+                for x in range(width):
+                    if mask >> x & 1:
+                        cells[base + x] = code
+
+
+class PuyoPuyoEnv(FallingBlockEnv):
+    # Cell code: color index + 1. ROTATE turns the pair clockwise.
+
+    game_class = puyopuyo.PuyoPuyo
+    grid_width = puyopuyo.GRID_WIDTH
+    grid_height = puyopuyo.GRID_HEIGHT
+
+    COLOR_CODES = {color: i + 1 for i, color in enumerate(puyopuyo.PUYO_COLORS)}
+
+    def move(self, dx):
+        self.game.move_pair(dx, 0)
+
+    def rotate(self):
+        self.game.rotate_pair('clockwise')
+
+    def fall(self):
+        if self.game.move_pair(0, 1):
+            return True
+        self.game.lock_pair()
+        return False
+
+    def write_board(self, cells):
+        codes = self.COLOR_CODES
+        width = self.grid_width
+        for y, row in enumerate(self.game.grid):
+            base = y * width
+            for x, color in enumerate(row):
+                if color:
+                    cells[base + x] = codes[color]
+
+    def write_piece(self, cells, offset):
+        for puyo in self.game.current_pair.values():
+            if puyo['y'] >= 0:
+                cells[offset + puyo['y'] * self.grid_width + puyo['x']] = self.COLOR_CODES[puyo['color']]
+
+
+class TetoRisuEnv(FallingBlockEnv):
+    # Cell code: the packed cell byte used by the game itself
+
+    game_class = tetorisu.TetoRisu
+    grid_width = tetorisu.GRID_WIDTH
+    grid_height = tetorisu.GRID_HEIGHT
+
+    def write_board(self, cells):
+        # Rows are already bytearrays of packed cells
+        width = self.grid_width
+        for y, row in enumerate(self.game.grid):
+            cells[y * width:(y + 1) * width] = row
+
+    def write_piece(self, cells, offset):
+        piece = self.game.current_piece
+        width = self.grid_width
+        offsets = tetorisu.PIECE_OFFSETS[piece['type']][piece['rotation']]
+        for (x, y), cell in zip(offsets, piece['cells']):
+            y += piece['y']
+            if y >= 0:
+                cells[offset + y * width + piece['x'] + x] = cell
+
+
+def hands_cell_code(cell):
+    # Low two bits hold the cell type (hand, squirrel or nut), the bits
+    # above them the bit length of the value (0 for cells without one)
+    return cell['type'] | cell.get('value', 0).bit_length() << 2
+
+
+class HandsAndSquirrelsEnv(FallingBlockEnv):
+    # Cell code: see hands_cell_code
+
+    game_class = hands_and_squirrels.HandsAndSquirrels
+    grid_width = hands_and_squirrels.GRID_WIDTH
+    grid_height = hands_and_squirrels.GRID_HEIGHT
+
+    def write_board(self, cells):
+        width = self.grid_width
+        for y, row in enumerate(self.game.grid):
+            base = y * width
+            for x, cell in enumerate(row):
+                if cell:
+                    cells[base + x] = hands_cell_code(cell)
+
+    def write_piece(self, cells, offset):
+        piece = self.game.current_piece
+        width = self.grid_width
+        for y, row in enumerate(piece['shape']):
+            grid_y = piece['y'] + y
+            if grid_y >= 0:
+                base = offset + grid_y * width + piece['x']
+                for x, cell in enumerate(row):
+                    if cell is not None:
+                        cells[base + x] = hands_cell_code(cell)
+
+
+class HandsAndSquirrelsV2Env(HandsAndSquirrelsEnv):
+    game_class = hands_and_squirrels_v2.HandsAndSquirrels
+    grid_width = hands_and_squirrels_v2.GRID_WIDTH
+    grid_height = hands_and_squirrels_v2.GRID_HEIGHT
+
+
+class BatchEnv:
+    # num_envs copies of one environment class stepped together. The
+    # observations of all of them live in one (N, planes, height, width)
+    # array that each environment writes its own slice of, and rewards and
+    # done flags are returned in arrays that are reused on every step.
+    # Finished games are reset automatically, so the observation returned
+    # for them is the first one of the next game. Every game, including the
+    # automatic restarts, gets its own seed drawn from the batch seed, so a
+    # batch run is reproducible from start to end and each game can be
+    # replayed on its own.
+
+    def __init__(self, env_class, num_envs, seed=None):
+        self.num_envs = num_envs
+        self.random = random.Random(seed)
+        size = PLANE_COUNT * env_class.grid_width * env_class.grid_height
+        self.buffer = bytearray(num_envs * size)
+        cells = memoryview(self.buffer)
+        self.envs = [env_class(seed=self.random.getrandbits(64), buffer=cells[i * size:(i + 1) * size])
+                     for i in range(num_envs)]
+        self.observations = np.frombuffer(self.buffer, dtype=np.uint8).reshape(
+            (num_envs,) + env_class.observation_shape())
+        self.rewards = np.zeros(num_envs, dtype=np.int64)
+        self.dones = np.zeros(num_envs, dtype=bool)
+        for env in self.envs:
+            env.observation()
+
+    def reset(self, seed=None):
+        # Reset every environment; a seed restarts the stream of game seeds
+        if seed is not None:
+            self.random.seed(seed)
+        for env in self.envs:
+            env.reset(self.random.getrandbits(64))
+        self.rewards[:] = 0
+        self.dones[:] = False
+        return self.observations
+
+    def step(self, actions):
+        # One action per environment; returns (observations, rewards, dones)
+        actions = np.broadcast_to(np.asarray(actions), (self.num_envs,)).tolist()
+        rewards = self.rewards
+        dones = self.dones
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            _, reward, done = env.step(action)
+            rewards[i] = reward
+            dones[i] = done
+            if done:
+                env.reset(self.random.getrandbits(64))
+        return self.observations, rewards, dones
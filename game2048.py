@@ -2,8 +2,8 @@ import pygame
 import random
 import sys
 
-# Initialize pygame
-pygame.init()
+from dirty_rects import DirtyRegions
+from replay import Replay, game_seed
 
 # Colors
 BLACK = (0, 0, 0)
@@ -57,21 +57,46 @@ GRID_HEIGHT = GRID_SIZE * (CELL_SIZE + GRID_PADDING) + GRID_PADDING
 # Screen dimensions
 SCREEN_WIDTH = GRID_WIDTH
 SCREEN_HEIGHT = GRID_HEIGHT + 100  # Extra space for score
+SCORE_RECT = (0, GRID_HEIGHT + 10, GRID_WIDTH, 80)
 
 class Game2048:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("2048")
-        self.clock = pygame.time.Clock()
-        self.fonts = {
-            'small': pygame.font.SysFont('Arial', 24),
-            'medium': pygame.font.SysFont('Arial', 36),
-            'large': pygame.font.SysFont('Arial', 48),
-            'xlarge': pygame.font.SysFont('Arial', 64)
-        }
+    def __init__(self, headless=False, seed=None):
+        self.headless = headless
+        # Per-game generator, so a seed reproduces the tile sequence. The
+        # seed is kept so a recorded session can be replayed.
+        self.seed = game_seed(seed)
+        self.random = random.Random(self.seed)
+        self.frame = 0
+        if not headless:
+            # Initialize pygame
+            pygame.init()
+            
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            pygame.display.set_caption("2048")
+            self.clock = pygame.time.Clock()
+            self.fonts = {
+                'small': pygame.font.SysFont('Arial', 24),
+                'medium': pygame.font.SysFont('Arial', 36),
+                'large': pygame.font.SysFont('Arial', 48),
+                'xlarge': pygame.font.SysFont('Arial', 64)
+            }
+            
+            # Rendered tile faces keyed by (value, cell size), see tile_surface
+            self.tile_colors = TILE_COLORS
+            self.text_colors = TEXT_COLORS
+            self.tile_cache = {}
+            
+            self.dirty = DirtyRegions(self.screen, self.draw_background)
+            self.overlay = None  # 'game_over', 'won' or None, as last drawn
+        
         self.reset_game()
 
-    def reset_game(self):
+    def reset_game(self, seed=None):
+        # A seed restarts the tile sequence; otherwise the stream continues
+        if seed is not None:
+            self.seed = game_seed(seed)
+            self.random.seed(seed)
+        
         # Initialize grid with zeros
         self.grid = [[0 for _ in range(GRID_SIZE)] for _ in range(GRID_SIZE)]
         self.score = 0
@@ -92,9 +117,9 @@ class Game2048:
         
         if empty_cells:
             # Choose a random empty cell
-            x, y = random.choice(empty_cells)
+            x, y = self.random.choice(empty_cells)
             # 90% chance for a 2, 10% chance for a 4
-            self.grid[y][x] = 2 if random.random() < 0.9 else 4
+            self.grid[y][x] = 2 if self.random.random() < 0.9 else 4
             return True
         return False
 
@@ -234,16 +259,29 @@ class Game2048:
         
         return True
 
-    def draw_tile(self, x, y, value):
-        # Calculate position
-        pos_x = GRID_PADDING + x * (CELL_SIZE + GRID_PADDING)
-        pos_y = GRID_PADDING + y * (CELL_SIZE + GRID_PADDING)
+    def set_theme(self, tile_colors, text_colors):
+        # Switch tile and text colors; tiles are rendered again on demand
+        self.tile_colors = tile_colors
+        self.text_colors = text_colors
+        self.tile_cache.clear()
+        self.dirty.invalidate()
+
+    def tile_surface(self, value, size=CELL_SIZE):
+        # There are only a dozen distinct tiles, so each face (background and
+        # centered number) is rendered once and then just blitted
+        key = (value, size)
+        surface = self.tile_cache.get(key)
+        if surface is not None:
+            return surface
         
-        # Draw tile background
+        # The corners outside the rounded rectangle show the grid background,
+        # which keeps the tile opaque and cheap to blit
+        surface = pygame.Surface((size, size))
+        surface.fill(DARK_GRAY)
         pygame.draw.rect(
-            self.screen,
-            TILE_COLORS.get(value, (60, 58, 50)),  # Default color for very high values
-            [pos_x, pos_y, CELL_SIZE, CELL_SIZE],
+            surface,
+            self.tile_colors.get(value, (60, 58, 50)),  # Default color for very high values
+            [0, 0, size, size],
             0,
             5  # Rounded corners
         )
@@ -257,34 +295,50 @@ class Game2048:
             if value >= 10000:
                 font_size = 'small'
             
-            text = self.fonts[font_size].render(str(value), True, TEXT_COLORS.get(value, WHITE))
-            text_rect = text.get_rect(center=(pos_x + CELL_SIZE // 2, pos_y + CELL_SIZE // 2))
-            self.screen.blit(text, text_rect)
+            text = self.fonts[font_size].render(str(value), True, self.text_colors.get(value, WHITE))
+            surface.blit(text, text.get_rect(center=(size // 2, size // 2)))
+        
+        surface = surface.convert()
+        self.tile_cache[key] = surface
+        return surface
 
-    def draw_grid(self):
-        # Draw background
+    def draw_tile(self, x, y, value):
+        # Calculate position
+        pos_x = GRID_PADDING + x * (CELL_SIZE + GRID_PADDING)
+        pos_y = GRID_PADDING + y * (CELL_SIZE + GRID_PADDING)
+        
+        # Tiles are only drawn again when their value changed
+        if self.dirty.changed((x, y), value, (pos_x, pos_y, CELL_SIZE, CELL_SIZE)):
+            self.screen.blit(self.tile_surface(value), (pos_x, pos_y))
+
+    def draw_background(self, surface):
+        # Static layer: window, grid and score panel backgrounds
+        surface.fill(GRAY)
         pygame.draw.rect(
-            self.screen,
+            surface,
             DARK_GRAY,
             [0, 0, GRID_WIDTH, GRID_HEIGHT],
             0,
             10  # Rounded corners
         )
-        
-        # Draw tiles
-        for y in range(GRID_SIZE):
-            for x in range(GRID_SIZE):
-                self.draw_tile(x, y, self.grid[y][x])
-
-    def draw_score(self):
-        # Draw score background
         pygame.draw.rect(
-            self.screen,
+            surface,
             DARK_GRAY,
-            [0, GRID_HEIGHT + 10, GRID_WIDTH, 80],
+            SCORE_RECT,
             0,
             10  # Rounded corners
         )
+
+    def draw_grid(self):
+        # Draw tiles
+        grid = self.grid
+        for y in range(GRID_SIZE):
+            for x in range(GRID_SIZE):
+                self.draw_tile(x, y, grid[y][x])
+
+    def draw_score(self):
+        if not self.dirty.changed('score', self.score, SCORE_RECT):
+            return
         
         # Draw score text
         score_text = self.fonts['medium'].render(f"Score: {self.score}", True, WHITE)
@@ -325,17 +379,51 @@ class Game2048:
         self.screen.blit(continue_text, text_rect)
 
     def draw(self):
-        # Draw everything
-        self.screen.fill(GRAY)
+        # Draw what changed since the last frame. The overlays cover the
+        # whole grid, so showing or hiding one redraws everything.
+        overlay = 'game_over' if self.game_over else 'won' if self.won else None
+        if overlay != self.overlay:
+            self.overlay = overlay
+            self.dirty.invalidate()
+        
+        self.dirty.begin()
+        full = self.dirty.full
         self.draw_grid()
         self.draw_score()
         
+        if full:
+            if self.game_over:
+                self.draw_game_over()
+            elif self.won:
+                self.draw_win()
+
+    def handle_key(self, key):
+        # Apply one key press; run() and replays both go through here
         if self.game_over:
-            self.draw_game_over()
+            if key == pygame.K_r:
+                self.reset_game()
         elif self.won:
-            self.draw_win()
+            if key == pygame.K_c:
+                self.won = False  # Continue playing
+        else:
+            if key == pygame.K_UP:
+                self.move(0)
+            elif key == pygame.K_RIGHT:
+                self.move(1)
+            elif key == pygame.K_DOWN:
+                self.move(2)
+            elif key == pygame.K_LEFT:
+                self.move(3)
+            elif key == pygame.K_r:
+                self.reset_game()
 
-    def run(self):
+    def update(self):
+        # Nothing moves on its own; frames only timestamp the key presses
+        self.frame += 1
+
+    def run(self, replay_path=None):
+        # Every key press is recorded; the replay is saved to replay_path on exit
+        replay = Replay(self.seed)
         running = True
         
         while running:
@@ -343,35 +431,22 @@ class Game2048:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
-                
-                if event.type == pygame.KEYDOWN:
-                    if self.game_over:
-                        if event.key == pygame.K_r:
-                            self.reset_game()
-                    elif self.won:
-                        if event.key == pygame.K_c:
-                            self.won = False  # Continue playing
-                    else:
-                        if event.key == pygame.K_UP:
-                            self.move(0)
-                        elif event.key == pygame.K_RIGHT:
-                            self.move(1)
-                        elif event.key == pygame.K_DOWN:
-                            self.move(2)
-                        elif event.key == pygame.K_LEFT:
-                            self.move(3)
-                        elif event.key == pygame.K_r:
-                            self.reset_game()
+                elif event.type == pygame.KEYDOWN:
+                    replay.record(self.frame, event.key)
+                    self.handle_key(event.key)
             
-            # Draw everything
-            self.draw()
+            self.update()
             
-            # Update the display
-            pygame.display.flip()
+            # Draw what changed and push only those areas to the display
+            self.draw()
+            self.dirty.present()
             
             # Cap the frame rate
             self.clock.tick(60)
         
+        if replay_path is not None:
+            replay.frames = self.frame
+            replay.save(replay_path)
         pygame.quit()
         sys.exit()
 
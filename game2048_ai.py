@@ -0,0 +1,280 @@
+import random
+import time
+from collections import OrderedDict
+
+from game2048 import GRID_SIZE
+from game2048_bitboard import (ROW_MASK, empty_cells, grid_to_board,
+                               max_exponent, move_board, transpose)
+
+# Heuristic weights (per row, applied to rows and columns)
+LOST_PENALTY = 200000.0
+EMPTY_WEIGHT = 270.0
+MERGES_WEIGHT = 700.0
+MONOTONICITY_POWER = 4.0
+MONOTONICITY_WEIGHT = 47.0
+SUM_POWER = 3.5
+SUM_WEIGHT = 11.0
+
+# Search defaults
+DEFAULT_DEPTH = 3
+DEFAULT_CACHE_SIZE = 200000
+PROBABILITY_CUTOFF = 0.0001
+
+
+def _row_heuristic(row):
+    line = [(row >> (4 * i)) & 0xF for i in range(GRID_SIZE)]
+
+    tile_sum = 0.0
+    empty = 0
+    merges = 0
+    prev = 0
+    counter = 0
+    for rank in line:
+        tile_sum += rank ** SUM_POWER
+        if rank == 0:
+            empty += 1
+        else:
+            if prev == rank:
+                counter += 1
+            elif counter > 0:
+                merges += 1 + counter
+                counter = 0
+            prev = rank
+    if counter > 0:
+        merges += 1 + counter
+
+    # Penalize rows that are not monotonic in either direction
+    mono_left = 0.0
+    mono_right = 0.0
+    for i in range(1, GRID_SIZE):
+        if line[i - 1] > line[i]:
+            mono_left += line[i - 1] ** MONOTONICITY_POWER - line[i] ** MONOTONICITY_POWER
+        else:
+            mono_right += line[i] ** MONOTONICITY_POWER - line[i - 1] ** MONOTONICITY_POWER
+
+    return (LOST_PENALTY + EMPTY_WEIGHT * empty + MERGES_WEIGHT * merges
+            - MONOTONICITY_WEIGHT * min(mono_left, mono_right) - SUM_WEIGHT * tile_sum)
+
+
+ROW_HEURISTIC = [_row_heuristic(row) for row in range(65536)]
+
+
+def score_board(board):
+    # Static evaluation of a bitboard: rows plus columns
+    columns = transpose(board)
+    total = 0.0
+    for shift in (0, 16, 32, 48):
+        total += ROW_HEURISTIC[(board >> shift) & ROW_MASK]
+        total += ROW_HEURISTIC[(columns >> shift) & ROW_MASK]
+    return total
+
+
+class TranspositionTable:
+    # Bounded board -> (depth, value) cache with least-recently-used eviction
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, board, depth):
+        # Only reuse values searched at least as deep as requested
+        entry = self.entries.get(board)
+        if entry is not None and entry[0] >= depth:
+            self.entries.move_to_end(board)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, board, depth, value):
+        self.entries[board] = (depth, value)
+        self.entries.move_to_end(board)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class SearchStats:
+    # Throughput counters for tuning search depth against latency budgets
+
+    def __init__(self):
+        self.moves = 0
+        self.nodes = 0
+        self.elapsed = 0.0
+
+    def moves_per_second(self):
+        return self.moves / self.elapsed if self.elapsed else 0.0
+
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        return (f"{self.moves} moves, {self.nodes} nodes in {self.elapsed:.2f}s: "
+                f"{self.moves_per_second():.1f} moves/s, {self.nodes_per_second():.0f} nodes/s")
+
+
+class ExpectimaxSolver:
+    # Expectimax over bitboards: max nodes pick a direction, chance nodes
+    # average over every tile spawn. Branches whose probability falls below
+    # PROBABILITY_CUTOFF are evaluated statically.
+
+    def __init__(self, depth=DEFAULT_DEPTH, cache_size=DEFAULT_CACHE_SIZE):
+        self.depth = depth
+        self.cache = TranspositionTable(cache_size)
+        self.stats = SearchStats()
+
+    def best_move(self, board):
+        start = time.perf_counter()
+        best_direction = None
+        best_value = -1.0
+
+        for direction in range(4):
+            new_board, _ = move_board(board, direction)
+            if new_board == board:
+                continue
+            value = self._chance_node(new_board, self.depth, 1.0)
+            if value > best_value:
+                best_value = value
+                best_direction = direction
+
+        self.stats.moves += 1
+        self.stats.elapsed += time.perf_counter() - start
+        return best_direction
+
+    def _max_node(self, board, depth, probability):
+        self.stats.nodes += 1
+        best = 0.0
+        for direction in range(4):
+            new_board, _ = move_board(board, direction)
+            if new_board != board:
+                best = max(best, self._chance_node(new_board, depth - 1, probability))
+        return best
+
+    def _chance_node(self, board, depth, probability):
+        if depth <= 0 or probability < PROBABILITY_CUTOFF:
+            return score_board(board)
+
+        cached = self.cache.get(board, depth)
+        if cached is not None:
+            return cached
+
+        self.stats.nodes += 1
+        cells = empty_cells(board)
+        cell_probability = probability / len(cells)
+        total = 0.0
+        for index in cells:
+            shift = 4 * index
+            total += 0.9 * self._max_node(board | (1 << shift), depth, cell_probability * 0.9)
+            total += 0.1 * self._max_node(board | (2 << shift), depth, cell_probability * 0.1)
+        value = total / len(cells)
+
+        self.cache.put(board, depth, value)
+        return value
+
+
+class MonteCarloSolver:
+    # Picks the direction whose random playouts score best on average
+
+    def __init__(self, rollouts=50, rollout_depth=40, seed=None):
+        self.rollouts = rollouts
+        self.rollout_depth = rollout_depth
+        self.random = random.Random(seed)
+        self.stats = SearchStats()
+
+    def best_move(self, board):
+        start = time.perf_counter()
+        best_direction = None
+        best_value = -1.0
+
+        for direction in range(4):
+            new_board, gained = move_board(board, direction)
+            if new_board == board:
+                continue
+            total = 0
+            for _ in range(self.rollouts):
+                total += gained + self._rollout(new_board)
+            value = total / self.rollouts
+            if value > best_value:
+                best_value = value
+                best_direction = direction
+
+        self.stats.moves += 1
+        self.stats.elapsed += time.perf_counter() - start
+        return best_direction
+
+    def _spawn(self, board):
+        cells = empty_cells(board)
+        if not cells:
+            return board
+        exponent = 1 if self.random.random() < 0.9 else 2
+        return board | (exponent << (4 * self.random.choice(cells)))
+
+    def _rollout(self, board):
+        # Random playout; returns the score gained before it ends
+        score = 0
+        board = self._spawn(board)
+        for _ in range(self.rollout_depth):
+            self.stats.nodes += 1
+            directions = [0, 1, 2, 3]
+            self.random.shuffle(directions)
+            for direction in directions:
+                new_board, gained = move_board(board, direction)
+                if new_board != board:
+                    break
+            else:
+                break
+            score += gained
+            board = self._spawn(new_board)
+        return score
+
+
+class AutoPlayer:
+    # Drives a Game2048 (or BitboardGame2048) through Game2048.move
+
+    def __init__(self, game, solver=None):
+        self.game = game
+        self.solver = solver if solver is not None else ExpectimaxSolver()
+
+    def current_board(self):
+        board = getattr(self.game, 'board', None)
+        if board is None:
+            board = grid_to_board(self.game.grid)
+        return board
+
+    def step(self):
+        # Play one move; returns False when no move is possible
+        if self.game.game_over:
+            return False
+        direction = self.solver.best_move(self.current_board())
+        if direction is None:
+            self.game.game_over = True
+            return False
+        return self.game.move(direction)
+
+    def play(self, max_moves=None):
+        # Play until the game is over; reaching 2048 keeps the game going
+        moves = 0
+        while not self.game.game_over and (max_moves is None or moves < max_moves):
+            if not self.step():
+                break
+            self.game.won = False
+            moves += 1
+        return self.solver.stats
+
+
+if __name__ == "__main__":
+    from game2048_bitboard import BitboardGame2048
+
+    game = BitboardGame2048(headless=True)
+    stats = AutoPlayer(game, ExpectimaxSolver(depth=2)).play()
+    print(f"Score: {game.score}, max tile: {1 << max_exponent(game.board)}")
+    print(stats.report())
@@ -0,0 +1,207 @@
+import numpy as np
+
+from game2048 import GRID_SIZE
+from game2048_bitboard import ROW_LEFT, ROW_SCORE
+
+# Row table shared with the bitboard backend. Every direction is turned
+# into a left move by transposing and/or mirroring the boards, so a single
+# 1-D table gather per row is enough.
+_ROW_LEFT = np.array(ROW_LEFT, dtype=np.uint64)
+_ROW_SCORE = np.array(ROW_SCORE, dtype=np.int64)
+
+# uint64 constants keep numpy from promoting the boards to float
+_ROW_SHIFTS = [np.uint64(shift) for shift in (0, 16, 32, 48)]
+_CELL_SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+_ROW_MASK = np.uint64(0xFFFF)
+_CELL_MASK = np.uint64(0xF)
+_NIBBLE_LOW_BITS = np.uint64(0x1111111111111111)
+_WIN_PATTERN = np.uint64(0xBBBBBBBBBBBBBBBB)  # 2048 is exponent 11 (0xB)
+_ZERO = np.uint64(0)
+_ONE = np.uint64(1)
+_TWO = np.uint64(2)
+_FOUR = np.uint64(4)
+
+# Random cell draws per board before falling back to an exact pick
+_SPAWN_ATTEMPTS = 8
+
+
+def _transpose(boards):
+    # Vectorized version of game2048_bitboard.transpose
+    a1 = boards & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = boards & np.uint64(0x0000F0F00000F0F0)
+    a3 = boards & np.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = a & np.uint64(0xFF00FF0000FF00FF)
+    b2 = a & np.uint64(0x00FF00FF00000000)
+    b3 = a & np.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+
+def _mirror(boards):
+    # Reverse the cell order of every row (swap nibbles, then bytes)
+    m = ((boards & np.uint64(0x0F0F0F0F0F0F0F0F)) << _FOUR) | ((boards >> _FOUR) & np.uint64(0x0F0F0F0F0F0F0F0F))
+    return ((m & np.uint64(0x00FF00FF00FF00FF)) << np.uint64(8)) | ((m >> np.uint64(8)) & np.uint64(0x00FF00FF00FF00FF))
+
+
+def _empty_bits(boards):
+    # One bit (the lowest of the nibble) set for every empty cell
+    occupied = boards | (boards >> _ONE)
+    occupied |= occupied >> _TWO
+    return ~occupied & _NIBBLE_LOW_BITS
+
+
+def _move_left(boards):
+    result = np.zeros_like(boards)
+    score = np.zeros(len(boards), dtype=np.int64)
+    for shift in _ROW_SHIFTS:
+        rows = ((boards >> shift) & _ROW_MASK).astype(np.intp)
+        result |= _ROW_LEFT[rows] << shift
+        score += _ROW_SCORE[rows]
+    return result, score
+
+
+def move_boards(boards, directions):
+    # directions: 0=up, 1=right, 2=down, 3=left, one per board
+    # Returns the new boards and the score gained by each move
+    result = np.empty_like(boards)
+    score = np.empty(len(boards), dtype=np.int64)
+
+    # Boards are grouped by direction so each group only pays for the
+    # transforms it needs: up and down work on the transposed board, right
+    # and down on the mirrored one, and everything becomes a left move
+    for direction in range(4):
+        indices = np.flatnonzero(directions == direction)
+        if not len(indices):
+            continue
+
+        vertical = direction in (0, 2)
+        mirrored = direction in (1, 2)
+
+        source = boards[indices]
+        if vertical:
+            source = _transpose(source)
+        if mirrored:
+            source = _mirror(source)
+
+        moved, gained = _move_left(source)
+
+        # Undo the transforms in reverse order
+        if mirrored:
+            moved = _mirror(moved)
+        if vertical:
+            moved = _transpose(moved)
+
+        result[indices] = moved
+        score[indices] = gained
+
+    return result, score
+
+
+def unpack_cells(boards):
+    # (N, 16) array of cell exponents in row-major order
+    return ((boards[:, None] >> _CELL_SHIFTS) & _CELL_MASK).astype(np.uint8)
+
+
+class BatchGame2048:
+    # N independent 2048 boards stored as one array of packed 64-bit boards
+    # (same layout as game2048_bitboard) and stepped together.
+
+    def __init__(self, num_boards, seed=None):
+        self.num_boards = num_boards
+        self.rng = np.random.default_rng(seed)
+        self.boards = np.zeros(num_boards, dtype=np.uint64)
+        self.score = np.zeros(num_boards, dtype=np.int64)
+        self.game_over = np.zeros(num_boards, dtype=bool)
+        self.won = np.zeros(num_boards, dtype=bool)
+        self.reset_game()
+
+    @property
+    def grid(self):
+        # Tile values as an (N, 4, 4) array, matching Game2048.grid per board
+        cells = unpack_cells(self.boards).astype(np.int64)
+        values = np.where(cells > 0, np.left_shift(1, cells), 0)
+        return values.reshape(-1, GRID_SIZE, GRID_SIZE)
+
+    def reset_game(self, mask=None):
+        # Reset every board, or only the boards selected by a boolean mask
+        if mask is None:
+            mask = np.ones(self.num_boards, dtype=bool)
+        self.boards[mask] = 0
+        self.score[mask] = 0
+        self.game_over[mask] = False
+        self.won[mask] = False
+
+        # Add two initial tiles
+        self.add_new_tile(mask)
+        self.add_new_tile(mask)
+
+    def add_new_tile(self, mask=None):
+        # Place a tile on a uniformly random empty cell of each selected
+        # board: 90% chance for a 2, 10% chance for a 4
+        if mask is None:
+            mask = np.ones(self.num_boards, dtype=bool)
+
+        empty = np.where(mask, _empty_bits(self.boards), _ZERO)
+        added = empty != _ZERO
+
+        # Rejection sampling: draw a random cell and keep it if it is empty.
+        # The first draw covers every board; later draws only the misses,
+        # and boards still unlucky after a few rounds get an exact pick.
+        cells = self.rng.integers(0, 16, self.num_boards, dtype=np.uint64)
+        chosen = (_ONE << (cells * _FOUR)) & empty
+        todo = np.flatnonzero(added & (chosen == _ZERO))
+
+        for _ in range(_SPAWN_ATTEMPTS):
+            if not len(todo):
+                break
+            cells = self.rng.integers(0, 16, len(todo), dtype=np.uint64)
+            guess = (_ONE << (cells * _FOUR)) & empty[todo]
+            hit = guess != _ZERO
+            chosen[todo[hit]] = guess[hit]
+            todo = todo[~hit]
+
+        if len(todo):
+            bits = (empty[todo][:, None] >> _CELL_SHIFTS) & _ONE
+            k = (self.rng.random(len(todo)) * bits.sum(axis=1)).astype(np.int64)
+            cells = np.argmax(np.cumsum(bits, axis=1) > k[:, None], axis=1).astype(np.uint64)
+            chosen[todo] = _ONE << (cells * _FOUR)
+
+        # chosen holds a 1 in the picked nibble; shifting it once makes a 4
+        fours = (self.rng.random(self.num_boards) >= 0.9).astype(np.uint64)
+        self.boards |= chosen << fours
+        return added
+
+    def move(self, directions):
+        # Apply one move per board and return a boolean array of boards that changed
+        directions = np.broadcast_to(np.asarray(directions, dtype=np.int64), (self.num_boards,))
+        new_boards, score_increase = move_boards(self.boards, directions)
+        moved = new_boards != self.boards
+
+        # Boards that did not move are unchanged and scored nothing
+        self.boards = new_boards
+        self.score += score_increase
+        self.add_new_tile(moved)
+
+        # Check for win and game over only on boards that changed
+        self.won |= moved & self.check_win()
+        self.game_over |= moved & self.check_game_over()
+
+        return moved
+
+    def check_win(self):
+        # A cell equals 2048 when it becomes an empty nibble after XOR with 0xB
+        return _empty_bits(self.boards ^ _WIN_PATTERN) != _ZERO
+
+    def check_game_over(self):
+        game_over = _empty_bits(self.boards) == _ZERO
+
+        # Full boards are over only if no direction changes them
+        full = np.flatnonzero(game_over)
+        if len(full):
+            boards = self.boards[full]
+            stuck = np.ones(len(full), dtype=bool)
+            for direction in range(4):
+                new_boards, _ = move_boards(boards, np.full(len(full), direction))
+                stuck &= new_boards == boards
+            game_over[full] = stuck
+        return game_over
@@ -0,0 +1,215 @@
+from game2048 import Game2048, GRID_SIZE
+from replay import game_seed
+
+# Bitboard layout: the 4x4 grid is packed into one 64-bit integer.
+# Each cell holds a 4-bit exponent (0 = empty, 1 = 2, 2 = 4, ... 15 = 32768).
+# Cell (x, y) lives at bits 4 * (y * 4 + x), so row y is the 16-bit word
+# starting at bit 16 * y and its leftmost cell is the lowest nibble.
+ROW_MASK = 0xFFFF
+MAX_EXPONENT = 15
+
+
+def _move_row_left(row):
+    # Slide and merge a single packed row toward the low nibble, using the
+    # same compact / merge / compact rules as Game2048.move
+    line = [(row >> (4 * i)) & 0xF for i in range(GRID_SIZE)]
+    tiles = [val for val in line if val != 0]
+
+    merged = []
+    score = 0
+    i = 0
+    while i < len(tiles):
+        # Exponent 15 cannot be doubled inside a nibble, so it never merges
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1] and tiles[i] < MAX_EXPONENT:
+            merged.append(tiles[i] + 1)
+            score += 1 << (tiles[i] + 1)
+            i += 2
+        else:
+            merged.append(tiles[i])
+            i += 1
+
+    result = 0
+    for i, val in enumerate(merged):
+        result |= val << (4 * i)
+    return result, score
+
+
+def _reverse_row(row):
+    return ((row & 0xF) << 12) | ((row & 0xF0) << 4) | ((row >> 4) & 0xF0) | (row >> 12)
+
+
+def _build_tables():
+    # Precompute the result of moving every possible row left and right,
+    # plus the score gained by the merges (identical for both directions)
+    left = [0] * 65536
+    right = [0] * 65536
+    score = [0] * 65536
+
+    for row in range(65536):
+        result, gain = _move_row_left(row)
+        left[row] = result
+        score[row] = gain
+
+    for row in range(65536):
+        right[row] = _reverse_row(left[_reverse_row(row)])
+
+    return left, right, score
+
+
+ROW_LEFT, ROW_RIGHT, ROW_SCORE = _build_tables()
+
+
+def transpose(board):
+    # Swap rows and columns so vertical moves can reuse the row tables
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def _apply_rows(board, table):
+    result = 0
+    score = 0
+    for shift in (0, 16, 32, 48):
+        row = (board >> shift) & ROW_MASK
+        result |= table[row] << shift
+        score += ROW_SCORE[row]
+    return result, score
+
+
+def move_board(board, direction):
+    # direction: 0=up, 1=right, 2=down, 3=left
+    # Returns the new board and the score gained by the move
+    if direction == 3:
+        return _apply_rows(board, ROW_LEFT)
+    if direction == 1:
+        return _apply_rows(board, ROW_RIGHT)
+
+    # Up and down are left and right moves on the transposed board
+    table = ROW_LEFT if direction == 0 else ROW_RIGHT
+    result, score = _apply_rows(transpose(board), table)
+    return transpose(result), score
+
+
+def empty_cells(board):
+    # Cell indices (y * 4 + x) of all empty cells, in row-major order
+    return [i for i in range(GRID_SIZE * GRID_SIZE) if not (board >> (4 * i)) & 0xF]
+
+
+def count_empty(board):
+    # Fold each nibble onto its lowest bit, then count the occupied cells
+    occupied = board | (board >> 1)
+    occupied |= occupied >> 2
+    occupied &= 0x1111111111111111
+    return GRID_SIZE * GRID_SIZE - bin(occupied).count("1")
+
+
+def max_exponent(board):
+    highest = 0
+    while board:
+        highest = max(highest, board & 0xF)
+        board >>= 4
+    return highest
+
+
+def board_to_grid(board):
+    grid = []
+    for y in range(GRID_SIZE):
+        row = []
+        for x in range(GRID_SIZE):
+            exponent = (board >> (4 * (y * GRID_SIZE + x))) & 0xF
+            row.append(1 << exponent if exponent else 0)
+        grid.append(row)
+    return grid
+
+
+def grid_to_board(grid):
+    board = 0
+    for y in range(GRID_SIZE):
+        for x in range(GRID_SIZE):
+            value = grid[y][x]
+            if value:
+                exponent = value.bit_length() - 1
+                if exponent > MAX_EXPONENT:
+                    raise ValueError(f"Tile {value} does not fit in a 4-bit cell")
+                board |= exponent << (4 * (y * GRID_SIZE + x))
+    return board
+
+
+class BitboardGame2048(Game2048):
+    # Game2048 backed by a packed 64-bit board. The grid attribute is derived
+    # from the bitboard on access, so the renderer keeps working unchanged.
+
+    @property
+    def grid(self):
+        return board_to_grid(self.board)
+
+    @grid.setter
+    def grid(self, grid):
+        self.board = grid_to_board(grid)
+
+    def reset_game(self, seed=None):
+        if seed is not None:
+            self.seed = game_seed(seed)
+            self.random.seed(seed)
+
+        self.board = 0
+        self.score = 0
+        self.game_over = False
+        self.won = False
+
+        # Add two initial tiles
+        self.add_new_tile()
+        self.add_new_tile()
+
+    def add_new_tile(self):
+        # Same choice order and probabilities as Game2048.add_new_tile
+        cells = empty_cells(self.board)
+        if cells:
+            index = self.random.choice(cells)
+            exponent = 1 if self.random.random() < 0.9 else 2
+            self.board |= exponent << (4 * index)
+            return True
+        return False
+
+    def move(self, direction):
+        new_board, score_increase = move_board(self.board, direction)
+        if new_board == self.board:
+            return False
+
+        self.board = new_board
+        self.score += score_increase
+        self.add_new_tile()
+
+        # Check for win condition
+        if self.check_win():
+            self.won = True
+
+        # Check for game over
+        if self.check_game_over():
+            self.game_over = True
+
+        return True
+
+    def check_win(self):
+        # Check if a 2048 tile (exponent 11) exists
+        board = self.board
+        while board:
+            if board & 0xF == 11:
+                return True
+            board >>= 4
+        return False
+
+    def check_game_over(self):
+        if count_empty(self.board):
+            return False
+        return all(move_board(self.board, d)[0] == self.board for d in range(4))
+
+
+if __name__ == "__main__":
+    game = BitboardGame2048()
+    game.run()
@@ -1,10 +1,9 @@
 import pygame
 import random
 import sys
-import time
 
-# Initialize pygame
-pygame.init()
+from dirty_rects import DirtyRegions
+from replay import FRAME_TIME, Replay, game_seed
 
 # Colors
 BLACK = (0, 0, 0)
@@ -25,6 +24,7 @@ SIDEBAR_WIDTH = 250
 # Screen dimensions
 SCREEN_WIDTH = BLOCK_SIZE * GRID_WIDTH + SIDEBAR_WIDTH
 SCREEN_HEIGHT = BLOCK_SIZE * GRID_HEIGHT
+SIDEBAR_RECT = (GRID_WIDTH * BLOCK_SIZE, 0, SIDEBAR_WIDTH, SCREEN_HEIGHT)
 
 # Cell types
 EMPTY = 0
@@ -32,6 +32,13 @@ HAND = 1
 SQUIRREL = 2
 NUT = 3  # Followed by value (1, 2, 4, 8, etc.)
 
+def cell_key(cell):
+    # What a cell looks like; cells are shared dicts whose values change in
+    # place, so the dirty tracker compares copies of their contents
+    if cell is None or cell == EMPTY:
+        return None
+    return (cell['type'], cell.get('value'))
+
 # Load emoji images
 def load_emoji(filename, size=(BLOCK_SIZE-4, BLOCK_SIZE-4)):
     try:
@@ -107,20 +114,37 @@ SHAPES = [
 ]
 
 class HandsAndSquirrels:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("Hands and Squirrels")
-        self.clock = pygame.time.Clock()
-        self.fonts = {
-            'small': pygame.font.SysFont('Arial', 16),
-            'medium': pygame.font.SysFont('Arial', 24),
-            'large': pygame.font.SysFont('Arial', 32),
-            'xlarge': pygame.font.SysFont('Arial', 48)
-        }
+    def __init__(self, headless=False, seed=None):
+        self.headless = headless
+        # Per-game generator, so a seed reproduces the piece sequence. The
+        # seed is kept so a recorded session can be replayed.
+        self.seed = game_seed(seed)
+        self.random = random.Random(self.seed)
+        # Game time advances FRAME_TIME per update(), not with the wall clock
+        self.frame = 0
+        if not headless:
+            # Initialize pygame
+            pygame.init()
+            
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            pygame.display.set_caption("Hands and Squirrels")
+            self.clock = pygame.time.Clock()
+            self.fonts = {
+                'small': pygame.font.SysFont('Arial', 16),
+                'medium': pygame.font.SysFont('Arial', 24),
+                'large': pygame.font.SysFont('Arial', 32),
+                'xlarge': pygame.font.SysFont('Arial', 48)
+            }
+            self.dirty = DirtyRegions(self.screen, self.draw_background)
         
         self.reset_game()
 
-    def reset_game(self):
+    def reset_game(self, seed=None):
+        # A seed restarts the piece sequence; otherwise the stream continues
+        if seed is not None:
+            self.seed = game_seed(seed)
+            self.random.seed(seed)
+        
         # Initialize grid with empty cells
         self.grid = [[EMPTY for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
         self.current_piece = self.new_piece()
@@ -131,13 +155,13 @@ class HandsAndSquirrels:
         self.rows_cleared = 0
         self.fall_time = 0
         self.fall_speed = 0.5  # Time in seconds between automatic piece movements
-        self.last_fall_time = time.time()
+        self.last_fall_time = self.frame * FRAME_TIME
         self.max_nut_value = 1
         self.squirrels_used = 0
 
     def new_piece(self):
         # Choose a random shape
-        shape_idx = random.randint(0, len(SHAPES) - 1)
+        shape_idx = self.random.randint(0, len(SHAPES) - 1)
         shape = [row[:] for row in SHAPES[shape_idx]]  # Deep copy
         
         # Starting position
@@ -391,33 +415,22 @@ class HandsAndSquirrels:
             self.screen.blit(text, text_rect)
 
     def draw_grid(self):
-        # Draw the game grid
+        # Draw the cells that changed, with the falling piece on top
+        piece_cells = {}
+        if not self.game_over:
+            piece = self.current_piece
+            for y, row in enumerate(piece['shape']):
+                for x, cell in enumerate(row):
+                    if cell is not None:
+                        piece_cells[(piece['x'] + x, piece['y'] + y)] = cell
+        
         for y in range(GRID_HEIGHT):
+            row = self.grid[y]
             for x in range(GRID_WIDTH):
-                # Draw grid cell
-                pygame.draw.rect(
-                    self.screen,
-                    DARK_GRAY,
-                    [x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE],
-                    1
-                )
-                
-                # If cell is occupied, draw the piece
-                if self.grid[y][x] != EMPTY:
-                    self.draw_cell(x, y, self.grid[y][x])
-
-    def draw_current_piece(self):
-        # Draw the current piece
-        for y, row in enumerate(self.current_piece['shape']):
-            for x, cell in enumerate(row):
-                if cell is not None:
-                    # Only draw if the cell is within the visible grid
-                    if self.current_piece['y'] + y >= 0:
-                        self.draw_cell(
-                            self.current_piece['x'] + x,
-                            self.current_piece['y'] + y,
-                            cell
-                        )
+                cell = piece_cells.get((x, y), row[x])
+                if self.dirty.changed((x, y), cell_key(cell), (x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)) \
+                        and cell != EMPTY:
+                    self.draw_cell(x, y, cell)
 
     def draw_next_piece(self):
         # Draw the next piece in the sidebar
@@ -449,60 +462,41 @@ class HandsAndSquirrels:
                                                          next_y + y * BLOCK_SIZE + BLOCK_SIZE // 2))
                         self.screen.blit(text, text_rect)
 
-    def draw_sidebar(self):
-        # Draw sidebar background
-        pygame.draw.rect(
-            self.screen,
-            (50, 50, 50),
-            [GRID_WIDTH * BLOCK_SIZE, 0, SIDEBAR_WIDTH, SCREEN_HEIGHT]
-        )
+    def draw_background(self, surface):
+        # Static layer: cell outlines, sidebar panel and the fixed sidebar text
+        surface.fill(BLACK)
+        for y in range(GRID_HEIGHT):
+            for x in range(GRID_WIDTH):
+                pygame.draw.rect(surface, DARK_GRAY, [x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE], 1)
+        pygame.draw.rect(surface, (50, 50, 50), SIDEBAR_RECT)
         
         # Draw game title
         title_text = self.fonts['large'].render("Hands & Squirrels", True, WHITE)
-        self.screen.blit(title_text, (GRID_WIDTH * BLOCK_SIZE + 10, 10))
-        
-        # Draw score
-        score_text = self.fonts['medium'].render(f"Score: {self.score}", True, WHITE)
-        self.screen.blit(score_text, (GRID_WIDTH * BLOCK_SIZE + 10, 60))
-        
-        # Draw level
-        level_text = self.fonts['medium'].render(f"Level: {self.level}", True, WHITE)
-        self.screen.blit(level_text, (GRID_WIDTH * BLOCK_SIZE + 10, 90))
+        surface.blit(title_text, (GRID_WIDTH * BLOCK_SIZE + 10, 10))
         
         # Draw next piece text
         next_text = self.fonts['medium'].render("Next:", True, WHITE)
-        self.screen.blit(next_text, (GRID_WIDTH * BLOCK_SIZE + 10, 120))
-        
-        # Draw the next piece
-        self.draw_next_piece()
-        
-        # Draw max nut value
-        max_nut_text = self.fonts['medium'].render(f"Max Nut: {self.max_nut_value}", True, WHITE)
-        self.screen.blit(max_nut_text, (GRID_WIDTH * BLOCK_SIZE + 10, 250))
-        
-        # Draw squirrels used
-        squirrels_text = self.fonts['medium'].render(f"Squirrels Used: {self.squirrels_used}", True, WHITE)
-        self.screen.blit(squirrels_text, (GRID_WIDTH * BLOCK_SIZE + 10, 280))
+        surface.blit(next_text, (GRID_WIDTH * BLOCK_SIZE + 10, 120))
         
         # Draw legend
         legend_y = 330
         
         # Hand legend
-        self.screen.blit(HAND_IMG, (GRID_WIDTH * BLOCK_SIZE + 10, legend_y))
+        surface.blit(HAND_IMG, (GRID_WIDTH * BLOCK_SIZE + 10, legend_y))
         hand_text = self.fonts['small'].render("Hands - Connect to handshake", True, WHITE)
-        self.screen.blit(hand_text, (GRID_WIDTH * BLOCK_SIZE + 60, legend_y + 10))
+        surface.blit(hand_text, (GRID_WIDTH * BLOCK_SIZE + 60, legend_y + 10))
         
         # Squirrel legend
         legend_y += 60
-        self.screen.blit(SQUIRREL_IMG, (GRID_WIDTH * BLOCK_SIZE + 10, legend_y))
+        surface.blit(SQUIRREL_IMG, (GRID_WIDTH * BLOCK_SIZE + 10, legend_y))
         squirrel_text = self.fonts['small'].render("Squirrels - Reduce nuts", True, WHITE)
-        self.screen.blit(squirrel_text, (GRID_WIDTH * BLOCK_SIZE + 60, legend_y + 10))
+        surface.blit(squirrel_text, (GRID_WIDTH * BLOCK_SIZE + 60, legend_y + 10))
         
         # Nut legend
         legend_y += 60
-        self.screen.blit(NUT_IMG, (GRID_WIDTH * BLOCK_SIZE + 10, legend_y))
+        surface.blit(NUT_IMG, (GRID_WIDTH * BLOCK_SIZE + 10, legend_y))
         nut_text = self.fonts['small'].render("Nuts - Merge to increase value", True, WHITE)
-        self.screen.blit(nut_text, (GRID_WIDTH * BLOCK_SIZE + 60, legend_y + 10))
+        surface.blit(nut_text, (GRID_WIDTH * BLOCK_SIZE + 60, legend_y + 10))
         
         # Draw game instructions
         instructions = [
@@ -525,8 +519,35 @@ class HandsAndSquirrels:
         y_pos = 500
         for instruction in instructions:
             instr_text = self.fonts['small'].render(instruction, True, WHITE)
-            self.screen.blit(instr_text, (GRID_WIDTH * BLOCK_SIZE + 10, y_pos))
+            surface.blit(instr_text, (GRID_WIDTH * BLOCK_SIZE + 10, y_pos))
             y_pos += 20
+
+    def draw_sidebar(self):
+        # Redrawn only when one of its values changes
+        next_cells = [[cell_key(cell) for cell in row] for row in self.next_piece['shape']]
+        key = (self.score, self.level, next_cells, self.max_nut_value, self.squirrels_used,
+               self.game_over)
+        if not self.dirty.changed('sidebar', key, SIDEBAR_RECT):
+            return
+        
+        # Draw score
+        score_text = self.fonts['medium'].render(f"Score: {self.score}", True, WHITE)
+        self.screen.blit(score_text, (GRID_WIDTH * BLOCK_SIZE + 10, 60))
+        
+        # Draw level
+        level_text = self.fonts['medium'].render(f"Level: {self.level}", True, WHITE)
+        self.screen.blit(level_text, (GRID_WIDTH * BLOCK_SIZE + 10, 90))
+        
+        # Draw the next piece
+        self.draw_next_piece()
+        
+        # Draw max nut value
+        max_nut_text = self.fonts['medium'].render(f"Max Nut: {self.max_nut_value}", True, WHITE)
+        self.screen.blit(max_nut_text, (GRID_WIDTH * BLOCK_SIZE + 10, 250))
+        
+        # Draw squirrels used
+        squirrels_text = self.fonts['medium'].render(f"Squirrels Used: {self.squirrels_used}", True, WHITE)
+        self.screen.blit(squirrels_text, (GRID_WIDTH * BLOCK_SIZE + 10, 280))
         
         # Draw game over text if game is over
         if self.game_over:
@@ -537,65 +558,75 @@ class HandsAndSquirrels:
             self.screen.blit(restart_text, (GRID_WIDTH * BLOCK_SIZE + 10, 840))
 
     def draw(self):
-        # Draw everything
-        self.screen.fill(BLACK)
+        # Draw what changed since the last frame
+        self.dirty.begin()
         self.draw_grid()
-        if not self.game_over:
-            self.draw_current_piece()
         self.draw_sidebar()
 
-    def run(self):
+    def handle_key(self, key):
+        # Apply one key press; run() and replays both go through here
+        if not self.game_over:
+            if key == pygame.K_LEFT:
+                if self.valid_move(self.current_piece, x_offset=-1):
+                    self.current_piece['x'] -= 1
+            elif key == pygame.K_RIGHT:
+                if self.valid_move(self.current_piece, x_offset=1):
+                    self.current_piece['x'] += 1
+            elif key == pygame.K_DOWN:
+                if self.valid_move(self.current_piece, y_offset=1):
+                    self.current_piece['y'] += 1
+                else:
+                    self.lock_piece(self.current_piece)
+            elif key == pygame.K_UP:
+                self.current_piece = self.rotate_piece(self.current_piece)
+            elif key == pygame.K_SPACE:
+                # Hard drop
+                while self.valid_move(self.current_piece, y_offset=1):
+                    self.current_piece['y'] += 1
+                self.lock_piece(self.current_piece)
+        elif key == pygame.K_r:
+            self.reset_game()
+
+    def update(self):
+        # Advance the game by one frame
+        current_time = self.frame * FRAME_TIME
+        
+        # Automatic falling
+        if not self.game_over and current_time - self.last_fall_time > self.fall_speed:
+            if self.valid_move(self.current_piece, y_offset=1):
+                self.current_piece['y'] += 1
+            else:
+                self.lock_piece(self.current_piece)
+            self.last_fall_time = current_time
+        
+        self.frame += 1
+
+    def run(self, replay_path=None):
+        # Every key press is recorded; the replay is saved to replay_path on exit
+        replay = Replay(self.seed)
         running = True
         
         while running:
-            current_time = time.time()
-            
             # Handle events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
-                
-                if not self.game_over:
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_LEFT:
-                            if self.valid_move(self.current_piece, x_offset=-1):
-                                self.current_piece['x'] -= 1
-                        elif event.key == pygame.K_RIGHT:
-                            if self.valid_move(self.current_piece, x_offset=1):
-                                self.current_piece['x'] += 1
-                        elif event.key == pygame.K_DOWN:
-                            if self.valid_move(self.current_piece, y_offset=1):
-                                self.current_piece['y'] += 1
-                            else:
-                                self.lock_piece(self.current_piece)
-                        elif event.key == pygame.K_UP:
-                            self.current_piece = self.rotate_piece(self.current_piece)
-                        elif event.key == pygame.K_SPACE:
-                            # Hard drop
-                            while self.valid_move(self.current_piece, y_offset=1):
-                                self.current_piece['y'] += 1
-                            self.lock_piece(self.current_piece)
-                else:
-                    if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
-                        self.reset_game()
+                elif event.type == pygame.KEYDOWN:
+                    replay.record(self.frame, event.key)
+                    self.handle_key(event.key)
             
-            # Automatic falling
-            if not self.game_over and current_time - self.last_fall_time > self.fall_speed:
-                if self.valid_move(self.current_piece, y_offset=1):
-                    self.current_piece['y'] += 1
-                else:
-                    self.lock_piece(self.current_piece)
-                self.last_fall_time = current_time
+            self.update()
             
-            # Draw everything
+            # Draw what changed and push only those areas to the display
             self.draw()
-            
-            # Update the display
-            pygame.display.flip()
+            self.dirty.present()
             
             # Cap the frame rate
             self.clock.tick(60)
         
+        if replay_path is not None:
+            replay.frames = self.frame
+            replay.save(replay_path)
         pygame.quit()
         sys.exit()
 
@@ -1,10 +1,10 @@
 import pygame
 import random
-import time
 import sys
+from collections import deque
 
-# Initialize pygame
-pygame.init()
+from dirty_rects import DirtyRegions
+from replay import FRAME_TIME, Replay, game_seed
 
 # Colors
 BLACK = (0, 0, 0)
@@ -26,21 +26,64 @@ SIDEBAR_WIDTH = 200
 # Screen dimensions
 SCREEN_WIDTH = BLOCK_SIZE * GRID_WIDTH + SIDEBAR_WIDTH
 SCREEN_HEIGHT = BLOCK_SIZE * GRID_HEIGHT
+SIDEBAR_RECT = (GRID_WIDTH * BLOCK_SIZE, 0, SIDEBAR_WIDTH, SCREEN_HEIGHT)
 
 # Puyo colors
 PUYO_COLORS = [RED, GREEN, BLUE, YELLOW, PURPLE]
 
+# Seconds each chain link stays on screen
+CHAIN_FRAME_TIME = 0.3
+
+# Flat cell indexing (index = y * GRID_WIDTH + x) used by the match search
+CELL_COUNT = GRID_WIDTH * GRID_HEIGHT
+CELL_X = tuple(i % GRID_WIDTH for i in range(CELL_COUNT))
+CELL_Y = tuple(i // GRID_WIDTH for i in range(CELL_COUNT))
+
+def build_neighbors():
+    # Precompute the orthogonal neighbors of every cell
+    neighbors = []
+    for y in range(GRID_HEIGHT):
+        for x in range(GRID_WIDTH):
+            cell = []
+            for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT:
+                    cell.append(ny * GRID_WIDTH + nx)
+            neighbors.append(tuple(cell))
+    return tuple(neighbors)
+
+NEIGHBORS = build_neighbors()
+
 class PuyoPuyo:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("Puyo Puyo")
-        self.clock = pygame.time.Clock()
-        self.font = pygame.font.SysFont('Arial', 25)
+    def __init__(self, headless=False, seed=None):
+        self.headless = headless
+        # Per-game generator, so a seed reproduces the piece sequence. The
+        # seed is kept so a recorded session can be replayed.
+        self.seed = game_seed(seed)
+        self.random = random.Random(self.seed)
+        # Game time advances FRAME_TIME per update(), not with the wall clock
+        self.frame = 0
+        if not headless:
+            # Initialize pygame
+            pygame.init()
+            
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            pygame.display.set_caption("Puyo Puyo")
+            self.clock = pygame.time.Clock()
+            self.font = pygame.font.SysFont('Arial', 25)
+            self.dirty = DirtyRegions(self.screen, self.draw_background)
+        
         self.reset_game()
 
-    def reset_game(self):
+    def reset_game(self, seed=None):
+        # A seed restarts the piece sequence; otherwise the stream continues
+        if seed is not None:
+            self.seed = game_seed(seed)
+            self.random.seed(seed)
+        
         # Initialize grid with zeros (empty cells)
         self.grid = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+        self.allocate_buffers()
         self.current_pair = self.new_pair()
         self.next_pair = self.new_pair()
         self.game_over = False
@@ -48,13 +91,17 @@ class PuyoPuyo:
         self.chain_count = 0
         self.fall_time = 0
         self.fall_speed = 0.5  # Time in seconds between automatic piece movements
-        self.last_fall_time = time.time()
+        self.last_fall_time = self.frame * FRAME_TIME
         self.rotation_state = 0  # 0: main above, 1: main right, 2: main below, 3: main left
+        
+        # Boards to show for each chain link, played back by run()
+        self.animation_queue = deque()
+        self.frame_start_time = None
 
     def new_pair(self):
         # Create a new pair of Puyos
-        main_color = random.choice(PUYO_COLORS)
-        sub_color = random.choice(PUYO_COLORS)
+        main_color = self.random.choice(PUYO_COLORS)
+        sub_color = self.random.choice(PUYO_COLORS)
         
         # Starting position (center top)
         x = GRID_WIDTH // 2 - 1
@@ -65,6 +112,14 @@ class PuyoPuyo:
             'sub': {'x': x, 'y': y - 1, 'color': sub_color}
         }
 
+    def allocate_buffers(self):
+        # Scratch buffers for the match search, reused across chain steps.
+        # A cell counts as visited when its mark equals the current pass mark,
+        # so starting a new pass never has to clear the buffer.
+        self.visit_marks = [0] * CELL_COUNT
+        self.visit_mark = 0
+        self.group = [0] * CELL_COUNT
+
     def rotate_pair(self, direction):
         # Rotate the current pair (clockwise or counterclockwise)
         main_x = self.current_pair['main']['x']
@@ -149,21 +204,23 @@ class PuyoPuyo:
         return False
 
     def lock_pair(self):
-        # Lock the current pair in place
+        # Lock the current pair in place; returns the chain events
         main = self.current_pair['main']
         sub = self.current_pair['sub']
         
-        # Add main puyo to grid if it's within bounds
-        if 0 <= main['y'] < GRID_HEIGHT:
-            self.grid[main['y']][main['x']] = main['color']
-        
-        # Add sub puyo to grid if it's within bounds
-        if 0 <= sub['y'] < GRID_HEIGHT:
-            self.grid[sub['y']][sub['x']] = sub['color']
+        # Add the puyos that are within bounds to the grid
+        placed = []
+        dirty_columns = {}
+        for puyo in (main, sub):
+            if 0 <= puyo['y'] < GRID_HEIGHT:
+                self.grid[puyo['y']][puyo['x']] = puyo['color']
+                placed.append(puyo['y'] * GRID_WIDTH + puyo['x'])
+                # The pair can hang over empty cells, so settle the whole column
+                dirty_columns[puyo['x']] = GRID_HEIGHT - 1
         
-        # Apply gravity and check for matches
-        self.apply_gravity()
-        self.check_matches()
+        # Apply gravity and check for matches around the new puyos
+        falls = self.apply_gravity(dirty_columns)
+        events = self.check_matches(placed + [to_y * GRID_WIDTH + x for x, _, to_y in falls])
         
         # Get next pair
         self.current_pair = self.next_pair
@@ -174,88 +231,135 @@ class PuyoPuyo:
         if not self.is_valid_position(self.current_pair['main']['x'], self.current_pair['main']['y']) or \
            not self.is_valid_position(self.current_pair['sub']['x'], self.current_pair['sub']['y']):
             self.game_over = True
+        
+        return events
 
-    def apply_gravity(self):
-        # Apply gravity to make puyos fall
-        for x in range(GRID_WIDTH):
-            # Start from the bottom and move up
+    def apply_gravity(self, dirty_columns=None):
+        # Apply gravity to make puyos fall. dirty_columns maps a column to the
+        # lowest row that changed; everything below it is already settled.
+        # None settles the whole board. Returns the falls as (x, from_y, to_y).
+        if dirty_columns is None:
+            dirty_columns = dict.fromkeys(range(GRID_WIDTH), GRID_HEIGHT - 1)
+        falls = []
+        for x, bottom in dirty_columns.items():
+            # Start from the lowest changed row and move up
             empty_y = None
-            for y in range(GRID_HEIGHT - 1, -1, -1):
+            for y in range(bottom, -1, -1):
                 if self.grid[y][x] == 0 and empty_y is None:
                     empty_y = y
                 elif self.grid[y][x] != 0 and empty_y is not None:
                     # Move puyo down
                     self.grid[empty_y][x] = self.grid[y][x]
                     self.grid[y][x] = 0
+                    falls.append((x, y, empty_y))
                     empty_y -= 1
+        return falls
 
-    def check_matches(self):
-        # Check for matches (4+ same color connected)
+    def check_matches(self, seeds=None):
+        # Check for matches (4+ same color connected). The board was stable
+        # before the last change, so only a group containing a cell that was
+        # just placed or just fell can have grown to 4. The search starts
+        # from those seed cells only; None searches the whole board.
+        # The chain resolves immediately. Returns one event per link with the
+        # popped puyos, the falls, the score gained and the resulting board.
+        events = []
         chain_count = 0
+        visit_marks = self.visit_marks
+        group = self.group
         while True:
-            matches_found = False
-            visited = [[False for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+            pops = []
+            points = 0
+            dirty_columns = {}
+            self.visit_mark += 1
+            mark = self.visit_mark
             
-            for y in range(GRID_HEIGHT):
-                for x in range(GRID_WIDTH):
-                    if self.grid[y][x] != 0 and not visited[y][x]:
-                        # Find all connected puyos of the same color
-                        color = self.grid[y][x]
-                        connected = []
-                        self.find_connected(x, y, color, visited, connected)
+            for start in (range(CELL_COUNT) if seeds is None else seeds):
+                color = self.grid[CELL_Y[start]][CELL_X[start]]
+                if color != 0 and visit_marks[start] != mark:
+                    # Find all connected puyos of the same color
+                    size = self.find_connected(start, color, mark)
+                    
+                    # If 4 or more connected, remove them
+                    if size >= 4:
+                        for k in range(size):
+                            cx = CELL_X[group[k]]
+                            cy = CELL_Y[group[k]]
+                            pops.append((cx, cy, color))
+                            self.grid[cy][cx] = 0
+                            if cy > dirty_columns.get(cx, -1):
+                                dirty_columns[cx] = cy
                         
-                        # If 4 or more connected, remove them
-                        if len(connected) >= 4:
-                            matches_found = True
-                            for cx, cy in connected:
-                                self.grid[cy][cx] = 0
-                            
-                            # Add score based on number of puyos popped
-                            self.score += len(connected) * 10 * (chain_count + 1)
+                        # Add score based on number of puyos popped
+                        points += size * 10 * (chain_count + 1)
             
-            if matches_found:
-                chain_count += 1
-                self.apply_gravity()
-                # Add a small delay to show the chain reaction
-                self.draw()
-                pygame.display.flip()
-                pygame.time.delay(300)
-            else:
+            if not pops:
                 break
+            
+            chain_count += 1
+            self.score += points
+            falls = self.apply_gravity(dirty_columns)
+            events.append({
+                'chain': chain_count,
+                'pops': pops,
+                'falls': falls,
+                'score': points,
+                'grid': [row[:] for row in self.grid]
+            })
+            
+            # Only the puyos that fell can start the next link of the chain
+            seeds = [to_y * GRID_WIDTH + x for x, _, to_y in falls]
         
         if chain_count > 0:
             self.chain_count = max(self.chain_count, chain_count)
+        return events
 
-    def find_connected(self, x, y, color, visited, connected):
-        # Find all connected puyos of the same color using DFS
-        if (x < 0 or x >= GRID_WIDTH or y < 0 or y >= GRID_HEIGHT or 
-            visited[y][x] or self.grid[y][x] != color):
-            return
-        
-        visited[y][x] = True
-        connected.append((x, y))
+    def find_connected(self, start, color, mark):
+        # Find all connected puyos of the same color with an iterative search.
+        # The group buffer doubles as the work queue: cells before head are
+        # done, cells between head and size are still to be expanded.
+        # Returns the group size; the cell indices are group[:size].
+        grid = self.grid
+        visit_marks = self.visit_marks
+        group = self.group
         
-        # Check all four directions
-        self.find_connected(x + 1, y, color, visited, connected)
-        self.find_connected(x - 1, y, color, visited, connected)
-        self.find_connected(x, y + 1, color, visited, connected)
-        self.find_connected(x, y - 1, color, visited, connected)
+        visit_marks[start] = mark
+        group[0] = start
+        head = 0
+        size = 1
+        while head < size:
+            for neighbor in NEIGHBORS[group[head]]:
+                if visit_marks[neighbor] != mark and grid[CELL_Y[neighbor]][CELL_X[neighbor]] == color:
+                    visit_marks[neighbor] = mark
+                    group[size] = neighbor
+                    size += 1
+            head += 1
+        return size
 
-    def draw_grid(self):
-        # Draw the game grid
+    def draw_background(self, surface):
+        # Static layer: cell outlines and sidebar panel
+        surface.fill(BLACK)
         for y in range(GRID_HEIGHT):
             for x in range(GRID_WIDTH):
-                # Draw grid cell
-                pygame.draw.rect(
-                    self.screen,
-                    GRAY,
-                    [x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE],
-                    1
-                )
-                
-                # If cell is occupied, draw the puyo
-                if self.grid[y][x] != 0:
-                    self.draw_puyo(x, y, self.grid[y][x])
+                pygame.draw.rect(surface, GRAY, [x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE], 1)
+        pygame.draw.rect(surface, (50, 50, 50), SIDEBAR_RECT)
+
+    def draw_grid(self, grid=None, pair=None):
+        # Draw the cells of the game grid (or a board from the chain
+        # animation) whose puyo changed, with the falling pair on top
+        if grid is None:
+            grid = self.grid
+        pair_cells = {}
+        if pair is not None:
+            for puyo in pair.values():
+                pair_cells[(puyo['x'], puyo['y'])] = puyo['color']
+        
+        for y in range(GRID_HEIGHT):
+            row = grid[y]
+            for x in range(GRID_WIDTH):
+                color = pair_cells.get((x, y), row[x])
+                if self.dirty.changed((x, y), color, (x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)) \
+                        and color != 0:
+                    self.draw_puyo(x, y, color)
 
     def draw_puyo(self, x, y, color):
         # Draw a puyo at the specified position
@@ -273,17 +377,6 @@ class PuyoPuyo:
             BLOCK_SIZE // 6
         )
 
-    def draw_current_pair(self):
-        # Draw the current pair of puyos
-        main = self.current_pair['main']
-        sub = self.current_pair['sub']
-        
-        # Only draw if they're within the visible grid
-        if main['y'] >= 0:
-            self.draw_puyo(main['x'], main['y'], main['color'])
-        if sub['y'] >= 0:
-            self.draw_puyo(sub['x'], sub['y'], sub['color'])
-
     def draw_next_pair(self):
         # Draw the next pair in the sidebar
         next_x = GRID_WIDTH * BLOCK_SIZE + SIDEBAR_WIDTH // 2
@@ -317,12 +410,11 @@ class PuyoPuyo:
         )
 
     def draw_sidebar(self):
-        # Draw sidebar background
-        pygame.draw.rect(
-            self.screen,
-            (50, 50, 50),
-            [GRID_WIDTH * BLOCK_SIZE, 0, SIDEBAR_WIDTH, SCREEN_HEIGHT]
-        )
+        # Redrawn only when one of its values changes
+        next_colors = (self.next_pair['main']['color'], self.next_pair['sub']['color'])
+        if not self.dirty.changed('sidebar', (self.score, self.chain_count, next_colors, self.game_over),
+                                  SIDEBAR_RECT):
+            return
         
         # Draw score
         score_text = self.font.render(f"Score: {self.score}", True, WHITE)
@@ -348,61 +440,100 @@ class PuyoPuyo:
             self.screen.blit(restart_text, (GRID_WIDTH * BLOCK_SIZE + 10, 290))
 
     def draw(self):
-        # Draw everything
-        self.screen.fill(BLACK)
-        self.draw_grid()
-        if not self.game_over:
-            self.draw_current_pair()
+        # Draw what changed since the last frame
+        self.dirty.begin()
+        if self.animation_queue:
+            # The next pair waits until the chain has been shown
+            self.draw_grid(self.animation_queue[0])
+        else:
+            self.draw_grid(pair=None if self.game_over else self.current_pair)
         self.draw_sidebar()
 
-    def run(self):
+    def queue_chain_animation(self, events):
+        # Queue the board after each chain link for playback by run()
+        for event in events:
+            self.animation_queue.append(event['grid'])
+
+    def update_animation(self, current_time):
+        # Advance the chain animation by one frame; returns True while it plays
+        if not self.animation_queue:
+            return False
+        if self.frame_start_time is None:
+            self.frame_start_time = current_time
+        elif current_time - self.frame_start_time >= CHAIN_FRAME_TIME:
+            self.animation_queue.popleft()
+            self.frame_start_time = current_time if self.animation_queue else None
+        if not self.animation_queue:
+            # Give the next pair a full fall interval once the chain is over
+            self.last_fall_time = current_time
+            return False
+        return True
+
+    def handle_key(self, key):
+        # Apply one key press; run() and replays both go through here
+        if self.animation_queue:
+            # Controls resume once the chain has been shown
+            return
+        
+        if not self.game_over:
+            if key == pygame.K_LEFT:
+                self.move_pair(-1, 0)
+            elif key == pygame.K_RIGHT:
+                self.move_pair(1, 0)
+            elif key == pygame.K_DOWN:
+                if not self.move_pair(0, 1):
+                    self.queue_chain_animation(self.lock_pair())
+            elif key == pygame.K_z:
+                self.rotate_pair('counterclockwise')
+            elif key == pygame.K_x or key == pygame.K_UP:
+                self.rotate_pair('clockwise')
+            elif key == pygame.K_SPACE:
+                # Hard drop
+                while self.move_pair(0, 1):
+                    pass
+                self.queue_chain_animation(self.lock_pair())
+        elif key == pygame.K_r:
+            self.reset_game()
+
+    def update(self):
+        # Advance the game by one frame
+        current_time = self.frame * FRAME_TIME
+        animating = self.update_animation(current_time)
+        
+        # Automatic falling
+        if not animating and not self.game_over and current_time - self.last_fall_time > self.fall_speed:
+            if not self.move_pair(0, 1):
+                self.queue_chain_animation(self.lock_pair())
+            self.last_fall_time = current_time
+        
+        self.frame += 1
+
+    def run(self, replay_path=None):
+        # Every key press is recorded; the replay is saved to replay_path on exit
+        replay = Replay(self.seed)
         running = True
         
         while running:
-            current_time = time.time()
-            
             # Handle events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
-                
-                if not self.game_over:
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_LEFT:
-                            self.move_pair(-1, 0)
-                        elif event.key == pygame.K_RIGHT:
-                            self.move_pair(1, 0)
-                        elif event.key == pygame.K_DOWN:
-                            if not self.move_pair(0, 1):
-                                self.lock_pair()
-                        elif event.key == pygame.K_z:
-                            self.rotate_pair('counterclockwise')
-                        elif event.key == pygame.K_x or event.key == pygame.K_UP:
-                            self.rotate_pair('clockwise')
-                        elif event.key == pygame.K_SPACE:
-                            # Hard drop
-                            while self.move_pair(0, 1):
-                                pass
-                            self.lock_pair()
-                else:
-                    if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
-                        self.reset_game()
+                elif event.type == pygame.KEYDOWN:
+                    replay.record(self.frame, event.key)
+                    self.handle_key(event.key)
             
-            # Automatic falling
-            if not self.game_over and current_time - self.last_fall_time > self.fall_speed:
-                if not self.move_pair(0, 1):
-                    self.lock_pair()
-                self.last_fall_time = current_time
+            self.update()
             
-            # Draw everything
+            # Draw what changed and push only those areas to the display
             self.draw()
-            
-            # Update the display
-            pygame.display.flip()
+            self.dirty.present()
             
             # Cap the frame rate
             self.clock.tick(60)
         
+        if replay_path is not None:
+            replay.frames = self.frame
+            replay.save(replay_path)
         pygame.quit()
         sys.exit()
 
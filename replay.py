@@ -0,0 +1,121 @@
+import random
+
+# Game logic advances in fixed frames so a session can be replayed exactly
+FPS = 60
+FRAME_TIME = 1 / FPS
+
+# File layout: MAGIC, then unsigned LEB128 varints: seed, frame count,
+# event count, and per event the frames since the previous event followed
+# by the key code
+MAGIC = b"RPLY\x01"
+
+
+def new_seed():
+    # Seed for games started without one, so their replays can still be saved
+    return random.getrandbits(64)
+
+
+def game_seed(seed=None):
+    # The seed a game is started or restarted with: a fresh one for None,
+    # otherwise seed itself. Replays store it as an unsigned varint, so
+    # anything but a non-negative int is refused here rather than when the
+    # session is saved.
+    if seed is None:
+        return new_seed()
+    if isinstance(seed, bool) or not isinstance(seed, int):
+        raise TypeError(f"seed must be an int, not {type(seed).__name__}")
+    if seed < 0:
+        raise ValueError("seed must not be negative")
+    return seed
+
+
+def write_varint(out, value):
+    if value < 0:
+        raise ValueError("replay values must not be negative")
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, position):
+    # Returns the value and the position after it
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError("truncated replay")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+class Replay:
+    # A session stored as the game's seed plus every key press, stamped with
+    # the frame it happened in. Everything else follows from the game rules.
+
+    def __init__(self, seed, events=None, frames=0):
+        self.seed = seed
+        self.events = events if events is not None else []  # (frame, key)
+        self.frames = frames  # Frames the session lasted
+
+    def record(self, frame, key):
+        self.events.append((frame, key))
+
+    def to_bytes(self):
+        out = bytearray(MAGIC)
+        write_varint(out, self.seed)
+        write_varint(out, self.frames)
+        write_varint(out, len(self.events))
+        previous = 0
+        for frame, key in self.events:
+            write_varint(out, frame - previous)
+            write_varint(out, key)
+            previous = frame
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data.startswith(MAGIC):
+            raise ValueError("not a replay file")
+        position = len(MAGIC)
+        seed, position = read_varint(data, position)
+        frames, position = read_varint(data, position)
+        count, position = read_varint(data, position)
+        events = []
+        frame = 0
+        for _ in range(count):
+            delta, position = read_varint(data, position)
+            key, position = read_varint(data, position)
+            frame += delta
+            events.append((frame, key))
+        return cls(seed, events, frames)
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
+
+
+def play_replay(game_class, replay, **options):
+    # Replays a session in a headless game at full speed and returns the
+    # game in its final state. The game must provide handle_key(key) and
+    # update(), the same calls its run() makes each frame. Every game takes
+    # headless=True to run only its rules: no pygame window, fonts or
+    # images, and no delays between the steps of a chain.
+    game = game_class(headless=True, seed=replay.seed, **options)
+    events = replay.events
+    index = 0
+    for frame in range(replay.frames):
+        while index < len(events) and events[index][0] == frame:
+            game.handle_key(events[index][1])
+            index += 1
+        game.update()
+    return game
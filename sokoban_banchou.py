@@ -1,16 +1,15 @@
 import pygame
-import sys
 import random
+import sys
 
-# Initialize pygame with audio disabled to avoid ALSA errors
-pygame.init()
-# Disable audio to prevent ALSA errors
-pygame.mixer.quit()
+from dirty_rects import DirtyRegions
+from replay import Replay, game_seed
 
 # Game constants
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 TILE_SIZE = 50
+# Size of generated levels; loaded levels bring their own size
 GRID_WIDTH = 12
 GRID_HEIGHT = 10
 
@@ -36,27 +35,72 @@ YANKEE = 6
 WEAK_PERSON = 7
 WEAPON = 8
 
-# Create a font
-FONT = pygame.font.SysFont('Arial', 24)
-LARGE_FONT = pygame.font.SysFont('Arial', 36)
+# Up, Right, Down, Left
+DIRECTIONS = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+DIRECTION_INDEX = {direction: i for i, direction in enumerate(DIRECTIONS)}
+
+# Undo journal entries are one byte: kind << 3 | had_weapon << 2 | direction.
+# Everything else an undo needs follows from the kind and the current state.
+STEP = 0             # Walked onto an empty cell or target
+PUSH = 1             # Pushed a box
+FIGHT = 2            # Walked into a yankee with a weapon
+BULLY = 3            # Walked into a weak person
+PICK_UP = 4          # Picked up a weapon
+LOSE = 5             # Walked into a yankee without a weapon (no move)
+SMASH_BOX = 6        # Used the weapon on a neighboring box
+SMASH_YANKEE = 7     # Used the weapon on a neighboring yankee
+SMASH_WEAK = 8       # Used the weapon on a neighboring weak person
 
 class SokobanBanchou:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("Sokoban Banchou")
-        self.clock = pygame.time.Clock()
+    def __init__(self, headless=False, level_pack=None, seed=None):
+        self.headless = headless
+        # Per-game generator, so a seed reproduces the generated levels. The
+        # seed is kept so a recorded session can be replayed.
+        self.seed = game_seed(seed)
+        self.random = random.Random(self.seed)
+        self.frame = 0
+        if not headless:
+            # Initialize pygame with audio disabled to avoid ALSA errors
+            pygame.init()
+            pygame.mixer.quit()
+            
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            pygame.display.set_caption("Sokoban Banchou")
+            self.clock = pygame.time.Clock()
+            
+            # Create fonts
+            self.font = pygame.font.SysFont('Arial', 24)
+            self.large_font = pygame.font.SysFont('Arial', 36)
+            
+            # Load images or create placeholders
+            self.images = {
+                WALL: self.create_image(DARK_GRAY),
+                BOX: self.create_image(BROWN),
+                TARGET: self.create_image(GREEN),
+                BOX_ON_TARGET: self.create_image(BLUE),
+                PLAYER: self.create_image(YELLOW),
+                YANKEE: self.create_image(RED),
+                WEAK_PERSON: self.create_image(BLUE),
+                WEAPON: self.create_image(GRAY)
+            }
+            
+            # Only tiles and text that changed are drawn again each frame
+            self.dirty = DirtyRegions(self.screen, self.draw_background)
+            self.view_offset = None
+            self.view_grid = None
+            self.hud_key = None
+            self.hud = []
         
-        # Load images or create placeholders
-        self.images = {
-            WALL: self.create_image(DARK_GRAY),
-            BOX: self.create_image(BROWN),
-            TARGET: self.create_image(GREEN),
-            BOX_ON_TARGET: self.create_image(BLUE),
-            PLAYER: self.create_image(YELLOW),
-            YANKEE: self.create_image(RED),
-            WEAK_PERSON: self.create_image(BLUE),
-            WEAPON: self.create_image(GRAY)
-        }
+        # Levels come from an XSB level pack (a path or LevelPack) when given;
+        # levels past the end of the pack are generated
+        if isinstance(level_pack, str):
+            from sokoban_levels import LevelPack
+            level_pack = LevelPack(level_pack)
+        self.level_pack = level_pack
+        
+        # Pool of generated levels, started by the first level that is not
+        # in the level pack
+        self.level_pool = None
         
         self.reset_game()
 
@@ -67,7 +111,14 @@ class SokobanBanchou:
         pygame.draw.rect(image, BLACK, (0, 0, TILE_SIZE, TILE_SIZE), 1)
         return image
 
-    def reset_game(self):
+    def reset_game(self, seed=None):
+        # A seed restarts the level sequence; otherwise the stream continues
+        if seed is not None:
+            self.seed = game_seed(seed)
+            self.random.seed(seed)
+            if self.level_pool is not None:
+                self.level_pool.clear()
+        
         self.level = 1
         self.score = 1000
         self.has_weapon = False
@@ -81,152 +132,180 @@ class SokobanBanchou:
         self.load_level(self.level)
 
     def load_level(self, level_num):
-        # Create a level based on the level number
-        # This is a simple level generator - you could replace with designed levels
-        self.grid = [[EMPTY for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
-        
-        # Add walls around the edges
-        for x in range(GRID_WIDTH):
-            self.grid[0][x] = WALL
-            self.grid[GRID_HEIGHT-1][x] = WALL
-        for y in range(GRID_HEIGHT):
-            self.grid[y][0] = WALL
-            self.grid[y][GRID_WIDTH-1] = WALL
+        # Create a level based on the level number. Levels are read from the
+        # level pack if there is one. Otherwise they are built by
+        # sokoban_generator so they are always solvable; windowed games take
+        # them from a pool of worker processes that prepares the next levels
+        # while the current one is played.
+        self.hint_search = None
+        level = None
+        if self.level_pack is not None:
+            level = self.level_pack.level(level_num - 1)
+        if level is None:
+            if self.level_pool is None:
+                # Upcoming levels are generated in the background while
+                # playing; headless games build them in process from the
+                # same seeds
+                from sokoban_generator import LevelPool
+                self.level_pool = LevelPool(workers=0 if self.headless else None, rng=self.random)
+            level = self.level_pool.get(level_num)
         
-        # Add some random walls
-        wall_count = 10 + level_num * 2
-        for _ in range(wall_count):
-            x = random.randint(1, GRID_WIDTH-2)
-            y = random.randint(1, GRID_HEIGHT-2)
-            self.grid[y][x] = WALL
+        self.grid = level.grid
+        self.grid_width = len(self.grid[0])
+        self.grid_height = len(self.grid)
+        # Entities are indexed by position so moves never scan a list
+        self.boxes = set(level.boxes)
+        self.targets = set(level.targets)
+        self.player_x, self.player_y = level.player
+        self.yankees = set(level.yankees)
+        self.weak_persons = set(level.weak_persons)
+        self.weapons = set(level.weapons)
+        self.boxes_on_target = len(self.boxes & self.targets)
         
-        # Add boxes and targets
-        self.boxes = []
-        self.targets = []
-        box_count = 3 + level_num
-        for i in range(box_count):
-            # Place boxes
-            while True:
-                x = random.randint(1, GRID_WIDTH-2)
-                y = random.randint(1, GRID_HEIGHT-2)
-                if self.grid[y][x] == EMPTY:
-                    self.grid[y][x] = BOX
-                    self.boxes.append((x, y))
-                    break
-            
-            # Place targets
-            while True:
-                x = random.randint(1, GRID_WIDTH-2)
-                y = random.randint(1, GRID_HEIGHT-2)
-                if self.grid[y][x] == EMPTY:
-                    self.grid[y][x] = TARGET
-                    self.targets.append((x, y))
-                    break
+        # Undo and redo journals for this level
+        self.history = bytearray()
+        self.redo_history = bytearray()
+        # Bumped by every change to the position, so a hint can tell
+        # whether it was solved for the position on screen
+        self.board_version = 0
+
+        # A level that starts with every box on a target is cleared at once
+        # rather than waiting for a box to be pushed off and back on
+        self.check_victory()
+
+    def draw_background(self, surface):
+        surface.fill(BLACK)
+
+    def hud_texts(self):
+        # Text shown over the map as (surface, rect) pairs, rendered again
+        # only when what it shows changes
+        key = (self.score, self.level, self.moves, self.has_weapon,
+               self.message, self.game_over, self.victory)
+        if key == self.hud_key:
+            return self.hud
+        self.hud_key = key
         
-        # Add player
-        while True:
-            x = random.randint(1, GRID_WIDTH-2)
-            y = random.randint(1, GRID_HEIGHT-2)
-            if self.grid[y][x] == EMPTY:
-                self.player_x = x
-                self.player_y = y
-                break
+        # The score and level
+        texts = [
+            (self.font.render(f"Score: {self.score}", True, WHITE), (10, 10)),
+            (self.font.render(f"Level: {self.level}", True, WHITE), (10, 40)),
+            (self.font.render(f"Moves: {self.moves}", True, WHITE), (10, 70)),
+            (self.font.render(f"Weapon: {'Yes' if self.has_weapon else 'No'}", True, WHITE), (10, 100)),
+        ]
         
-        # Add yankees
-        self.yankees = []
-        yankee_count = level_num
-        for _ in range(yankee_count):
-            while True:
-                x = random.randint(1, GRID_WIDTH-2)
-                y = random.randint(1, GRID_HEIGHT-2)
-                if self.grid[y][x] == EMPTY:
-                    self.grid[y][x] = YANKEE
-                    self.yankees.append((x, y))
-                    break
+        # The message if any
+        if self.message:
+            message_text = self.font.render(self.message, True, WHITE)
+            texts.append((message_text, (SCREEN_WIDTH // 2 - message_text.get_width() // 2, 10)))
         
-        # Add weak persons
-        self.weak_persons = []
-        weak_count = level_num
-        for _ in range(weak_count):
-            while True:
-                x = random.randint(1, GRID_WIDTH-2)
-                y = random.randint(1, GRID_HEIGHT-2)
-                if self.grid[y][x] == EMPTY:
-                    self.grid[y][x] = WEAK_PERSON
-                    self.weak_persons.append((x, y))
-                    break
+        # The game over or victory message
+        if self.game_over:
+            game_over_text = self.large_font.render("GAME OVER", True, RED)
+            restart_text = self.font.render("Press R to restart", True, WHITE)
+            texts.append((game_over_text,
+                          (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2,
+                           SCREEN_HEIGHT // 2 - game_over_text.get_height() // 2)))
+            texts.append((restart_text,
+                          (SCREEN_WIDTH // 2 - restart_text.get_width() // 2,
+                           SCREEN_HEIGHT // 2 + 50)))
+        elif self.victory:
+            victory_text = self.large_font.render("LEVEL CLEAR!", True, GREEN)
+            next_text = self.font.render("Press N for next level", True, WHITE)
+            texts.append((victory_text,
+                          (SCREEN_WIDTH // 2 - victory_text.get_width() // 2,
+                           SCREEN_HEIGHT // 2 - victory_text.get_height() // 2)))
+            texts.append((next_text,
+                          (SCREEN_WIDTH // 2 - next_text.get_width() // 2,
+                           SCREEN_HEIGHT // 2 + 50)))
         
-        # Add weapons
-        self.weapons = []
-        weapon_count = 1 + level_num // 2
-        for _ in range(weapon_count):
-            while True:
-                x = random.randint(1, GRID_WIDTH-2)
-                y = random.randint(1, GRID_HEIGHT-2)
-                if self.grid[y][x] == EMPTY:
-                    self.grid[y][x] = WEAPON
-                    self.weapons.append((x, y))
-                    break
+        self.hud = [(text, text.get_rect(topleft=position)) for text, position in texts]
+        return self.hud
 
     def draw(self):
-        # Clear the screen
-        self.screen.fill(BLACK)
+        dirty = self.dirty
         
-        # Calculate grid offset to center it
-        grid_width_px = GRID_WIDTH * TILE_SIZE
-        grid_height_px = GRID_HEIGHT * TILE_SIZE
-        offset_x = (SCREEN_WIDTH - grid_width_px) // 2
-        offset_y = (SCREEN_HEIGHT - grid_height_px) // 2
+        # Scrolling or a new level moves every tile
+        offset_x, offset_y = self.camera_offset()
+        if (offset_x, offset_y) != self.view_offset or self.grid is not self.view_grid:
+            self.view_offset = (offset_x, offset_y)
+            self.view_grid = self.grid
+            dirty.invalidate()
+        dirty.begin()
         
-        # Draw the grid
-        for y in range(GRID_HEIGHT):
-            for x in range(GRID_WIDTH):
-                cell = self.grid[y][x]
-                if cell != EMPTY:
-                    self.screen.blit(self.images[cell], 
-                                     (offset_x + x * TILE_SIZE, 
-                                      offset_y + y * TILE_SIZE))
-        
-        # Draw the player
-        self.screen.blit(self.images[PLAYER], 
-                         (offset_x + self.player_x * TILE_SIZE, 
-                          offset_y + self.player_y * TILE_SIZE))
+        # Only the tiles under the camera are drawn
+        first_x = max(0, -offset_x // TILE_SIZE)
+        first_y = max(0, -offset_y // TILE_SIZE)
+        last_x = min(self.grid_width, (SCREEN_WIDTH - offset_x + TILE_SIZE - 1) // TILE_SIZE)
+        last_y = min(self.grid_height, (SCREEN_HEIGHT - offset_y + TILE_SIZE - 1) // TILE_SIZE)
         
-        # Draw the score and level
-        score_text = FONT.render(f"Score: {self.score}", True, WHITE)
-        level_text = FONT.render(f"Level: {self.level}", True, WHITE)
-        moves_text = FONT.render(f"Moves: {self.moves}", True, WHITE)
-        weapon_text = FONT.render(f"Weapon: {'Yes' if self.has_weapon else 'No'}", True, WHITE)
+        # A tile shows its cell and maybe the player
+        tiles = []
+        for y in range(first_y, last_y):
+            row = self.grid[y]
+            for x in range(first_x, last_x):
+                tiles.append(((x, y), (row[x], x == self.player_x and y == self.player_y)))
         
-        self.screen.blit(score_text, (10, 10))
-        self.screen.blit(level_text, (10, 40))
-        self.screen.blit(moves_text, (10, 70))
-        self.screen.blit(weapon_text, (10, 100))
+        # The text is drawn over the tiles, so when it changes, or a tile
+        # under it does, its area is rebuilt: restored, the tiles under it
+        # drawn again and then all text on top
+        old_hud = self.hud
+        hud = self.hud_texts()
+        text_rects = [rect for _, rect in hud]
+        redraw_text = dirty.full or hud is not old_hud
+        if not redraw_text:
+            for (x, y), key in tiles:
+                if dirty.stale((x, y), key):
+                    rect = pygame.Rect(offset_x + x * TILE_SIZE, offset_y + y * TILE_SIZE,
+                                       TILE_SIZE, TILE_SIZE)
+                    if rect.collidelist(text_rects) != -1:
+                        redraw_text = True
+                        break
+        if redraw_text and not dirty.full:
+            areas = list(text_rects)
+            if hud is not old_hud:
+                areas += [rect for _, rect in old_hud]
+            for rect in areas:
+                dirty.restore(rect)
+                for y in range(max(first_y, (rect.top - offset_y) // TILE_SIZE),
+                               min(last_y, (rect.bottom - 1 - offset_y) // TILE_SIZE + 1)):
+                    for x in range(max(first_x, (rect.left - offset_x) // TILE_SIZE),
+                                   min(last_x, (rect.right - 1 - offset_x) // TILE_SIZE + 1)):
+                        dirty.forget((x, y))
         
-        # Draw message if any
-        if self.message:
-            message_text = FONT.render(self.message, True, WHITE)
-            self.screen.blit(message_text, (SCREEN_WIDTH // 2 - message_text.get_width() // 2, 10))
+        # Draw the grid and the player
+        for (x, y), key in tiles:
+            if dirty.stale((x, y), key):
+                position = (offset_x + x * TILE_SIZE, offset_y + y * TILE_SIZE)
+                dirty.changed((x, y), key, (position, (TILE_SIZE, TILE_SIZE)))
+                cell, player = key
+                if cell != EMPTY:
+                    self.screen.blit(self.images[cell], position)
+                if player:
+                    self.screen.blit(self.images[PLAYER], position)
         
-        # Draw game over or victory message
-        if self.game_over:
-            game_over_text = LARGE_FONT.render("GAME OVER", True, RED)
-            restart_text = FONT.render("Press R to restart", True, WHITE)
-            self.screen.blit(game_over_text, 
-                            (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2, 
-                             SCREEN_HEIGHT // 2 - game_over_text.get_height() // 2))
-            self.screen.blit(restart_text, 
-                            (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, 
-                             SCREEN_HEIGHT // 2 + 50))
-        elif self.victory:
-            victory_text = LARGE_FONT.render("LEVEL CLEAR!", True, GREEN)
-            next_text = FONT.render("Press N for next level", True, WHITE)
-            self.screen.blit(victory_text, 
-                            (SCREEN_WIDTH // 2 - victory_text.get_width() // 2, 
-                             SCREEN_HEIGHT // 2 - victory_text.get_height() // 2))
-            self.screen.blit(next_text, 
-                            (SCREEN_WIDTH // 2 - next_text.get_width() // 2, 
-                             SCREEN_HEIGHT // 2 + 50))
+        if redraw_text:
+            for text, rect in hud:
+                self.screen.blit(text, rect)
+
+    def camera_offset(self):
+        # Screen position of the grid's top-left corner. A map that fits on
+        # the screen is centered; a larger one scrolls to keep the player in
+        # the middle, stopping at the map edges.
+        offsets = []
+        for player, cells, screen_size in ((self.player_x, self.grid_width, SCREEN_WIDTH),
+                                           (self.player_y, self.grid_height, SCREEN_HEIGHT)):
+            map_size = cells * TILE_SIZE
+            if map_size <= screen_size:
+                offsets.append((screen_size - map_size) // 2)
+            else:
+                center = player * TILE_SIZE + TILE_SIZE // 2
+                scroll = min(max(center - screen_size // 2, 0), map_size - screen_size)
+                offsets.append(-scroll)
+        return tuple(offsets)
+
+    def in_bounds(self, x, y):
+        # Imported maps are not always closed by walls
+        return 0 <= x < self.grid_width and 0 <= y < self.grid_height
 
     def move_player(self, dx, dy):
         if self.game_over or self.victory:
@@ -236,7 +315,7 @@ class SokobanBanchou:
         new_y = self.player_y + dy
         
         # Check if the move is valid
-        if self.grid[new_y][new_x] == WALL:
+        if not self.in_bounds(new_x, new_y) or self.grid[new_y][new_x] == WALL:
             return
         
         # Handle box pushing
@@ -246,7 +325,7 @@ class SokobanBanchou:
             box_new_y = new_y + dy
             
             # Check if the box can be pushed
-            if self.grid[box_new_y][box_new_x] in [EMPTY, TARGET]:
+            if self.in_bounds(box_new_x, box_new_y) and self.grid[box_new_y][box_new_x] in [EMPTY, TARGET]:
                 # Move the box
                 is_on_target = self.grid[new_y][new_x] == BOX_ON_TARGET
                 self.grid[new_y][new_x] = TARGET if is_on_target else EMPTY
@@ -255,9 +334,11 @@ class SokobanBanchou:
                 is_target = self.grid[box_new_y][box_new_x] == TARGET
                 self.grid[box_new_y][box_new_x] = BOX_ON_TARGET if is_target else BOX
                 
-                # Update box list
+                # Update box set and the running count of boxes on targets
                 self.boxes.remove((new_x, new_y))
-                self.boxes.append((box_new_x, box_new_y))
+                self.boxes.add((box_new_x, box_new_y))
+                self.boxes_on_target += is_target - is_on_target
+                self.record(PUSH, dx, dy)
                 
                 # Move the player
                 self.player_x = new_x
@@ -275,6 +356,7 @@ class SokobanBanchou:
             if self.has_weapon:
                 # Fight the yankee with a weapon
                 self.message = "You fought a yankee! Lost score for using a weapon."
+                self.record(FIGHT, dx, dy)
                 self.score -= 100
                 self.has_weapon = False  # Use up the weapon
                 self.weapon_uses += 1
@@ -290,12 +372,14 @@ class SokobanBanchou:
             else:
                 # Game over if no weapon
                 self.message = "You challenged a yankee without a weapon! You lost..."
+                self.record(LOSE, dx, dy)
                 self.game_over = True
         
         # Handle weak person encounter
         elif self.grid[new_y][new_x] == WEAK_PERSON:
             # Bullying weak person loses score
             self.message = "You bullied a weak person! Your score decreased significantly."
+            self.record(BULLY, dx, dy)
             self.score -= 200
             
             # Remove the weak person
@@ -310,6 +394,7 @@ class SokobanBanchou:
         # Handle weapon pickup
         elif self.grid[new_y][new_x] == WEAPON:
             self.message = "You got a weapon!"
+            self.record(PICK_UP, dx, dy)
             self.has_weapon = True
             
             # Remove the weapon
@@ -323,6 +408,8 @@ class SokobanBanchou:
         
         # Handle normal movement
         elif self.grid[new_y][new_x] in [EMPTY, TARGET]:
+            self.record(STEP, dx, dy)
+            
             # Move the player
             self.player_x = new_x
             self.player_y = new_y
@@ -333,23 +420,22 @@ class SokobanBanchou:
             return
         
         # Use weapon to clear a path
-        directions = [(0, -1), (1, 0), (0, 1), (-1, 0)]  # Up, Right, Down, Left
-        
-        for dx, dy in directions:
+        for dx, dy in DIRECTIONS:
             target_x = self.player_x + dx
             target_y = self.player_y + dy
             
-            if 0 <= target_x < GRID_WIDTH and 0 <= target_y < GRID_HEIGHT:
+            if self.in_bounds(target_x, target_y):
                 if self.grid[target_y][target_x] == BOX or self.grid[target_y][target_x] == BOX_ON_TARGET:
                     # Remove the box
                     is_on_target = self.grid[target_y][target_x] == BOX_ON_TARGET
                     self.grid[target_y][target_x] = TARGET if is_on_target else EMPTY
                     
-                    # Update box list
-                    if (target_x, target_y) in self.boxes:
-                        self.boxes.remove((target_x, target_y))
+                    # Update box set and the running count of boxes on targets
+                    self.boxes.discard((target_x, target_y))
+                    self.boxes_on_target -= is_on_target
                     
                     # Decrease score for using weapon
+                    self.record(SMASH_BOX, dx, dy)
                     self.score -= 50
                     self.has_weapon = False
                     self.weapon_uses += 1
@@ -365,6 +451,7 @@ class SokobanBanchou:
                     self.yankees.remove((target_x, target_y))
                     
                     # Decrease score for using weapon
+                    self.record(SMASH_YANKEE, dx, dy)
                     self.score -= 100
                     self.has_weapon = False
                     self.weapon_uses += 1
@@ -377,6 +464,7 @@ class SokobanBanchou:
                     self.weak_persons.remove((target_x, target_y))
                     
                     # Decrease score significantly for attacking weak person
+                    self.record(SMASH_WEAK, dx, dy)
                     self.score -= 200
                     self.has_weapon = False
                     self.weapon_uses += 1
@@ -385,19 +473,128 @@ class SokobanBanchou:
         
         self.message = "No target to use weapon on."
 
-    def check_victory(self):
-        # Check if all boxes are on targets
-        boxes_on_target = 0
-        for x, y in self.boxes:
-            if self.grid[y][x] == BOX_ON_TARGET:
-                boxes_on_target += 1
+    def record(self, kind, dx, dy):
+        # Journal an action before it changes the state; a new action
+        # invalidates anything that could have been redone
+        self.history.append(kind << 3 | self.has_weapon << 2 | DIRECTION_INDEX[(dx, dy)])
+        self.redo_history = bytearray()
+        self.board_version += 1
+
+    def set_box(self, x, y):
+        self.grid[y][x] = BOX_ON_TARGET if (x, y) in self.targets else BOX
+        self.boxes.add((x, y))
+        self.boxes_on_target += (x, y) in self.targets
+
+    def clear_box(self, x, y):
+        self.grid[y][x] = TARGET if (x, y) in self.targets else EMPTY
+        self.boxes.remove((x, y))
+        self.boxes_on_target -= (x, y) in self.targets
+
+    def undo(self):
+        # Reverse the last journaled action in constant time
+        if not self.history:
+            return
+        entry = self.history.pop()
+        self.redo_history.append(entry)
+        self.board_version += 1
+        kind = entry >> 3
+        dx, dy = DIRECTIONS[entry & 3]
+        x, y = self.player_x, self.player_y
         
-        if boxes_on_target == len(self.targets):
+        if kind == LOSE:
+            self.game_over = False
+        elif kind >= SMASH_BOX:
+            # The player stayed put and the weapon hit the neighbor
+            if kind == SMASH_BOX:
+                self.set_box(x + dx, y + dy)
+                self.score += 50
+            elif kind == SMASH_YANKEE:
+                self.grid[y + dy][x + dx] = YANKEE
+                self.yankees.add((x + dx, y + dy))
+                self.score += 100
+            else:
+                self.grid[y + dy][x + dx] = WEAK_PERSON
+                self.weak_persons.add((x + dx, y + dy))
+                self.score += 200
+            self.has_weapon = True
+            self.weapon_uses -= 1
+        else:
+            # The player moved onto (x, y); put back what was there
+            if kind == PUSH:
+                self.clear_box(x + dx, y + dy)
+                self.set_box(x, y)
+            elif kind == FIGHT:
+                self.grid[y][x] = YANKEE
+                self.yankees.add((x, y))
+                self.score += 100
+                self.weapon_uses -= 1
+            elif kind == BULLY:
+                self.grid[y][x] = WEAK_PERSON
+                self.weak_persons.add((x, y))
+                self.score += 200
+            elif kind == PICK_UP:
+                self.grid[y][x] = WEAPON
+                self.weapons.add((x, y))
+            self.has_weapon = bool(entry & 4)
+            self.player_x = x - dx
+            self.player_y = y - dy
+            self.moves -= 1
+        
+        # No action is taken after a level is cleared, so undoing always
+        # returns to an unfinished level
+        self.victory = False
+        self.hint_search = None
+        self.message = "Undone."
+
+    def redo(self):
+        # Replay the last undone action through the normal rules
+        if not self.redo_history:
+            return
+        entry = self.redo_history.pop()
+        redo_history = self.redo_history
+        if entry >> 3 >= SMASH_BOX:
+            self.use_weapon()
+        else:
+            self.move_player(*DIRECTIONS[entry & 3])
+        # Replaying journals the action again, which clears the redo journal
+        self.redo_history = redo_history
+        self.hint_search = None
+
+    def check_victory(self):
+        # Check if all targets are covered (boxes_on_target is kept up to date
+        # by move_player and use_weapon)
+        if self.boxes_on_target == len(self.targets):
             self.victory = True
             # Calculate final score
             final_score = self.score - self.moves - (self.weapon_uses * 50)
             self.message = f"Level {self.level} cleared! Final score: {final_score}"
 
+    def request_hint(self):
+        # Start solving the current position in the background; run() shows
+        # the first move of the solution once the search finishes
+        from sokoban_solver import HintSearch
+        
+        if self.game_over or self.victory or self.hint_search is not None:
+            return
+        self.message = "Thinking..."
+        self.hint_search = HintSearch(self)
+
+    def update_hint(self):
+        # Show a finished hint if the position has not changed since asking
+        if self.hint_search is None or not self.hint_search.done:
+            return
+        if self.hint_search.board_version == self.board_version and not self.victory:
+            from sokoban_solver import DIRECTIONS, DIRECTION_NAMES
+            
+            move = self.hint_search.next_move()
+            if self.hint_search.result.status == 'failed':
+                self.message = "No hint available."
+            elif move is None:
+                self.message = "No solution found from here."
+            else:
+                self.message = f"Hint: {DIRECTION_NAMES[DIRECTIONS.index(move)]}"
+        self.hint_search = None
+
     def next_level(self):
         if self.victory:
             self.level += 1
@@ -408,7 +605,37 @@ class SokobanBanchou:
             self.weapon_uses = 0
             self.load_level(self.level)
 
-    def run(self):
+    def handle_key(self, key):
+        # Apply one key press; run() and replays both go through here
+        if key == pygame.K_r and self.game_over:
+            self.reset_game()
+        elif key == pygame.K_n and self.victory:
+            self.next_level()
+        elif key == pygame.K_UP:
+            self.move_player(0, -1)
+        elif key == pygame.K_RIGHT:
+            self.move_player(1, 0)
+        elif key == pygame.K_DOWN:
+            self.move_player(0, 1)
+        elif key == pygame.K_LEFT:
+            self.move_player(-1, 0)
+        elif key == pygame.K_SPACE:
+            self.use_weapon()
+        elif key == pygame.K_h:
+            self.request_hint()
+        elif key == pygame.K_z:
+            self.undo()
+        elif key == pygame.K_y:
+            self.redo()
+
+    def update(self):
+        # Advance by one frame; only a pending hint can change on its own
+        self.update_hint()
+        self.frame += 1
+
+    def run(self, replay_path=None):
+        # Every key press is recorded; the replay is saved to replay_path on exit
+        replay = Replay(self.seed)
         running = True
         
         while running:
@@ -418,33 +645,27 @@ class SokobanBanchou:
                     running = False
                 
                 elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_r and self.game_over:
-                        self.reset_game()
-                    elif event.key == pygame.K_n and self.victory:
-                        self.next_level()
-                    elif event.key == pygame.K_UP:
-                        self.move_player(0, -1)
-                    elif event.key == pygame.K_RIGHT:
-                        self.move_player(1, 0)
-                    elif event.key == pygame.K_DOWN:
-                        self.move_player(0, 1)
-                    elif event.key == pygame.K_LEFT:
-                        self.move_player(-1, 0)
-                    elif event.key == pygame.K_SPACE:
-                        self.use_weapon()
+                    replay.record(self.frame, event.key)
+                    self.handle_key(event.key)
             
-            # Draw everything
-            self.draw()
+            self.update()
             
-            # Update the display
-            pygame.display.flip()
+            # Draw what changed and push only those areas to the display
+            self.draw()
+            self.dirty.present()
             
             # Cap the frame rate
             self.clock.tick(60)
         
+        if replay_path is not None:
+            replay.frames = self.frame
+            replay.save(replay_path)
+        if self.level_pool is not None:
+            self.level_pool.close()
         pygame.quit()
         sys.exit()
 
 if __name__ == "__main__":
-    game = SokobanBanchou()
+    # Optional argument: an XSB level pack to play
+    game = SokobanBanchou(level_pack=sys.argv[1] if len(sys.argv) > 1 else None)
     game.run()
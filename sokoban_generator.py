@@ -0,0 +1,288 @@
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from sokoban_banchou import (BOX, BOX_ON_TARGET, EMPTY, GRID_HEIGHT, GRID_WIDTH, TARGET,
+                             WALL, WEAK_PERSON, WEAPON, YANKEE)
+
+# Up, Right, Down, Left
+DIRECTIONS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+
+# Box pulls made when scrambling a solved layout: PULLS_PER_BOX for every
+# box plus PULLS_PER_LEVEL for every level, so later levels are scrambled
+# further
+PULLS_PER_BOX = 3
+PULLS_PER_LEVEL = 2
+# Chance that pulling the same box on in the same direction is among the
+# pulls compared, so boxes travel instead of shuffling around their targets
+KEEP_PULLING_CHANCE = 0.5
+# Pulls compared at each step of a scramble
+PULL_CHOICES = 3
+# Scrambles tried per level; the most scrambled one is used
+SCRAMBLE_ATTEMPTS = 8
+
+# Levels kept ready ahead of the one being played
+DEFAULT_LOOKAHEAD = 3
+
+
+class Level:
+    # Plain, picklable description of a level, as returned by worker processes
+
+    def __init__(self, grid, boxes, targets, player, yankees, weak_persons, weapons):
+        self.grid = grid
+        self.boxes = boxes
+        self.targets = targets
+        self.player = player
+        self.yankees = yankees
+        self.weak_persons = weak_persons
+        self.weapons = weapons
+
+
+def entity_counts(level_num, free_cells):
+    # The classic counts (3 + level boxes, level yankees and weak persons,
+    # 1 + level // 2 weapons), scaled down when the board runs out of room.
+    # At least a third of the free cells stay empty so the player can move.
+    boxes = 3 + level_num
+    people = level_num
+    weapons = 1 + level_num // 2
+    budget = free_cells * 2 // 3
+    while 2 * boxes + 2 * people + weapons > budget:
+        if people > 0:
+            people -= 1
+        elif weapons > 1:
+            weapons -= 1
+        elif boxes > 1:
+            boxes -= 1
+        else:
+            break
+    return boxes, people, weapons
+
+
+def _largest_region(grid):
+    # Floor cells of the largest 4-connected open area
+    seen = set()
+    best = []
+    for y in range(len(grid)):
+        for x in range(len(grid[0])):
+            if grid[y][x] == WALL or (x, y) in seen:
+                continue
+            region = []
+            seen.add((x, y))
+            stack = [(x, y)]
+            while stack:
+                cx, cy = stack.pop()
+                region.append((cx, cy))
+                for dx, dy in DIRECTIONS:
+                    neighbor = (cx + dx, cy + dy)
+                    if neighbor not in seen and grid[neighbor[1]][neighbor[0]] != WALL:
+                        seen.add(neighbor)
+                        stack.append(neighbor)
+            if len(region) > len(best):
+                best = region
+    return best
+
+
+def _walk_map(grid, boxes, player):
+    # Cells the player can walk to, each mapped to the cell it was reached from
+    came_from = {player: None}
+    frontier = [player]
+    while frontier:
+        next_frontier = []
+        for x, y in frontier:
+            for dx, dy in DIRECTIONS:
+                cell = (x + dx, y + dy)
+                if cell not in came_from and grid[cell[1]][cell[0]] != WALL and cell not in boxes:
+                    came_from[cell] = (x, y)
+                    next_frontier.append(cell)
+        frontier = next_frontier
+    return came_from
+
+
+def _pulls(grid, boxes, came_from):
+    # Pulls the player can make as (box, direction): the box moves onto a
+    # reachable neighbor and the player steps back to the free cell beyond
+    pulls = []
+    for bx, by in sorted(boxes):
+        for dx, dy in DIRECTIONS:
+            stand = (bx + dx, by + dy)
+            back = (bx + 2 * dx, by + 2 * dy)
+            if stand in came_from and grid[back[1]][back[0]] != WALL and back not in boxes:
+                pulls.append(((bx, by), (dx, dy)))
+    return pulls
+
+
+def _scramble(grid, targets, player, level_num, rng):
+    # Play backwards from the solved position: walk up to a box and step
+    # away from it, pulling it along. Returns the boxes, the player and
+    # every cell the walk used.
+    boxes = set(targets)
+    touched = set(targets)
+    touched.add(player)
+    came_from = _walk_map(grid, boxes, player)
+    pulls = _pulls(grid, boxes, came_from)
+    last_pull = None
+    for _ in range(PULLS_PER_BOX * len(targets) + PULLS_PER_LEVEL * level_num):
+        if not pulls:
+            break
+        candidates = pulls[:]
+        rng.shuffle(candidates)
+        if last_pull in pulls and rng.random() < KEEP_PULLING_CHANCE:
+            candidates.remove(last_pull)
+            candidates.insert(0, last_pull)
+
+        # Of the first few pulls, take the one that leaves the player the
+        # most room, so the walk does not wall itself in among the boxes
+        best = None
+        for pull in candidates[:PULL_CHOICES]:
+            (bx, by), (dx, dy) = pull
+            next_boxes = boxes - {(bx, by)} | {(bx + dx, by + dy)}
+            next_player = (bx + 2 * dx, by + 2 * dy)
+            next_came_from = _walk_map(grid, next_boxes, next_player)
+            next_pulls = _pulls(grid, next_boxes, next_came_from)
+            room = (len(next_pulls) > 0, len(next_came_from))
+            if best is None or room > best[0]:
+                best = (room, pull, next_boxes, next_player, next_came_from, next_pulls)
+        _, pull, next_boxes, next_player, next_came_from, next_pulls = best
+
+        (bx, by), (dx, dy) = pull
+        stand = (bx + dx, by + dy)
+        cell = stand
+        while cell is not None:
+            touched.add(cell)
+            cell = came_from[cell]
+        touched.add(next_player)
+        boxes, player, came_from, pulls = next_boxes, next_player, next_came_from, next_pulls
+        last_pull = (stand, (dx, dy))
+    return boxes, player, touched
+
+
+def _spread(boxes, targets):
+    # How far the boxes are from being solved: the distance from each box to
+    # its nearest target, summed (0 when every box is on a target)
+    return sum(min(abs(bx - tx) + abs(by - ty) for tx, ty in targets) for bx, by in boxes)
+
+
+def generate_level(level_num, seed=None, width=GRID_WIDTH, height=GRID_HEIGHT):
+    # Builds a level that is solvable by construction: boxes start on their
+    # targets and the player plays the level backwards, pulling boxes away.
+    # Replaying that walk forwards solves the level. People and weapons only
+    # go on cells the walk never touched, so they cannot block the solution.
+    rng = random.Random(seed)
+    grid = [[EMPTY for _ in range(width)] for _ in range(height)]
+
+    # Add walls around the edges
+    for x in range(width):
+        grid[0][x] = WALL
+        grid[height-1][x] = WALL
+    for y in range(height):
+        grid[y][0] = WALL
+        grid[y][width-1] = WALL
+
+    # Add some random walls (a fixed number of draws, duplicates allowed),
+    # capped so late levels keep most of the board open. Larger boards get
+    # proportionally more walls.
+    interior = (width - 2) * (height - 2)
+    base_interior = (GRID_WIDTH - 2) * (GRID_HEIGHT - 2)
+    wall_count = min((10 + level_num * 2) * interior // base_interior, interior // 3)
+    for _ in range(wall_count):
+        x = rng.randint(1, width-2)
+        y = rng.randint(1, height-2)
+        grid[y][x] = WALL
+
+    # Anything outside the main area is walled off so it cannot hold items
+    region = _largest_region(grid)
+    region_set = set(region)
+    for y in range(1, height-1):
+        for x in range(1, width-1):
+            if (x, y) not in region_set:
+                grid[y][x] = WALL
+
+    box_count, people_count, weapon_count = entity_counts(level_num, len(region))
+    # A tiny main area still needs a cell for the player to start on
+    box_count = min(box_count, len(region) - 1)
+
+    # Start from solved positions and scramble them, keeping the scramble
+    # that left the boxes farthest from the targets. A level where every box
+    # ended back on a target is only kept if no scramble did better.
+    region.sort()
+    best = None
+    for _ in range(SCRAMBLE_ATTEMPTS):
+        targets = rng.sample(region, box_count)
+        free = [cell for cell in region if cell not in targets]
+        boxes, player, touched = _scramble(grid, targets, rng.choice(free), level_num, rng)
+        spread = _spread(boxes, targets)
+        if best is None or spread > best[0]:
+            best = (spread, targets, boxes, player, touched)
+    _, targets, boxes, player, touched = best
+
+    # Place the remaining items on untouched cells
+    spare = [cell for cell in region if cell not in touched]
+    rng.shuffle(spare)
+    people_count = min(people_count, len(spare) // 2)
+    yankees = spare[:people_count]
+    weak_persons = spare[people_count:2 * people_count]
+    weapons = spare[2 * people_count:2 * people_count + weapon_count]
+
+    target_set = set(targets)
+    for x, y in targets:
+        grid[y][x] = TARGET
+    for x, y in boxes:
+        grid[y][x] = BOX_ON_TARGET if (x, y) in target_set else BOX
+    for cells, element in ((yankees, YANKEE), (weak_persons, WEAK_PERSON), (weapons, WEAPON)):
+        for x, y in cells:
+            grid[y][x] = element
+
+    return Level(grid, sorted(boxes), targets, player, yankees, weak_persons, weapons)
+
+
+class LevelPool:
+    # Generates upcoming levels in worker processes. get() returns a level
+    # that is usually already waiting, then queues the ones after it.
+    # Level seeds are drawn from rng in the same order whether or not there
+    # are workers, so a seeded game gets the same levels either way.
+    # workers=0 builds each level in this process when it is requested.
+
+    def __init__(self, lookahead=DEFAULT_LOOKAHEAD, workers=None, rng=None):
+        self.lookahead = lookahead
+        self.random = rng if rng is not None else random.Random()
+        self.executor = None
+        if workers != 0:
+            # Spawned workers never inherit the parent's pygame display
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        self.pending = {}  # level number -> (seed, future or None)
+
+    def prefetch(self, level_num):
+        for upcoming in range(level_num, level_num + self.lookahead):
+            if upcoming not in self.pending:
+                seed = self.random.getrandbits(64)
+                future = None
+                if self.executor is not None:
+                    future = self.executor.submit(generate_level, upcoming, seed)
+                self.pending[upcoming] = (seed, future)
+
+    def get(self, level_num):
+        # Levels that were not queued (first level, restarts) are built here
+        seed, future = self.pending.pop(level_num, None) or (self.random.getrandbits(64), None)
+        level = future.result() if future is not None else generate_level(level_num, seed)
+
+        # Drop levels that were skipped and queue the next ones
+        for stale in [n for n in self.pending if n <= level_num]:
+            self.cancel(stale)
+        self.prefetch(level_num + 1)
+        return level
+
+    def cancel(self, level_num):
+        _, future = self.pending.pop(level_num)
+        if future is not None:
+            future.cancel()
+
+    def clear(self):
+        # Forget every queued level, e.g. after the seed changed
+        for level_num in list(self.pending):
+            self.cancel(level_num)
+
+    def close(self):
+        self.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
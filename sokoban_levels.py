@@ -0,0 +1,134 @@
+import mmap
+
+from sokoban_banchou import (BOX, BOX_ON_TARGET, EMPTY, TARGET, WALL, WEAK_PERSON, WEAPON,
+                             YANKEE)
+from sokoban_generator import Level
+
+# Standard XSB symbols plus this game's extras: Y yankee, W weak person, ! weapon.
+# '-' and '_' are alternative floor symbols used where spaces get mangled.
+FLOOR_SYMBOLS = b" -_"
+PLAYER_SYMBOLS = b"@+"
+BOARD_SYMBOLS = b"#$.*@+YW!" + FLOOR_SYMBOLS
+DIGITS = b"0123456789"
+
+
+def is_board_line(line):
+    # Board rows contain a wall and nothing but board symbols (optionally
+    # run-length encoded); titles, comments and blank lines do not
+    line = line.rstrip(b"\r\n\t ")
+    return b"#" in line and not line.translate(None, BOARD_SYMBOLS + DIGITS)
+
+
+def expand_run_lengths(line):
+    # "4#2-$" -> "####--$"
+    expanded = bytearray()
+    count = 0
+    for byte in line:
+        if 48 <= byte <= 57:
+            count = count * 10 + byte - 48
+        else:
+            expanded.extend(bytes((byte,)) * max(count, 1))
+            count = 0
+    return bytes(expanded)
+
+
+def parse_level(text):
+    # Builds a Level from the board rows of one XSB level
+    if isinstance(text, str):
+        text = text.encode()
+    rows = [expand_run_lengths(line.rstrip(b"\r\n\t "))
+            for line in text.splitlines() if is_board_line(line)]
+    if not rows:
+        raise ValueError("no board rows in level text")
+    width = max(len(row) for row in rows)
+
+    grid = [[EMPTY] * width for _ in rows]
+    boxes, targets, yankees, weak_persons, weapons = [], [], [], [], []
+    player = None
+    for y, row in enumerate(rows):
+        for x, symbol in enumerate(row.decode()):
+            if symbol == "#":
+                grid[y][x] = WALL
+            elif symbol in ".*+":
+                grid[y][x] = TARGET
+                targets.append((x, y))
+            if symbol in "$*":
+                grid[y][x] = BOX_ON_TARGET if symbol == "*" else BOX
+                boxes.append((x, y))
+            elif symbol in "@+":
+                if player is not None:
+                    raise ValueError("level has more than one player")
+                player = (x, y)
+            elif symbol == "Y":
+                grid[y][x] = YANKEE
+                yankees.append((x, y))
+            elif symbol == "W":
+                grid[y][x] = WEAK_PERSON
+                weak_persons.append((x, y))
+            elif symbol == "!":
+                grid[y][x] = WEAPON
+                weapons.append((x, y))
+    if player is None:
+        raise ValueError("level has no player")
+    return Level(grid, boxes, targets, player, yankees, weak_persons, weapons)
+
+
+class LevelPack:
+    # A collection of XSB levels in one file. The file is memory-mapped and
+    # level boundaries are found only as far as the requested level, so
+    # opening a pack costs nothing and each level is parsed on demand.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            # mmap refuses empty files
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if file.read(1) else b""
+        self.offsets = []  # (start, end) byte range of each level found so far
+        self.scan_position = 0
+        self.scanned = False
+
+    def _scan_next(self):
+        # Find the next level after scan_position; returns False at end of file
+        data = self.data
+        position = self.scan_position
+        start = None
+        end = None
+        size = len(data)
+        while position < size:
+            newline = data.find(b"\n", position)
+            line_end = size if newline < 0 else newline + 1
+            if is_board_line(data[position:line_end]):
+                if start is None:
+                    start = position
+                end = line_end
+            elif start is not None:
+                break
+            position = line_end
+        self.scan_position = position
+        if start is None:
+            self.scanned = True
+            return False
+        self.offsets.append((start, end))
+        return True
+
+    def __len__(self):
+        while not self.scanned:
+            self._scan_next()
+        return len(self.offsets)
+
+    def level_text(self, index):
+        # Raw board rows of a level, or None past the end of the pack
+        while len(self.offsets) <= index and not self.scanned:
+            self._scan_next()
+        if index >= len(self.offsets):
+            return None
+        start, end = self.offsets[index]
+        return self.data[start:end]
+
+    def level(self, index):
+        text = self.level_text(index)
+        return None if text is None else parse_level(text)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
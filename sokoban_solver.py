@@ -0,0 +1,380 @@
+import heapq
+import random
+import threading
+import time
+
+from sokoban_banchou import BOX, BOX_ON_TARGET, EMPTY, TARGET, WALL, WEAK_PERSON, YANKEE
+
+# Up, Right, Down, Left as (dx, dy) for SokobanBanchou.move_player;
+# the opposite of direction d is (d + 2) % 4
+DIRECTIONS = ((0, -1), (1, 0), (0, 1), (-1, 0))
+DIRECTION_NAMES = ("Up", "Right", "Down", "Left")
+
+INFINITY = float('inf')
+
+# Fixed seed so Zobrist keys (and therefore search order) are reproducible
+ZOBRIST_SEED = 0x5B0C0BA
+
+# Search limits used by the in-game hint. Crowded late levels expand about
+# a thousand nodes a second, so either limit ends a hopeless search.
+HINT_TIME_LIMIT = 5.0
+HINT_MAX_NODES = 5000
+
+
+class SolveResult:
+    # Outcome of a search: status is 'solved', 'unsolvable', 'limit' or
+    # 'failed' (the search raised)
+
+    def __init__(self, status, moves, pushes, expanded, elapsed):
+        self.status = status
+        self.moves = moves
+        self.pushes = pushes
+        self.expanded = expanded
+        self.elapsed = elapsed
+
+    @property
+    def solved(self):
+        return self.status == 'solved'
+
+    @property
+    def length(self):
+        return len(self.moves) if self.solved else None
+
+    def report(self):
+        if not self.solved:
+            return f"{self.status}: {self.expanded} nodes in {self.elapsed:.2f}s"
+        return (f"solved in {self.length} moves ({self.pushes} pushes): "
+                f"{self.expanded} nodes in {self.elapsed:.2f}s")
+
+
+def min_cost_matching(costs):
+    # Hungarian algorithm with potentials. costs[i][j] is the cost of giving
+    # row i column j, with at most as many rows as columns. Returns the
+    # total cost of the cheapest assignment of every row.
+    rows = len(costs)
+    columns = len(costs[0]) if rows else 0
+    u = [0.0] * (rows + 1)
+    v = [0.0] * (columns + 1)
+    owner = [0] * (columns + 1)
+    way = [0] * (columns + 1)
+    for i in range(1, rows + 1):
+        owner[0] = i
+        j0 = 0
+        min_slack = [INFINITY] * (columns + 1)
+        used = [False] * (columns + 1)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            row = costs[i0 - 1]
+            delta = INFINITY
+            j1 = 0
+            for j in range(1, columns + 1):
+                if not used[j]:
+                    slack = row[j - 1] - u[i0] - v[j]
+                    if slack < min_slack[j]:
+                        min_slack[j] = slack
+                        way[j] = j0
+                    if min_slack[j] < delta:
+                        delta = min_slack[j]
+                        j1 = j
+            if delta == INFINITY:
+                return INFINITY
+            for j in range(columns + 1):
+                if used[j]:
+                    u[owner[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        # Flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+    return -v[0]
+
+
+class SokobanSolver:
+    # A* over box pushes for one level layout. The static part of the level
+    # (walls, targets, people, weapons) is analysed once in the constructor;
+    # solve() then searches from any box/player arrangement.
+    #
+    # The solver never fights or uses weapons: yankees and weak persons are
+    # treated as walls, and weapon tiles can be walked over but not pushed
+    # onto, so a plan it finds never costs score beyond moves.
+
+    def __init__(self, grid, targets):
+        self.height = len(grid)
+        self.width = len(grid[0])
+        cell_count = self.width * self.height
+        self.targets = [y * self.width + x for x, y in targets]
+
+        # Which cells the player may stand on and which a box may enter
+        self.walkable = [False] * cell_count
+        self.box_floor = [False] * cell_count
+        for y, row in enumerate(grid):
+            for x, cell in enumerate(row):
+                index = y * self.width + x
+                self.walkable[index] = cell not in (WALL, YANKEE, WEAK_PERSON)
+                self.box_floor[index] = cell in (EMPTY, TARGET, BOX, BOX_ON_TARGET)
+
+        # neighbors[cell][d] is the cell one step in direction d, or -1
+        self.neighbors = []
+        for index in range(cell_count):
+            x, y = index % self.width, index // self.width
+            cell = []
+            for dx, dy in DIRECTIONS:
+                nx, ny = x + dx, y + dy
+                inside = 0 <= nx < self.width and 0 <= ny < self.height
+                cell.append(ny * self.width + nx if inside else -1)
+            self.neighbors.append(tuple(cell))
+
+        self.push_distances = [self._pull_distances(target) for target in self.targets]
+        # A box on a dead square can never reach any target
+        self.dead = [all(distances[index] == INFINITY for distances in self.push_distances)
+                     for index in range(cell_count)]
+
+        rng = random.Random(ZOBRIST_SEED)
+        self.box_keys = [rng.getrandbits(64) for _ in range(cell_count)]
+        self.player_keys = [rng.getrandbits(64) for _ in range(cell_count)]
+
+        # Reusable reachability buffers, cleared by bumping the pass mark
+        self.visit_marks = [0] * cell_count
+        self.visit_mark = 0
+        self.came_from = [0] * cell_count
+
+    def _pull_distances(self, target):
+        # Pushes needed to bring a lone box from each cell to target, found by
+        # pulling the box backwards from the target (other boxes are ignored)
+        distances = [INFINITY] * len(self.walkable)
+        distances[target] = 0
+        frontier = [target]
+        while frontier:
+            next_frontier = []
+            for cell in frontier:
+                for d in range(4):
+                    # The box came from the previous cell, pushed by a player behind it
+                    previous = self.neighbors[cell][(d + 2) % 4]
+                    if previous < 0 or not self.box_floor[previous]:
+                        continue
+                    player = self.neighbors[previous][(d + 2) % 4]
+                    if player < 0 or not self.walkable[player]:
+                        continue
+                    if distances[previous] == INFINITY:
+                        distances[previous] = distances[cell] + 1
+                        next_frontier.append(previous)
+            frontier = next_frontier
+        return distances
+
+    def lower_bound(self, boxes):
+        # Cheapest assignment of targets to distinct boxes by push distance
+        costs = [[distances[box] for box in boxes] for distances in self.push_distances]
+        return min_cost_matching(costs)
+
+    def _reach(self, boxes, start):
+        # Marks every cell the player can walk to; returns the smallest one,
+        # which identifies the player's region independently of where in it
+        # the player stands
+        self.visit_mark += 1
+        mark = self.visit_mark
+        visit_marks = self.visit_marks
+        walkable = self.walkable
+        visit_marks[start] = mark
+        stack = [start]
+        lowest = start
+        while stack:
+            cell = stack.pop()
+            if cell < lowest:
+                lowest = cell
+            for neighbor in self.neighbors[cell]:
+                if (neighbor >= 0 and visit_marks[neighbor] != mark
+                        and walkable[neighbor] and neighbor not in boxes):
+                    visit_marks[neighbor] = mark
+                    stack.append(neighbor)
+        return lowest
+
+    def _walk(self, boxes, start, goal):
+        # Shortest walk between two cells without pushing; returns directions
+        self.visit_mark += 1
+        mark = self.visit_mark
+        visit_marks = self.visit_marks
+        came_from = self.came_from
+        visit_marks[start] = mark
+        frontier = [start]
+        while frontier and visit_marks[goal] != mark:
+            next_frontier = []
+            for cell in frontier:
+                for d, neighbor in enumerate(self.neighbors[cell]):
+                    if (neighbor >= 0 and visit_marks[neighbor] != mark
+                            and self.walkable[neighbor] and neighbor not in boxes):
+                        visit_marks[neighbor] = mark
+                        came_from[neighbor] = d
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+
+        path = []
+        cell = goal
+        while cell != start:
+            d = came_from[cell]
+            path.append(d)
+            cell = self.neighbors[cell][(d + 2) % 4]
+        path.reverse()
+        return path
+
+    def solve(self, boxes, player, max_nodes=None, time_limit=None):
+        # boxes are (x, y) tuples and player an (x, y) tuple, as kept by
+        # SokobanBanchou. Finds a plan with the fewest pushes.
+        start_time = time.perf_counter()
+        width = self.width
+        start_boxes = frozenset(y * width + x for x, y in boxes)
+        start_player = player[1] * width + player[0]
+        expanded = 0
+
+        def finish(status, moves=(), pushes=0):
+            return SolveResult(status, list(moves), pushes, expanded,
+                               time.perf_counter() - start_time)
+
+        if len(start_boxes) < len(self.targets):
+            return finish('unsolvable')
+        # With spare boxes a box may rest anywhere, so dead squares only apply
+        # when every box has to end on a target
+        prune_dead = len(start_boxes) == len(self.targets)
+        target_set = frozenset(self.targets)
+
+        boxes_hash = 0
+        for box in start_boxes:
+            boxes_hash ^= self.box_keys[box]
+
+        bounds = {}
+        h = self.lower_bound(start_boxes)
+        if h == INFINITY:
+            return finish('unsolvable')
+        bounds[boxes_hash] = h
+
+        # nodes[i] = (boxes, boxes_hash, player, pushes, parent, push)
+        nodes = [(start_boxes, boxes_hash, start_player, 0, -1, None)]
+        open_heap = [(h, h, 0)]
+        closed = set()
+
+        while open_heap:
+            _, _, node_index = heapq.heappop(open_heap)
+            node_boxes, node_hash, node_player, pushes, _, _ = nodes[node_index]
+
+            region = self._reach(node_boxes, node_player)
+            key = node_hash ^ self.player_keys[region]
+            if key in closed:
+                continue
+            closed.add(key)
+            expanded += 1
+
+            if target_set <= node_boxes:
+                plan = self._plan(nodes, node_index, start_boxes, start_player)
+                return finish('solved', plan, pushes)
+            if max_nodes is not None and expanded >= max_nodes:
+                return finish('limit')
+            if time_limit is not None and time.perf_counter() - start_time > time_limit:
+                return finish('limit')
+
+            # visit_marks still hold this node's reachable region
+            mark = self.visit_mark
+            for box in node_boxes:
+                for d in range(4):
+                    behind = self.neighbors[box][(d + 2) % 4]
+                    ahead = self.neighbors[box][d]
+                    if behind < 0 or ahead < 0 or self.visit_marks[behind] != mark:
+                        continue
+                    if not self.box_floor[ahead] or ahead in node_boxes:
+                        continue
+                    if prune_dead and self.dead[ahead]:
+                        continue
+
+                    child_hash = node_hash ^ self.box_keys[box] ^ self.box_keys[ahead]
+                    child_boxes = node_boxes - {box} | {ahead}
+                    h = bounds.get(child_hash)
+                    if h is None:
+                        h = self.lower_bound(child_boxes)
+                        bounds[child_hash] = h
+                    if h == INFINITY:
+                        continue
+
+                    nodes.append((child_boxes, child_hash, box, pushes + 1, node_index, (box, d)))
+                    heapq.heappush(open_heap, (pushes + 1 + h, h, len(nodes) - 1))
+
+        return finish('unsolvable')
+
+    def _plan(self, nodes, node_index, boxes, player):
+        # Replay the pushes from the start, walking between them
+        pushes = []
+        while nodes[node_index][4] >= 0:
+            pushes.append(nodes[node_index][5])
+            node_index = nodes[node_index][4]
+        pushes.reverse()
+
+        moves = []
+        for box, d in pushes:
+            behind = self.neighbors[box][(d + 2) % 4]
+            for step in self._walk(boxes, player, behind):
+                moves.append(DIRECTIONS[step])
+            moves.append(DIRECTIONS[d])
+            boxes = boxes - {box} | {self.neighbors[box][d]}
+            player = box
+        return moves
+
+
+def solve_game(game, max_nodes=None, time_limit=None):
+    # Solve the current position of a SokobanBanchou game
+    solver = SokobanSolver(game.grid, game.targets)
+    return solver.solve(game.boxes, (game.player_x, game.player_y),
+                        max_nodes=max_nodes, time_limit=time_limit)
+
+
+class HintSearch:
+    # Solves a snapshot of the game on a background thread so run() can keep
+    # drawing frames; poll done and read result once it is set. The search
+    # is pure Python and shares the GIL with the game loop, so the frame
+    # rate drops while it runs; the node and time limits bound how long.
+
+    def __init__(self, game, time_limit=HINT_TIME_LIMIT, max_nodes=HINT_MAX_NODES):
+        self.grid = [row[:] for row in game.grid]
+        self.targets = list(game.targets)
+        self.boxes = list(game.boxes)
+        self.player = (game.player_x, game.player_y)
+        self.board_version = game.board_version
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.result = None
+        self.thread = threading.Thread(target=self._search, daemon=True)
+        self.thread.start()
+
+    def _search(self):
+        # Always leave a result behind, or done would never become true and
+        # the game could not ask for another hint
+        start_time = time.perf_counter()
+        try:
+            solver = SokobanSolver(self.grid, self.targets)
+            self.result = solver.solve(self.boxes, self.player, max_nodes=self.max_nodes,
+                                       time_limit=self.time_limit)
+        except Exception:
+            self.result = SolveResult('failed', [], 0, 0, time.perf_counter() - start_time)
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    def next_move(self):
+        # First move of the solution, or None if there is none
+        if self.result is None or not self.result.solved or not self.result.moves:
+            return None
+        return self.result.moves[0]
+
+
+if __name__ == "__main__":
+    from sokoban_banchou import SokobanBanchou
+
+    game = SokobanBanchou(headless=True)
+    for level in range(1, 6):
+        game.load_level(level)
+        result = solve_game(game, max_nodes=200000)
+        print(f"Level {level}: {result.report()}")
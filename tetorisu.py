@@ -1,10 +1,10 @@
 import pygame
 import random
 import sys
-import time
+from collections import deque
 
-# Initialize pygame
-pygame.init()
+from dirty_rects import DirtyRegions
+from replay import FRAME_TIME, Replay, game_seed
 
 # Colors
 BLACK = (0, 0, 0)
@@ -63,99 +63,151 @@ SIDEBAR_WIDTH = 200
 # Screen dimensions
 SCREEN_WIDTH = BLOCK_SIZE * GRID_WIDTH + SIDEBAR_WIDTH
 SCREEN_HEIGHT = BLOCK_SIZE * GRID_HEIGHT
+SIDEBAR_RECT = (GRID_WIDTH * BLOCK_SIZE, 0, SIDEBAR_WIDTH, SCREEN_HEIGHT)
+
+# Seconds each chain link stays on screen
+CHAIN_FRAME_TIME = 0.3
 
 # Cell types
 EMPTY = 0
-SQUIRREL = 1  # Followed by color index
-HAND = 2      # Followed by value (2, 4, 8, etc.)
+SQUIRREL = 1  # Payload is the index into SQUIRREL_COLORS
+HAND = 2      # Payload is log2 of the value (2, 4, 8, etc.)
+
+# A cell is packed into one small int, type << CELL_BITS | payload, so grid
+# rows are bytearrays and the rules compare cells as plain ints: squirrels
+# of the same color and hands of the same value are equal, and doubling a
+# hand is adding one.
+CELL_BITS = 5
+PAYLOAD_MASK = (1 << CELL_BITS) - 1
+SQUIRREL_BASE = SQUIRREL << CELL_BITS
+HAND_BASE = HAND << CELL_BITS
+
+def squirrel_cell(color_index):
+    return SQUIRREL_BASE | color_index
+
+def hand_cell(value):
+    return HAND_BASE | (value.bit_length() - 1)
+
+def cell_type(cell):
+    return cell >> CELL_BITS
+
+def cell_color(cell):
+    return SQUIRREL_COLORS[cell & PAYLOAD_MASK]
+
+def hand_value(cell):
+    return 1 << (cell & PAYLOAD_MASK)
+
+# The hand that matched squirrels turn into
+NEW_HAND = hand_cell(2)
+
+def build_neighbors():
+    # Precompute the orthogonal neighbors of every cell as (x, y, flat index)
+    neighbors = []
+    for y in range(GRID_HEIGHT):
+        for x in range(GRID_WIDTH):
+            cell = []
+            for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+                nx, ny = x + dx, y + dy
+                if 0 <= nx < GRID_WIDTH and 0 <= ny < GRID_HEIGHT:
+                    cell.append((nx, ny, ny * GRID_WIDTH + nx))
+            neighbors.append(tuple(cell))
+    return tuple(neighbors)
+
+NEIGHBORS = build_neighbors()
+CELL_COUNT = GRID_WIDTH * GRID_HEIGHT
+
+# Every horizontal pair (by its left cell) and vertical pair (by its upper
+# cell) in scan order, for merge passes over the whole board
+ALL_HORIZONTAL_PAIRS = tuple(i for i in range(CELL_COUNT) if i % GRID_WIDTH < GRID_WIDTH - 1)
+ALL_VERTICAL_PAIRS = tuple(range(CELL_COUNT - GRID_WIDTH))
 
-# Tetris shapes (modified to include squirrels and hands)
+# Piece shapes (1 marks a cell). The first ones are made of squirrels and
+# new_piece picks their colors; the hand shapes always hold 2-hands.
 SHAPES = [
-    # I shape
-    [[{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)} for _ in range(4)]],
-    
-    # O shape
-    [[{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}],
-     [{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}]],
-    
-    # T shape
-    [[{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}],
-     [None, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      None]],
-    
-    # L shape
-    [[{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}],
-     [{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      None, 
-      None]],
-    
-    # J shape
-    [[{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}],
-     [None, 
-      None, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}]],
-    
-    # S shape
-    [[None, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}],
-     [{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      None]],
-    
-    # Z shape
-    [[{'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      None],
-     [None, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}, 
-      {'type': SQUIRREL, 'value': random.choice(SQUIRREL_COLORS)}]]
+    [[1, 1, 1, 1]],  # I
+    [[1, 1], [1, 1]],  # O
+    [[1, 1, 1], [0, 1, 0]],  # T
+    [[1, 1, 1], [1, 0, 0]],  # L
+    [[1, 1, 1], [0, 0, 1]],  # J
+    [[0, 1, 1], [1, 1, 0]],  # S
+    [[1, 1, 0], [0, 1, 1]]   # Z
 ]
 
 # Special shapes with hands
 HAND_SHAPES = [
-    # Single hand
-    [[{'type': HAND, 'value': 2}]],
-    
-    # Double hand
-    [[{'type': HAND, 'value': 2}, {'type': HAND, 'value': 2}]],
-    
-    # Triple hand
-    [[{'type': HAND, 'value': 2}, {'type': HAND, 'value': 2}, {'type': HAND, 'value': 2}]]
+    [[1]],  # Single hand
+    [[1, 1]],  # Double hand
+    [[1, 1, 1]]  # Triple hand
 ]
 
+def build_piece_catalog():
+    # Precompute the cell offsets of every rotation state of every shape.
+    # Offsets are listed in the same cell order for every rotation, so a
+    # piece's per-cell colors never have to be rearranged when it turns.
+    offsets, widths = [], []
+    for shape in SHAPES + HAND_SHAPES:
+        cells = tuple((x, y) for y, row in enumerate(shape) for x, cell in enumerate(row) if cell)
+        rows = len(shape)
+        states = []
+        for _ in range(4):
+            states.append(cells)
+            # Rotate 90 degrees clockwise: (x, y) -> (rows - 1 - y, x)
+            cells = tuple((rows - 1 - y, x) for x, y in cells)
+            rows = max(y for _, y in cells) + 1
+        offsets.append(tuple(states))
+        widths.append(tuple(max(x for x, _ in state) + 1 for state in states))
+    return tuple(offsets), tuple(widths)
+
+# Immutable piece catalog, indexed by [piece type][rotation]. Piece types
+# are the indices of SHAPES followed by those of HAND_SHAPES.
+PIECE_OFFSETS, PIECE_WIDTHS = build_piece_catalog()
+HAND_PIECE_START = len(SHAPES)
+
+# Hand pieces never change, so every instance shares one cell tuple
+HAND_PIECE_CELLS = tuple((NEW_HAND,) * len(PIECE_OFFSETS[HAND_PIECE_START + i][0])
+                         for i in range(len(HAND_SHAPES)))
+
 class TetoRisu:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("TetoRisu - Te (Hand) + To (And) + Risu (Squirrel)")
-        self.clock = pygame.time.Clock()
-        self.fonts = {
-            'small': pygame.font.SysFont('Arial', 16),
-            'medium': pygame.font.SysFont('Arial', 24),
-            'large': pygame.font.SysFont('Arial', 32),
-            'xlarge': pygame.font.SysFont('Arial', 48)
-        }
-        
-        # Load images
-        self.squirrel_img = pygame.Surface((BLOCK_SIZE-4, BLOCK_SIZE-4))
-        self.squirrel_img.fill(RED)  # Placeholder for squirrel image
-        self.hand_img = pygame.Surface((BLOCK_SIZE-4, BLOCK_SIZE-4))
-        self.hand_img.fill(HAND_COLORS[2])  # Placeholder for hand image
+    def __init__(self, headless=False, seed=None):
+        self.headless = headless
+        # Per-game generator, so a seed reproduces the piece sequence. The
+        # seed is kept so a recorded session can be replayed.
+        self.seed = game_seed(seed)
+        self.random = random.Random(self.seed)
+        # Game time advances FRAME_TIME per update(), not with the wall clock
+        self.frame = 0
+        if not headless:
+            # Initialize pygame
+            pygame.init()
+            
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            pygame.display.set_caption("TetoRisu - Te (Hand) + To (And) + Risu (Squirrel)")
+            self.clock = pygame.time.Clock()
+            self.fonts = {
+                'small': pygame.font.SysFont('Arial', 16),
+                'medium': pygame.font.SysFont('Arial', 24),
+                'large': pygame.font.SysFont('Arial', 32),
+                'xlarge': pygame.font.SysFont('Arial', 48)
+            }
+        
+            # Load images
+            self.squirrel_img = pygame.Surface((BLOCK_SIZE-4, BLOCK_SIZE-4))
+            self.squirrel_img.fill(RED)  # Placeholder for squirrel image
+            self.hand_img = pygame.Surface((BLOCK_SIZE-4, BLOCK_SIZE-4))
+            self.hand_img.fill(HAND_COLORS[2])  # Placeholder for hand image
+            
+            self.dirty = DirtyRegions(self.screen, self.draw_background)
         
         self.reset_game()
 
-    def reset_game(self):
-        # Initialize grid with empty cells
-        self.grid = [[EMPTY for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+    def reset_game(self, seed=None):
+        # A seed restarts the piece sequence; otherwise the stream continues
+        if seed is not None:
+            self.seed = game_seed(seed)
+            self.random.seed(seed)
+        
+        # Initialize grid with empty cells (one bytearray of packed cells per row)
+        self.grid = [bytearray(GRID_WIDTH) for _ in range(GRID_HEIGHT)]
         self.current_piece = self.new_piece()
         self.next_piece = self.new_piece()
         self.game_over = False
@@ -164,76 +216,72 @@ class TetoRisu:
         self.lines_cleared = 0
         self.fall_time = 0
         self.fall_speed = 0.5  # Time in seconds between automatic piece movements
-        self.last_fall_time = time.time()
+        self.last_fall_time = self.frame * FRAME_TIME
         self.combo_count = 0
         self.max_hand_value = 2
+        
+        # Boards to show for each chain link, played back by run()
+        self.animation_queue = deque()
+        self.frame_start_time = None
 
     def new_piece(self):
-        # Choose between squirrel piece and hand piece
-        if random.random() < 0.8:  # 80% chance for squirrel piece
-            shape_idx = random.randint(0, len(SHAPES) - 1)
-            shape = SHAPES[shape_idx]
+        # A piece is a shared template from the catalog plus its own tuple of
+        # packed cells, one per template cell
+        if self.random.random() < 0.8:  # 80% chance for squirrel piece
+            piece_type = self.random.randint(0, len(SHAPES) - 1)
             
             # Randomize colors for each cell
-            for row in shape:
-                for i in range(len(row)):
-                    if row[i] is not None:
-                        row[i]['value'] = random.choice(SQUIRREL_COLORS)
+            cells = tuple(squirrel_cell(self.random.randrange(len(SQUIRREL_COLORS)))
+                          for _ in PIECE_OFFSETS[piece_type][0])
         else:  # 20% chance for hand piece
-            shape_idx = random.randint(0, len(HAND_SHAPES) - 1)
-            shape = HAND_SHAPES[shape_idx]
+            hand_idx = self.random.randint(0, len(HAND_SHAPES) - 1)
+            piece_type = HAND_PIECE_START + hand_idx
+            cells = HAND_PIECE_CELLS[hand_idx]
         
         # Starting position
-        x = GRID_WIDTH // 2 - len(shape[0]) // 2
+        x = GRID_WIDTH // 2 - PIECE_WIDTHS[piece_type][0] // 2
         y = 0
         
-        return {'shape': shape, 'x': x, 'y': y}
+        return {'type': piece_type, 'rotation': 0, 'cells': cells, 'x': x, 'y': y}
 
     def valid_move(self, piece, x_offset=0, y_offset=0):
-        for y, row in enumerate(piece['shape']):
-            for x, cell in enumerate(row):
-                if cell is not None:
-                    new_x = piece['x'] + x + x_offset
-                    new_y = piece['y'] + y + y_offset
-                    
-                    # Check if the move is within boundaries
-                    if new_x < 0 or new_x >= GRID_WIDTH or new_y >= GRID_HEIGHT:
-                        return False
-                    
-                    # Check if the cell is already occupied
-                    if new_y >= 0 and self.grid[new_y][new_x] != EMPTY:
-                        return False
+        piece_x = piece['x'] + x_offset
+        piece_y = piece['y'] + y_offset
+        for x, y in PIECE_OFFSETS[piece['type']][piece['rotation']]:
+            new_x = piece_x + x
+            new_y = piece_y + y
+            
+            # Check if the move is within boundaries
+            if new_x < 0 or new_x >= GRID_WIDTH or new_y >= GRID_HEIGHT:
+                return False
+            
+            # Check if the cell is already occupied
+            if new_y >= 0 and self.grid[new_y][new_x] != EMPTY:
+                return False
         return True
 
     def rotate_piece(self, piece):
-        # Create a new rotated shape (90 degrees clockwise)
-        rows = len(piece['shape'])
-        cols = len(piece['shape'][0])
-        rotated = [[None for _ in range(rows)] for _ in range(cols)]
-        
-        for y in range(rows):
-            for x in range(cols):
-                if piece['shape'][y][x] is not None:
-                    rotated[x][rows - 1 - y] = piece['shape'][y][x]
+        # Turn the piece 90 degrees clockwise; the rotated piece shares the
+        # cells of the original
+        temp_piece = dict(piece, rotation=(piece['rotation'] + 1) % 4)
         
         # Check if the rotated piece is valid
-        temp_piece = {'shape': rotated, 'x': piece['x'], 'y': piece['y']}
         if self.valid_move(temp_piece):
             return temp_piece
         return piece
 
     def lock_piece(self, piece):
-        for y, row in enumerate(piece['shape']):
-            for x, cell in enumerate(row):
-                if cell is not None:
-                    # Add the piece to the grid
-                    grid_y = piece['y'] + y
-                    grid_x = piece['x'] + x
-                    if grid_y >= 0:  # Only add if it's within the grid
-                        self.grid[grid_y][grid_x] = cell
+        # Lock the piece in place; returns the chain events
+        offsets = PIECE_OFFSETS[piece['type']][piece['rotation']]
+        for (x, y), cell in zip(offsets, piece['cells']):
+            # Add the piece to the grid
+            grid_y = piece['y'] + y
+            grid_x = piece['x'] + x
+            if grid_y >= 0:  # Only add if it's within the grid
+                self.grid[grid_y][grid_x] = cell
         
         # Check for matches and merges
-        self.check_matches()
+        events = self.check_matches()
         
         # Check for completed lines
         self.check_lines()
@@ -245,33 +293,40 @@ class TetoRisu:
         # Check if game is over
         if not self.valid_move(self.current_piece):
             self.game_over = True
+        
+        return events
 
     def check_matches(self):
-        # Check for squirrel matches (Puyo Puyo style)
+        # Check for squirrel matches (Puyo Puyo style). The chain resolves
+        # immediately; returns one event per link with the squirrels turned
+        # into hands, the hand merges, the falls, the score gained and the
+        # resulting board.
+        events = []
         matches_found = True
         chain_count = 0
+        grid = self.grid
         
         while matches_found:
             matches_found = False
-            visited = [[False for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+            pops = []
+            score_before = self.score
+            visited = bytearray(GRID_WIDTH * GRID_HEIGHT)
             
             for y in range(GRID_HEIGHT):
+                row = grid[y]
                 for x in range(GRID_WIDTH):
-                    if (self.grid[y][x] != EMPTY and 
-                        isinstance(self.grid[y][x], dict) and 
-                        self.grid[y][x]['type'] == SQUIRREL and 
-                        not visited[y][x]):
-                        
+                    cell = row[x]
+                    if SQUIRREL_BASE <= cell < HAND_BASE and not visited[y * GRID_WIDTH + x]:
                         # Find all connected squirrels of the same color
-                        color = self.grid[y][x]['value']
                         connected = []
-                        self.find_connected_squirrels(x, y, color, visited, connected)
+                        self.find_connected_squirrels(x, y, cell, visited, connected)
                         
                         # If 4 or more connected, transform them into hands
                         if len(connected) >= 4:
                             matches_found = True
                             for cx, cy in connected:
-                                self.grid[cy][cx] = {'type': HAND, 'value': 2}
+                                grid[cy][cx] = NEW_HAND
+                            pops.extend(connected)
                             
                             # Add score based on number of squirrels popped
                             points = len(connected) * 10 * (chain_count + 1)
@@ -282,114 +337,183 @@ class TetoRisu:
                 self.combo_count = max(self.combo_count, chain_count)
                 
                 # Apply gravity after matches
-                self.apply_gravity()
+                falls = self.apply_gravity()
                 
-                # Check for hand merges (2048 style)
-                self.check_hand_merges()
+                # Check for hand merges (2048 style). Hands that landed
+                # before the chain were never merge-checked, so the first
+                # link examines the whole board; later links only need the
+                # cells this link changed.
+                if chain_count == 1:
+                    dirty = None
+                else:
+                    dirty = {y * GRID_WIDTH + x for x, y in pops}
+                    for x, from_y, to_y in falls:
+                        dirty.add(from_y * GRID_WIDTH + x)
+                        dirty.add(to_y * GRID_WIDTH + x)
+                merges, merge_falls = self.check_hand_merges(dirty)
                 
-                # Add a small delay to show the chain reaction
-                self.draw()
-                pygame.display.flip()
-                pygame.time.delay(300)
-
-    def find_connected_squirrels(self, x, y, color, visited, connected):
-        # Find all connected squirrels of the same color using DFS
-        if (x < 0 or x >= GRID_WIDTH or y < 0 or y >= GRID_HEIGHT or 
-            visited[y][x] or self.grid[y][x] == EMPTY or 
-            not isinstance(self.grid[y][x], dict) or
-            self.grid[y][x]['type'] != SQUIRREL or 
-            self.grid[y][x]['value'] != color):
-            return
+                events.append({
+                    'chain': chain_count,
+                    'pops': pops,
+                    'merges': merges,
+                    'falls': falls + merge_falls,
+                    'score': self.score - score_before,
+                    'grid': [row[:] for row in self.grid]
+                })
         
-        visited[y][x] = True
-        connected.append((x, y))
-        
-        # Check all four directions
-        self.find_connected_squirrels(x + 1, y, color, visited, connected)
-        self.find_connected_squirrels(x - 1, y, color, visited, connected)
-        self.find_connected_squirrels(x, y + 1, color, visited, connected)
-        self.find_connected_squirrels(x, y - 1, color, visited, connected)
+        return events
+
+    def find_connected_squirrels(self, x, y, cell, visited, connected):
+        # Find all squirrels connected to (x, y) with the same packed cell
+        # (same color) using an iterative search; visited is a flat bytearray
+        grid = self.grid
+        start = y * GRID_WIDTH + x
+        visited[start] = 1
+        stack = [(x, y, start)]
+        while stack:
+            x, y, index = stack.pop()
+            connected.append((x, y))
+            for neighbor in NEIGHBORS[index]:
+                nx, ny, nindex = neighbor
+                if not visited[nindex] and grid[ny][nx] == cell:
+                    visited[nindex] = 1
+                    stack.append(neighbor)
 
-    def check_hand_merges(self):
-        # Check for hand merges (2048 style)
-        merged = True
+    def check_hand_merges(self, dirty=None):
+        # Check for hand merges (2048 style); returns the merges as
+        # (x, y, value) and the falls they caused. Two hands merge when their
+        # packed cells are equal, and the merged hand is that cell plus one.
+        #
+        # Merge order: each round merges horizontal pairs into the left hand,
+        # scanning rows top to bottom and left to right, then vertical pairs
+        # into the upper hand in the same order, then settles the columns
+        # that gained holes. Rounds repeat until nothing merges.
+        #
+        # The board is settled and merge-free apart from the cells in dirty
+        # (flat indices; None means every cell), so a round only looks at
+        # pairs containing a cell changed since that pair was last examined.
+        # A cascade costs time in proportion to its merges and falls.
+        merges = []
+        falls = []
+        grid = self.grid
+        full_pass = dirty is None
+        dirty_horizontal = set() if full_pass else set(dirty)
+        dirty_vertical = set(dirty_horizontal)
         
-        while merged:
-            merged = False
+        while full_pass or dirty_horizontal or dirty_vertical:
+            # Lowest new hole per column, for gravity
+            holes = {}
             
-            # Check horizontal merges
-            for y in range(GRID_HEIGHT):
-                for x in range(GRID_WIDTH - 1):
-                    if (self.grid[y][x] != EMPTY and 
-                        isinstance(self.grid[y][x], dict) and 
-                        self.grid[y][x]['type'] == HAND and 
-                        self.grid[y][x+1] != EMPTY and 
-                        isinstance(self.grid[y][x+1], dict) and 
-                        self.grid[y][x+1]['type'] == HAND and 
-                        self.grid[y][x]['value'] == self.grid[y][x+1]['value']):
-                        
-                        # Merge hands
-                        value = self.grid[y][x]['value'] * 2
-                        self.grid[y][x] = {'type': HAND, 'value': value}
-                        self.grid[y][x+1] = EMPTY
-                        
-                        # Update score and max hand value
-                        self.score += value
-                        self.max_hand_value = max(self.max_hand_value, value)
-                        merged = True
+            # Check horizontal merges, keyed by the left cell
+            if full_pass:
+                pairs = ALL_HORIZONTAL_PAIRS
+            else:
+                pairs = set()
+                for index in dirty_horizontal:
+                    x = index % GRID_WIDTH
+                    if x > 0:
+                        pairs.add(index - 1)
+                    if x < GRID_WIDTH - 1:
+                        pairs.add(index)
+                pairs = sorted(pairs)
+            changed_horizontal = set()
+            for index in pairs:
+                y, x = divmod(index, GRID_WIDTH)
+                row = grid[y]
+                cell = row[x]
+                if cell >= HAND_BASE and cell == row[x+1]:
+                    # Merge hands
+                    row[x] = cell + 1
+                    row[x+1] = EMPTY
+                    value = hand_value(cell + 1)
+                    merges.append((x, y, value))
+                    changed_horizontal.add(index)
+                    changed_horizontal.add(index + 1)
+                    holes[x+1] = max(holes.get(x+1, -1), y)
+                    
+                    # Update score and max hand value
+                    self.score += value
+                    self.max_hand_value = max(self.max_hand_value, value)
             
-            # Check vertical merges
-            for y in range(GRID_HEIGHT - 1):
-                for x in range(GRID_WIDTH):
-                    if (self.grid[y][x] != EMPTY and 
-                        isinstance(self.grid[y][x], dict) and 
-                        self.grid[y][x]['type'] == HAND and 
-                        self.grid[y+1][x] != EMPTY and 
-                        isinstance(self.grid[y+1][x], dict) and 
-                        self.grid[y+1][x]['type'] == HAND and 
-                        self.grid[y][x]['value'] == self.grid[y+1][x]['value']):
-                        
-                        # Merge hands
-                        value = self.grid[y][x]['value'] * 2
-                        self.grid[y][x] = {'type': HAND, 'value': value}
-                        self.grid[y+1][x] = EMPTY
-                        
-                        # Update score and max hand value
-                        self.score += value
-                        self.max_hand_value = max(self.max_hand_value, value)
-                        merged = True
+            # Check vertical merges, keyed by the upper cell
+            if full_pass:
+                pairs = ALL_VERTICAL_PAIRS
+            else:
+                pairs = set()
+                for index in dirty_vertical | changed_horizontal:
+                    if index >= GRID_WIDTH:
+                        pairs.add(index - GRID_WIDTH)
+                    if index < CELL_COUNT - GRID_WIDTH:
+                        pairs.add(index)
+                pairs = sorted(pairs)
+            changed_vertical = set()
+            for index in pairs:
+                y, x = divmod(index, GRID_WIDTH)
+                cell = grid[y][x]
+                if cell >= HAND_BASE and cell == grid[y+1][x]:
+                    # Merge hands
+                    grid[y][x] = cell + 1
+                    grid[y+1][x] = EMPTY
+                    value = hand_value(cell + 1)
+                    merges.append((x, y, value))
+                    changed_vertical.add(index)
+                    changed_vertical.add(index + GRID_WIDTH)
+                    holes[x] = max(holes.get(x, -1), y + 1)
+                    
+                    # Update score and max hand value
+                    self.score += value
+                    self.max_hand_value = max(self.max_hand_value, value)
+            
+            # Apply gravity to the columns with new holes
+            moved = self.apply_gravity(dict(sorted(holes.items())))
+            falls.extend(moved)
+            fallen = set()
+            for x, from_y, to_y in moved:
+                fallen.add(from_y * GRID_WIDTH + x)
+                fallen.add(to_y * GRID_WIDTH + x)
             
-            # Apply gravity after merges
-            if merged:
-                self.apply_gravity()
+            # Horizontal pairs before a horizontal merge in scan order have
+            # not seen it yet; vertical pairs have
+            dirty_horizontal = changed_horizontal | changed_vertical | fallen
+            dirty_vertical = changed_vertical | fallen
+            full_pass = False
+        
+        return merges, falls
 
-    def apply_gravity(self):
-        # Apply gravity to make pieces fall
-        for x in range(GRID_WIDTH):
-            # Start from the bottom and move up
+    def apply_gravity(self, dirty_columns=None):
+        # Apply gravity to make pieces fall. dirty_columns maps a column to the
+        # lowest row that changed; everything below it is already settled.
+        # None settles the whole board. Returns the falls as (x, from_y, to_y).
+        if dirty_columns is None:
+            dirty_columns = dict.fromkeys(range(GRID_WIDTH), GRID_HEIGHT - 1)
+        falls = []
+        for x, bottom in dirty_columns.items():
+            # Start from the lowest changed row and move up
             empty_y = None
-            for y in range(GRID_HEIGHT - 1, -1, -1):
+            for y in range(bottom, -1, -1):
                 if self.grid[y][x] == EMPTY and empty_y is None:
                     empty_y = y
                 elif self.grid[y][x] != EMPTY and empty_y is not None:
                     # Move piece down
                     self.grid[empty_y][x] = self.grid[y][x]
                     self.grid[y][x] = EMPTY
+                    falls.append((x, y, empty_y))
                     empty_y -= 1
+        return falls
 
     def check_lines(self):
         # Check for completed lines (Tetris style)
         lines_to_clear = []
         
         for y in range(GRID_HEIGHT):
-            if all(self.grid[y][x] != EMPTY for x in range(GRID_WIDTH)):
+            if EMPTY not in self.grid[y]:
                 lines_to_clear.append(y)
         
         for line in lines_to_clear:
             # Remove the line
             del self.grid[line]
             # Add a new empty line at the top
-            self.grid.insert(0, [EMPTY for _ in range(GRID_WIDTH)])
+            self.grid.insert(0, bytearray(GRID_WIDTH))
         
         # Update score
         if lines_to_clear:
@@ -402,29 +526,72 @@ class TetoRisu:
             # Increase speed with level
             self.fall_speed = max(0.1, 0.5 - (self.level - 1) * 0.05)
 
-    def draw_grid(self):
-        # Draw the game grid
+    def draw_background(self, surface):
+        # Static layer: cell outlines, sidebar panel and the fixed sidebar text
+        surface.fill(BLACK)
         for y in range(GRID_HEIGHT):
             for x in range(GRID_WIDTH):
-                # Draw grid cell
-                pygame.draw.rect(
-                    self.screen,
-                    DARK_GRAY,
-                    [x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE],
-                    1
-                )
-                
-                # If cell is occupied, draw the piece
-                if self.grid[y][x] != EMPTY:
-                    self.draw_cell(x, y, self.grid[y][x])
+                pygame.draw.rect(surface, DARK_GRAY, [x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE], 1)
+        pygame.draw.rect(surface, (50, 50, 50), SIDEBAR_RECT)
+        
+        # Draw game title
+        title_text = self.fonts['large'].render("TetoRisu", True, WHITE)
+        surface.blit(title_text, (GRID_WIDTH * BLOCK_SIZE + 10, 10))
+        
+        subtitle_text = self.fonts['small'].render("Te (Hand) + To (And) + Risu (Squirrel)", True, WHITE)
+        surface.blit(subtitle_text, (GRID_WIDTH * BLOCK_SIZE + 10, 50))
+        
+        # Draw next piece text
+        next_text = self.fonts['medium'].render("Next:", True, WHITE)
+        surface.blit(next_text, (GRID_WIDTH * BLOCK_SIZE + 10, 150))
+        
+        # Draw game instructions
+        instructions = [
+            "Controls:",
+            "← → : Move",
+            "↑ : Rotate",
+            "↓ : Soft Drop",
+            "Space : Hard Drop",
+            "",
+            "Match 4+ squirrels",
+            "to create hands",
+            "",
+            "Merge same-value",
+            "hands to double them"
+        ]
+        
+        y_pos = 320
+        for instruction in instructions:
+            instr_text = self.fonts['small'].render(instruction, True, WHITE)
+            surface.blit(instr_text, (GRID_WIDTH * BLOCK_SIZE + 10, y_pos))
+            y_pos += 25
+
+    def draw_grid(self, grid=None, piece=None):
+        # Draw the cells of the game grid (or a board from the chain
+        # animation) that changed, with the falling piece on top
+        if grid is None:
+            grid = self.grid
+        piece_cells = {}
+        if piece is not None:
+            offsets = PIECE_OFFSETS[piece['type']][piece['rotation']]
+            for (x, y), cell in zip(offsets, piece['cells']):
+                piece_cells[(piece['x'] + x, piece['y'] + y)] = cell
+        
+        for y in range(GRID_HEIGHT):
+            row = grid[y]
+            for x in range(GRID_WIDTH):
+                cell = piece_cells.get((x, y), row[x])
+                if self.dirty.changed((x, y), cell, (x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE, BLOCK_SIZE)) \
+                        and cell != EMPTY:
+                    self.draw_cell(x, y, cell)
 
     def draw_cell(self, x, y, cell):
-        # Draw a cell at the specified position
-        if cell['type'] == SQUIRREL:
+        # Draw a packed cell at the specified position
+        if cell_type(cell) == SQUIRREL:
             # Draw squirrel
             pygame.draw.circle(
                 self.screen,
-                cell['value'],
+                cell_color(cell),
                 (x * BLOCK_SIZE + BLOCK_SIZE // 2, y * BLOCK_SIZE + BLOCK_SIZE // 2),
                 BLOCK_SIZE // 2 - 4
             )
@@ -441,11 +608,12 @@ class TetoRisu:
                 (x * BLOCK_SIZE + BLOCK_SIZE * 2 // 3, y * BLOCK_SIZE + BLOCK_SIZE // 3),
                 3
             )
-        elif cell['type'] == HAND:
+        elif cell_type(cell) == HAND:
             # Draw hand
+            value = hand_value(cell)
             pygame.draw.rect(
                 self.screen,
-                HAND_COLORS.get(cell['value'], (60, 58, 50)),
+                HAND_COLORS.get(value, (60, 58, 50)),
                 [x * BLOCK_SIZE + 2, y * BLOCK_SIZE + 2, BLOCK_SIZE - 4, BLOCK_SIZE - 4],
                 0,
                 5  # Rounded corners
@@ -453,93 +621,74 @@ class TetoRisu:
             
             # Draw value text
             font_size = 'medium'
-            if cell['value'] >= 1000:
+            if value >= 1000:
                 font_size = 'small'
             
-            text = self.fonts[font_size].render(str(cell['value']), True, TEXT_COLORS.get(cell['value'], WHITE))
+            text = self.fonts[font_size].render(str(value), True, TEXT_COLORS.get(value, WHITE))
             text_rect = text.get_rect(center=(x * BLOCK_SIZE + BLOCK_SIZE // 2, y * BLOCK_SIZE + BLOCK_SIZE // 2))
             self.screen.blit(text, text_rect)
 
-    def draw_current_piece(self):
-        # Draw the current piece
-        for y, row in enumerate(self.current_piece['shape']):
-            for x, cell in enumerate(row):
-                if cell is not None:
-                    # Only draw if the cell is within the visible grid
-                    if self.current_piece['y'] + y >= 0:
-                        self.draw_cell(
-                            self.current_piece['x'] + x,
-                            self.current_piece['y'] + y,
-                            cell
-                        )
-
     def draw_next_piece(self):
         # Draw the next piece in the sidebar
         next_x = GRID_WIDTH * BLOCK_SIZE + 50
         next_y = 150
         
         # Draw the next piece preview
-        for y, row in enumerate(self.next_piece['shape']):
-            for x, cell in enumerate(row):
-                if cell is not None:
-                    if cell['type'] == SQUIRREL:
-                        pygame.draw.circle(
-                            self.screen,
-                            cell['value'],
-                            (next_x + x * BLOCK_SIZE + BLOCK_SIZE // 2, 
-                             next_y + y * BLOCK_SIZE + BLOCK_SIZE // 2),
-                            BLOCK_SIZE // 2 - 4
-                        )
-                        # Draw eyes
-                        pygame.draw.circle(
-                            self.screen,
-                            BLACK,
-                            (next_x + x * BLOCK_SIZE + BLOCK_SIZE // 3, 
-                             next_y + y * BLOCK_SIZE + BLOCK_SIZE // 3),
-                            3
-                        )
-                        pygame.draw.circle(
-                            self.screen,
-                            BLACK,
-                            (next_x + x * BLOCK_SIZE + BLOCK_SIZE * 2 // 3, 
-                             next_y + y * BLOCK_SIZE + BLOCK_SIZE // 3),
-                            3
-                        )
-                    elif cell['type'] == HAND:
-                        pygame.draw.rect(
-                            self.screen,
-                            HAND_COLORS.get(cell['value'], (60, 58, 50)),
-                            [next_x + x * BLOCK_SIZE + 2, 
-                             next_y + y * BLOCK_SIZE + 2, 
-                             BLOCK_SIZE - 4, BLOCK_SIZE - 4],
-                            0,
-                            5  # Rounded corners
-                        )
+        piece = self.next_piece
+        offsets = PIECE_OFFSETS[piece['type']][piece['rotation']]
+        for (x, y), cell in zip(offsets, piece['cells']):
+            if cell_type(cell) == SQUIRREL:
+                pygame.draw.circle(
+                    self.screen,
+                    cell_color(cell),
+                    (next_x + x * BLOCK_SIZE + BLOCK_SIZE // 2, 
+                     next_y + y * BLOCK_SIZE + BLOCK_SIZE // 2),
+                    BLOCK_SIZE // 2 - 4
+                )
+                # Draw eyes
+                pygame.draw.circle(
+                    self.screen,
+                    BLACK,
+                    (next_x + x * BLOCK_SIZE + BLOCK_SIZE // 3, 
+                     next_y + y * BLOCK_SIZE + BLOCK_SIZE // 3),
+                    3
+                )
+                pygame.draw.circle(
+                    self.screen,
+                    BLACK,
+                    (next_x + x * BLOCK_SIZE + BLOCK_SIZE * 2 // 3, 
+                     next_y + y * BLOCK_SIZE + BLOCK_SIZE // 3),
+                    3
+                )
+            elif cell_type(cell) == HAND:
+                value = hand_value(cell)
+                pygame.draw.rect(
+                    self.screen,
+                    HAND_COLORS.get(value, (60, 58, 50)),
+                    [next_x + x * BLOCK_SIZE + 2, 
+                     next_y + y * BLOCK_SIZE + 2, 
+                     BLOCK_SIZE - 4, BLOCK_SIZE - 4],
+                    0,
+                    5  # Rounded corners
+                )
                         
-                        # Draw value text
-                        font_size = 'medium'
-                        if cell['value'] >= 1000:
-                            font_size = 'small'
+                # Draw value text
+                font_size = 'medium'
+                if value >= 1000:
+                    font_size = 'small'
                         
-                        text = self.fonts[font_size].render(str(cell['value']), True, TEXT_COLORS.get(cell['value'], WHITE))
-                        text_rect = text.get_rect(center=(next_x + x * BLOCK_SIZE + BLOCK_SIZE // 2, 
-                                                         next_y + y * BLOCK_SIZE + BLOCK_SIZE // 2))
-                        self.screen.blit(text, text_rect)
+                text = self.fonts[font_size].render(str(value), True, TEXT_COLORS.get(value, WHITE))
+                text_rect = text.get_rect(center=(next_x + x * BLOCK_SIZE + BLOCK_SIZE // 2, 
+                                                 next_y + y * BLOCK_SIZE + BLOCK_SIZE // 2))
+                self.screen.blit(text, text_rect)
 
     def draw_sidebar(self):
-        # Draw sidebar background
-        pygame.draw.rect(
-            self.screen,
-            (50, 50, 50),
-            [GRID_WIDTH * BLOCK_SIZE, 0, SIDEBAR_WIDTH, SCREEN_HEIGHT]
-        )
-        
-        # Draw game title
-        title_text = self.fonts['large'].render("TetoRisu", True, WHITE)
-        self.screen.blit(title_text, (GRID_WIDTH * BLOCK_SIZE + 10, 10))
-        
-        subtitle_text = self.fonts['small'].render("Te (Hand) + To (And) + Risu (Squirrel)", True, WHITE)
-        self.screen.blit(subtitle_text, (GRID_WIDTH * BLOCK_SIZE + 10, 50))
+        # Redrawn only when one of its values changes
+        piece = self.next_piece
+        key = (self.score, self.level, piece['type'], piece['cells'], self.max_hand_value,
+               self.combo_count, self.game_over)
+        if not self.dirty.changed('sidebar', key, SIDEBAR_RECT):
+            return
         
         # Draw score
         score_text = self.fonts['medium'].render(f"Score: {self.score}", True, WHITE)
@@ -549,10 +698,6 @@ class TetoRisu:
         level_text = self.fonts['medium'].render(f"Level: {self.level}", True, WHITE)
         self.screen.blit(level_text, (GRID_WIDTH * BLOCK_SIZE + 10, 110))
         
-        # Draw next piece text
-        next_text = self.fonts['medium'].render("Next:", True, WHITE)
-        self.screen.blit(next_text, (GRID_WIDTH * BLOCK_SIZE + 10, 150))
-        
         # Draw the next piece
         self.draw_next_piece()
         
@@ -564,27 +709,6 @@ class TetoRisu:
         combo_text = self.fonts['medium'].render(f"Max Combo: {self.combo_count}", True, WHITE)
         self.screen.blit(combo_text, (GRID_WIDTH * BLOCK_SIZE + 10, 280))
         
-        # Draw game instructions
-        instructions = [
-            "Controls:",
-            "← → : Move",
-            "↑ : Rotate",
-            "↓ : Soft Drop",
-            "Space : Hard Drop",
-            "",
-            "Match 4+ squirrels",
-            "to create hands",
-            "",
-            "Merge same-value",
-            "hands to double them"
-        ]
-        
-        y_pos = 320
-        for instruction in instructions:
-            instr_text = self.fonts['small'].render(instruction, True, WHITE)
-            self.screen.blit(instr_text, (GRID_WIDTH * BLOCK_SIZE + 10, y_pos))
-            y_pos += 25
-        
         # Draw game over text if game is over
         if self.game_over:
             game_over_text = self.fonts['large'].render("GAME OVER", True, RED)
@@ -594,65 +718,104 @@ class TetoRisu:
             self.screen.blit(restart_text, (GRID_WIDTH * BLOCK_SIZE + 10, 640))
 
     def draw(self):
-        # Draw everything
-        self.screen.fill(BLACK)
-        self.draw_grid()
-        if not self.game_over:
-            self.draw_current_piece()
+        # Draw what changed since the last frame
+        self.dirty.begin()
+        if self.animation_queue:
+            # The next piece waits until the chain has been shown
+            self.draw_grid(self.animation_queue[0])
+        else:
+            self.draw_grid(piece=None if self.game_over else self.current_piece)
         self.draw_sidebar()
 
-    def run(self):
+    def queue_chain_animation(self, events):
+        # Queue the board after each chain link for playback by run()
+        for event in events:
+            self.animation_queue.append(event['grid'])
+
+    def update_animation(self, current_time):
+        # Advance the chain animation by one frame; returns True while it plays
+        if not self.animation_queue:
+            return False
+        if self.frame_start_time is None:
+            self.frame_start_time = current_time
+        elif current_time - self.frame_start_time >= CHAIN_FRAME_TIME:
+            self.animation_queue.popleft()
+            self.frame_start_time = current_time if self.animation_queue else None
+        if not self.animation_queue:
+            # Give the next piece a full fall interval once the chain is over
+            self.last_fall_time = current_time
+            return False
+        return True
+
+    def handle_key(self, key):
+        # Apply one key press; run() and replays both go through here
+        if self.animation_queue:
+            # Controls resume once the chain has been shown
+            return
+        
+        if not self.game_over:
+            if key == pygame.K_LEFT:
+                if self.valid_move(self.current_piece, x_offset=-1):
+                    self.current_piece['x'] -= 1
+            elif key == pygame.K_RIGHT:
+                if self.valid_move(self.current_piece, x_offset=1):
+                    self.current_piece['x'] += 1
+            elif key == pygame.K_DOWN:
+                if self.valid_move(self.current_piece, y_offset=1):
+                    self.current_piece['y'] += 1
+                else:
+                    self.queue_chain_animation(self.lock_piece(self.current_piece))
+            elif key == pygame.K_UP:
+                self.current_piece = self.rotate_piece(self.current_piece)
+            elif key == pygame.K_SPACE:
+                # Hard drop
+                while self.valid_move(self.current_piece, y_offset=1):
+                    self.current_piece['y'] += 1
+                self.queue_chain_animation(self.lock_piece(self.current_piece))
+        elif key == pygame.K_r:
+            self.reset_game()
+
+    def update(self):
+        # Advance the game by one frame
+        current_time = self.frame * FRAME_TIME
+        animating = self.update_animation(current_time)
+        
+        # Automatic falling
+        if not animating and not self.game_over and current_time - self.last_fall_time > self.fall_speed:
+            if self.valid_move(self.current_piece, y_offset=1):
+                self.current_piece['y'] += 1
+            else:
+                self.queue_chain_animation(self.lock_piece(self.current_piece))
+            self.last_fall_time = current_time
+        
+        self.frame += 1
+
+    def run(self, replay_path=None):
+        # Every key press is recorded; the replay is saved to replay_path on exit
+        replay = Replay(self.seed)
         running = True
         
         while running:
-            current_time = time.time()
-            
             # Handle events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
-                
-                if not self.game_over:
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_LEFT:
-                            if self.valid_move(self.current_piece, x_offset=-1):
-                                self.current_piece['x'] -= 1
-                        elif event.key == pygame.K_RIGHT:
-                            if self.valid_move(self.current_piece, x_offset=1):
-                                self.current_piece['x'] += 1
-                        elif event.key == pygame.K_DOWN:
-                            if self.valid_move(self.current_piece, y_offset=1):
-                                self.current_piece['y'] += 1
-                            else:
-                                self.lock_piece(self.current_piece)
-                        elif event.key == pygame.K_UP:
-                            self.current_piece = self.rotate_piece(self.current_piece)
-                        elif event.key == pygame.K_SPACE:
-                            # Hard drop
-                            while self.valid_move(self.current_piece, y_offset=1):
-                                self.current_piece['y'] += 1
-                            self.lock_piece(self.current_piece)
-                else:
-                    if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
-                        self.reset_game()
+                elif event.type == pygame.KEYDOWN:
+                    replay.record(self.frame, event.key)
+                    self.handle_key(event.key)
             
-            # Automatic falling
-            if not self.game_over and current_time - self.last_fall_time > self.fall_speed:
-                if self.valid_move(self.current_piece, y_offset=1):
-                    self.current_piece['y'] += 1
-                else:
-                    self.lock_piece(self.current_piece)
-                self.last_fall_time = current_time
+            self.update()
             
-            # Draw everything
+            # Draw what changed and push only those areas to the display
             self.draw()
-            
-            # Update the display
-            pygame.display.flip()
+            self.dirty.present()
             
             # Cap the frame rate
             self.clock.tick(60)
         
+        if replay_path is not None:
+            replay.frames = self.frame
+            replay.save(replay_path)
         pygame.quit()
         sys.exit()
 
@@ -1,9 +1,8 @@
 import pygame
 import random
-import time
 
-# Initialize pygame
-pygame.init()
+from dirty_rects import DirtyRegions
+from replay import FRAME_TIME, Replay, game_seed
 
 # Colors
 BLACK = (0, 0, 0)
@@ -26,6 +25,7 @@ SIDEBAR_WIDTH = 200
 # Screen dimensions
 SCREEN_WIDTH = BLOCK_SIZE * GRID_WIDTH + SIDEBAR_WIDTH
 SCREEN_HEIGHT = BLOCK_SIZE * GRID_HEIGHT
+SIDEBAR_RECT = (GRID_WIDTH * BLOCK_SIZE, 0, SIDEBAR_WIDTH, SCREEN_HEIGHT)
 
 # Tetromino shapes
 SHAPES = [
@@ -41,16 +41,85 @@ SHAPES = [
 # Colors for each shape
 SHAPE_COLORS = [CYAN, YELLOW, PURPLE, ORANGE, BLUE, GREEN, RED]
 
+# Row bitmasks: bit x of a row is set when column x is occupied
+FULL_ROW = (1 << GRID_WIDTH) - 1
+
+def rotate_shape(shape):
+    # Rotate a shape 90 degrees clockwise
+    rows = len(shape)
+    cols = len(shape[0])
+    rotated = [[0 for _ in range(rows)] for _ in range(cols)]
+    
+    for y in range(rows):
+        for x in range(cols):
+            rotated[x][rows - 1 - y] = shape[y][x]
+    return rotated
+
+def shape_masks(shape):
+    # One bitmask per shape row, relative to the piece's x position
+    return tuple(sum(1 << x for x, cell in enumerate(row) if cell) for row in shape)
+
+# Offsets (dx, dy) tried in order when a rotation collides; the first one
+# that fits is used. O never needs to move, I gets wider wall kicks.
+DEFAULT_KICKS = ((0, 0), (-1, 0), (1, 0), (0, -1))
+SHAPE_KICKS = {
+    0: ((0, 0), (-1, 0), (1, 0), (-2, 0), (2, 0), (0, -1)),  # I
+    1: ((0, 0),)  # O
+}
+
+def build_piece_catalog():
+    # Precompute every rotation state of every shape once. Shapes are stored
+    # as tuples so pieces can share them without copying.
+    rotations, masks, widths, kicks = [], [], [], []
+    for shape_idx, shape in enumerate(SHAPES):
+        states = [shape]
+        for _ in range(3):
+            states.append(rotate_shape(states[-1]))
+        rotations.append(tuple(tuple(tuple(row) for row in state) for state in states))
+        masks.append(tuple(shape_masks(state) for state in states))
+        widths.append(tuple(len(state[0]) for state in states))
+        kicks.append(SHAPE_KICKS.get(shape_idx, DEFAULT_KICKS))
+    return tuple(rotations), tuple(masks), tuple(widths), tuple(kicks)
+
+# Piece catalog, indexed by [shape index][rotation]
+PIECE_ROTATIONS, PIECE_MASKS, PIECE_WIDTHS, PIECE_KICKS = build_piece_catalog()
+
 class Tetris:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-        pygame.display.set_caption("Tetris")
-        self.clock = pygame.time.Clock()
-        self.font = pygame.font.SysFont('Arial', 25)
+    def __init__(self, headless=False, seed=None):
+        self.headless = headless
+        # Per-game generator, so a seed reproduces the piece sequence. The
+        # seed is kept so a recorded session can be replayed.
+        self.seed = game_seed(seed)
+        self.random = random.Random(self.seed)
+        # Game time advances FRAME_TIME per update(), not with the wall clock
+        self.frame = 0
+        if not headless:
+            # Initialize pygame
+            pygame.init()
+            
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            pygame.display.set_caption("Tetris")
+            self.clock = pygame.time.Clock()
+            self.font = pygame.font.SysFont('Arial', 25)
+            self.dirty = DirtyRegions(self.screen, self.draw_background)
+        
         self.reset_game()
 
-    def reset_game(self):
-        self.grid = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
+    @property
+    def grid(self):
+        # Grid of colors (0 for empty cells), derived from the row bitmasks
+        return [[self.colors[y][x] if self.rows[y] >> x & 1 else 0 for x in range(GRID_WIDTH)]
+                for y in range(GRID_HEIGHT)]
+
+    def reset_game(self, seed=None):
+        # A seed restarts the piece sequence; otherwise the stream continues
+        if seed is not None:
+            self.seed = game_seed(seed)
+            self.random.seed(seed)
+        
+        # Occupancy is kept as one bitmask per row; colors are only read when rendering
+        self.rows = [0] * GRID_HEIGHT
+        self.colors = [[0 for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT)]
         self.current_piece = self.new_piece()
         self.game_over = False
         self.score = 0
@@ -58,64 +127,84 @@ class Tetris:
         self.lines_cleared = 0
         self.fall_time = 0
         self.fall_speed = 0.5  # Time in seconds between automatic piece movements
-        self.last_fall_time = time.time()
+        self.last_fall_time = self.frame * FRAME_TIME
 
     def new_piece(self):
         # Choose a random shape
-        shape_idx = random.randint(0, len(SHAPES) - 1)
-        shape = SHAPES[shape_idx]
+        shape_idx = self.random.randint(0, len(SHAPES) - 1)
+        shape = PIECE_ROTATIONS[shape_idx][0]
         color = SHAPE_COLORS[shape_idx]
         
         # Starting position
-        x = GRID_WIDTH // 2 - len(shape[0]) // 2
+        x = GRID_WIDTH // 2 - PIECE_WIDTHS[shape_idx][0] // 2
         y = 0
         
-        return {'shape': shape, 'x': x, 'y': y, 'color': color}
+        return {'shape': shape, 'x': x, 'y': y, 'color': color, 'type': shape_idx, 'rotation': 0}
 
     def valid_move(self, piece, x_offset=0, y_offset=0):
-        for y, row in enumerate(piece['shape']):
-            for x, cell in enumerate(row):
-                if cell:
-                    new_x = piece['x'] + x + x_offset
-                    new_y = piece['y'] + y + y_offset
-                    
-                    # Check if the move is within boundaries
-                    if new_x < 0 or new_x >= GRID_WIDTH or new_y >= GRID_HEIGHT:
-                        return False
-                    
-                    # Check if the cell is already occupied
-                    if new_y >= 0 and self.grid[new_y][new_x]:
-                        return False
+        shape_idx = piece['type']
+        rotation = piece['rotation']
+        return self.fits(PIECE_MASKS[shape_idx][rotation], PIECE_WIDTHS[shape_idx][rotation],
+                         piece['x'] + x_offset, piece['y'] + y_offset)
+
+    def fits(self, masks, width, x, y):
+        # Check if the move is within boundaries
+        if x < 0 or x + width > GRID_WIDTH or y + len(masks) > GRID_HEIGHT:
+            return False
+        
+        # Check if any cell is already occupied
+        rows = self.rows
+        for i, mask in enumerate(masks):
+            if y + i >= 0 and rows[y + i] & (mask << x):
+                return False
         return True
 
+    def drop_distance(self, piece):
+        # Number of rows the piece can fall before it lands
+        cells = [mask << piece['x'] for mask in PIECE_MASKS[piece['type']][piece['rotation']]]
+        rows = self.rows
+        y = piece['y'] + 1
+        while y + len(cells) <= GRID_HEIGHT:
+            for i, mask in enumerate(cells):
+                if y + i >= 0 and rows[y + i] & mask:
+                    return y - 1 - piece['y']
+            y += 1
+        return y - 1 - piece['y']
+
     def rotate_piece(self, piece):
-        # Create a new rotated shape (90 degrees clockwise)
-        rows = len(piece['shape'])
-        cols = len(piece['shape'][0])
-        rotated = [[0 for _ in range(rows)] for _ in range(cols)]
-        
-        for y in range(rows):
-            for x in range(cols):
-                rotated[x][rows - 1 - y] = piece['shape'][y][x]
+        # Rotate 90 degrees clockwise in place by stepping to the next
+        # precomputed rotation state, trying each kick offset in turn
+        shape_idx = piece['type']
+        rotation = (piece['rotation'] + 1) % 4
+        masks = PIECE_MASKS[shape_idx][rotation]
+        width = PIECE_WIDTHS[shape_idx][rotation]
         
-        # Check if the rotated piece is valid
-        temp_piece = {'shape': rotated, 'x': piece['x'], 'y': piece['y'], 'color': piece['color']}
-        if self.valid_move(temp_piece):
-            return temp_piece
+        for dx, dy in PIECE_KICKS[shape_idx]:
+            if self.fits(masks, width, piece['x'] + dx, piece['y'] + dy):
+                piece['x'] += dx
+                piece['y'] += dy
+                piece['rotation'] = rotation
+                piece['shape'] = PIECE_ROTATIONS[shape_idx][rotation]
+                break
         return piece
 
     def lock_piece(self, piece):
-        for y, row in enumerate(piece['shape']):
-            for x, cell in enumerate(row):
-                if cell:
-                    # Add the piece to the grid
-                    grid_y = piece['y'] + y
-                    grid_x = piece['x'] + x
-                    if grid_y >= 0:  # Only add if it's within the grid
-                        self.grid[grid_y][grid_x] = piece['color']
+        masks = PIECE_MASKS[piece['type']][piece['rotation']]
+        top = max(piece['y'], 0)
+        bottom = piece['y'] + len(masks)
+        for i, mask in enumerate(masks):
+            # Add the piece to the grid
+            grid_y = piece['y'] + i
+            if grid_y >= 0:  # Only add if it's within the grid
+                cells = mask << piece['x']
+                self.rows[grid_y] |= cells
+                color_row = self.colors[grid_y]
+                for x in range(GRID_WIDTH):
+                    if cells >> x & 1:
+                        color_row[x] = piece['color']
         
-        # Check for completed lines
-        self.check_lines()
+        # Check for completed lines (only the rows the piece touched can fill up)
+        self.check_lines(range(top, bottom))
         
         # Get a new piece
         self.current_piece = self.new_piece()
@@ -124,18 +213,14 @@ class Tetris:
         if not self.valid_move(self.current_piece):
             self.game_over = True
 
-    def check_lines(self):
-        lines_to_clear = []
+    def check_lines(self, rows_to_check=None):
+        # A row is full when its bitmask is FULL_ROW, so checking is O(1) per row
+        if rows_to_check is None:
+            rows_to_check = range(GRID_HEIGHT)
+        lines_to_clear = [y for y in rows_to_check if self.rows[y] == FULL_ROW]
         
-        for y in range(GRID_HEIGHT):
-            if all(self.grid[y]):
-                lines_to_clear.append(y)
-        
-        for line in lines_to_clear:
-            # Remove the line
-            del self.grid[line]
-            # Add a new empty line at the top
-            self.grid.insert(0, [0 for _ in range(GRID_WIDTH)])
+        if lines_to_clear:
+            self.remove_lines(lines_to_clear)
         
         # Update score
         if lines_to_clear:
@@ -148,44 +233,59 @@ class Tetris:
             # Increase speed with level
             self.fall_speed = max(0.1, 0.5 - (self.level - 1) * 0.05)
 
+    def remove_lines(self, lines):
+        # Remove all the given lines in a single compaction pass: rows above
+        # the lowest cleared line move down, rows below it are untouched
+        rows = self.rows
+        colors = self.colors
+        cleared = set(lines)
+        freed_colors = [colors[y] for y in lines]
+        
+        write = max(lines)
+        for read in range(write, -1, -1):
+            if read not in cleared:
+                rows[write] = rows[read]
+                colors[write] = colors[read]
+                write -= 1
+        
+        # Fill the top with empty lines, reusing the cleared color rows
+        for y in range(write + 1):
+            rows[y] = 0
+            colors[y] = freed_colors[y]
+
+    def draw_background(self, surface):
+        # Static layer: empty board and sidebar panel
+        surface.fill(BLACK)
+        pygame.draw.rect(surface, (50, 50, 50), SIDEBAR_RECT)
+
     def draw_grid(self):
+        # Draw the cells whose color changed, with the falling piece on top
+        piece_cells = {}
+        if not self.game_over:
+            piece = self.current_piece
+            for i, mask in enumerate(PIECE_MASKS[piece['type']][piece['rotation']]):
+                mask <<= piece['x']
+                for x in range(GRID_WIDTH):
+                    if mask >> x & 1:
+                        piece_cells[(x, piece['y'] + i)] = piece['color']
+        
         for y in range(GRID_HEIGHT):
+            row = self.rows[y]
+            color_row = self.colors[y]
             for x in range(GRID_WIDTH):
-                # Draw grid cell
-                pygame.draw.rect(
-                    self.screen,
-                    WHITE if self.grid[y][x] else BLACK,
-                    [x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE - GRID_MARGIN, BLOCK_SIZE - GRID_MARGIN]
-                )
+                color = piece_cells.get((x, y))
+                if color is None and row >> x & 1:
+                    color = color_row[x]
                 
-                # If cell is occupied, draw the block with its color
-                if self.grid[y][x]:
-                    pygame.draw.rect(
-                        self.screen,
-                        self.grid[y][x],
-                        [x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE - GRID_MARGIN, BLOCK_SIZE - GRID_MARGIN]
-                    )
-
-    def draw_piece(self, piece):
-        for y, row in enumerate(piece['shape']):
-            for x, cell in enumerate(row):
-                if cell:
-                    # Only draw if the cell is within the visible grid
-                    if piece['y'] + y >= 0:
-                        pygame.draw.rect(
-                            self.screen,
-                            piece['color'],
-                            [(piece['x'] + x) * BLOCK_SIZE, (piece['y'] + y) * BLOCK_SIZE, 
-                             BLOCK_SIZE - GRID_MARGIN, BLOCK_SIZE - GRID_MARGIN]
-                        )
+                rect = (x * BLOCK_SIZE, y * BLOCK_SIZE, BLOCK_SIZE - GRID_MARGIN, BLOCK_SIZE - GRID_MARGIN)
+                if self.dirty.changed((x, y), color, rect) and color is not None:
+                    pygame.draw.rect(self.screen, color, rect)
 
     def draw_sidebar(self):
-        # Draw sidebar background
-        pygame.draw.rect(
-            self.screen,
-            (50, 50, 50),
-            [GRID_WIDTH * BLOCK_SIZE, 0, SIDEBAR_WIDTH, SCREEN_HEIGHT]
-        )
+        # Redrawn only when one of its values changes
+        if not self.dirty.changed('sidebar', (self.score, self.level, self.lines_cleared, self.game_over),
+                                  SIDEBAR_RECT):
+            return
         
         # Draw score
         score_text = self.font.render(f"Score: {self.score}", True, WHITE)
@@ -207,60 +307,72 @@ class Tetris:
             restart_text = self.font.render("Press R to restart", True, WHITE)
             self.screen.blit(restart_text, (GRID_WIDTH * BLOCK_SIZE + 10, 240))
 
-    def run(self):
+    def draw(self):
+        self.dirty.begin()
+        self.draw_grid()
+        self.draw_sidebar()
+
+    def handle_key(self, key):
+        # Apply one key press; run() and replays both go through here
+        if not self.game_over:
+            if key == pygame.K_LEFT:
+                if self.valid_move(self.current_piece, x_offset=-1):
+                    self.current_piece['x'] -= 1
+            elif key == pygame.K_RIGHT:
+                if self.valid_move(self.current_piece, x_offset=1):
+                    self.current_piece['x'] += 1
+            elif key == pygame.K_DOWN:
+                if self.valid_move(self.current_piece, y_offset=1):
+                    self.current_piece['y'] += 1
+            elif key == pygame.K_UP:
+                self.current_piece = self.rotate_piece(self.current_piece)
+            elif key == pygame.K_SPACE:
+                # Hard drop
+                self.current_piece['y'] += self.drop_distance(self.current_piece)
+                self.lock_piece(self.current_piece)
+        elif key == pygame.K_r:
+            self.reset_game()
+
+    def update(self):
+        # Advance the game by one frame
+        current_time = self.frame * FRAME_TIME
+        
+        # Automatic falling
+        if not self.game_over and current_time - self.last_fall_time > self.fall_speed:
+            if self.valid_move(self.current_piece, y_offset=1):
+                self.current_piece['y'] += 1
+            else:
+                self.lock_piece(self.current_piece)
+            self.last_fall_time = current_time
+        
+        self.frame += 1
+
+    def run(self, replay_path=None):
+        # Every key press is recorded; the replay is saved to replay_path on exit
+        replay = Replay(self.seed)
         running = True
         
         while running:
-            current_time = time.time()
-            
             # Handle events
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
-                
-                if not self.game_over:
-                    if event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_LEFT:
-                            if self.valid_move(self.current_piece, x_offset=-1):
-                                self.current_piece['x'] -= 1
-                        elif event.key == pygame.K_RIGHT:
-                            if self.valid_move(self.current_piece, x_offset=1):
-                                self.current_piece['x'] += 1
-                        elif event.key == pygame.K_DOWN:
-                            if self.valid_move(self.current_piece, y_offset=1):
-                                self.current_piece['y'] += 1
-                        elif event.key == pygame.K_UP:
-                            self.current_piece = self.rotate_piece(self.current_piece)
-                        elif event.key == pygame.K_SPACE:
-                            # Hard drop
-                            while self.valid_move(self.current_piece, y_offset=1):
-                                self.current_piece['y'] += 1
-                            self.lock_piece(self.current_piece)
-                else:
-                    if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
-                        self.reset_game()
-            
-            # Automatic falling
-            if not self.game_over and current_time - self.last_fall_time > self.fall_speed:
-                if self.valid_move(self.current_piece, y_offset=1):
-                    self.current_piece['y'] += 1
-                else:
-                    self.lock_piece(self.current_piece)
-                self.last_fall_time = current_time
+                elif event.type == pygame.KEYDOWN:
+                    replay.record(self.frame, event.key)
+                    self.handle_key(event.key)
             
-            # Draw everything
-            self.screen.fill(BLACK)
-            self.draw_grid()
-            if not self.game_over:
-                self.draw_piece(self.current_piece)
-            self.draw_sidebar()
+            self.update()
             
-            # Update the display
-            pygame.display.flip()
+            # Draw what changed and push only those areas to the display
+            self.draw()
+            self.dirty.present()
             
             # Cap the frame rate
             self.clock.tick(60)
         
+        if replay_path is not None:
+            replay.frames = self.frame
+            replay.save(replay_path)
         pygame.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,297 @@
+import time
+
+from tetris import (Tetris, FULL_ROW, GRID_HEIGHT, GRID_WIDTH, PIECE_KICKS, PIECE_MASKS,
+                    PIECE_ROTATIONS)
+
+# Heuristic weights for scoring a placement (Dellacherie's features with
+# the El-Tetris weights); they keep the stack low and flat without a preview
+LANDING_HEIGHT_WEIGHT = -4.500158825082766
+LINES_WEIGHT = 3.4181268101392694
+ROW_TRANSITIONS_WEIGHT = -3.2178882868487753
+COLUMN_TRANSITIONS_WEIGHT = -9.348695305445199
+HOLES_WEIGHT = -7.899265427351652
+WELLS_WEIGHT = -3.3855972247263626
+DEFAULT_WEIGHTS = (LANDING_HEIGHT_WEIGHT, LINES_WEIGHT, ROW_TRANSITIONS_WEIGHT,
+                   COLUMN_TRANSITIONS_WEIGHT, HOLES_WEIGHT, WELLS_WEIGHT)
+
+# A row with the side walls as filled cells at bit 0 and bit GRID_WIDTH + 1
+SIDE_WALLS = 1 | 1 << (GRID_WIDTH + 1)
+WALLED_ROW = (1 << (GRID_WIDTH + 1)) - 1
+
+
+class Placement:
+    # A final resting position of a piece and the board features it leaves
+
+    def __init__(self, x, y, rotation, landing_height, lines,
+                 row_transitions, column_transitions, holes, wells):
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.landing_height = landing_height
+        self.lines = lines
+        self.row_transitions = row_transitions
+        self.column_transitions = column_transitions
+        self.holes = holes
+        self.wells = wells
+        self.score = 0.0
+
+    def evaluate(self, weights=DEFAULT_WEIGHTS):
+        (landing_height_weight, lines_weight, row_transitions_weight,
+         column_transitions_weight, holes_weight, wells_weight) = weights
+        self.score = (landing_height_weight * self.landing_height + lines_weight * self.lines
+                      + row_transitions_weight * self.row_transitions
+                      + column_transitions_weight * self.column_transitions
+                      + holes_weight * self.holes + wells_weight * self.wells)
+        return self.score
+
+
+def board_features(rows):
+    # Returns (row transitions, column transitions, holes, wells) for a list
+    # of row bitmasks. Transitions count filled/empty changes between
+    # neighboring cells, with the side walls and the floor counted as filled.
+    # Wells are empty cells with both neighbors filled; a well d cells deep
+    # counts 1 + 2 + ... + d.
+    # Empty rows only cross the two walls
+    top = 0
+    while top < len(rows) and not rows[top]:
+        top += 1
+    row_transitions = 2 * top
+    column_transitions = 0
+    holes = 0
+    wells = 0
+    previous = 0  # Above the stack is empty
+    above = 0
+    runs = []  # runs[k]: columns whose well goes on for more than k rows here
+    for row in rows[top:]:
+        walled = row << 1 | SIDE_WALLS
+        row_transitions += bin((walled ^ walled >> 1) & WALLED_ROW).count("1")
+        column_transitions += bin(row ^ previous).count("1")
+        previous = row
+        # Empty cells under a column that already started are holes
+        holes += bin(above & ~row).count("1")
+        above |= row
+
+        well = (~walled & walled << 1 & walled >> 1) >> 1 & FULL_ROW
+        if well or runs:
+            deeper = [well]
+            for run in runs:
+                run &= well
+                if not run:
+                    break
+                deeper.append(run)
+            runs = deeper if well else []
+            for run in runs:
+                wells += bin(run).count("1")
+    if rows:
+        column_transitions += bin(rows[-1] ^ FULL_ROW).count("1")
+    return row_transitions, column_transitions, holes, wells
+
+
+# Collision board for the placement search: the grid as one integer with
+# BOARD_STRIDE bits per row, grid columns in bits 1..GRID_WIDTH and every
+# other bit set, so the side walls and the floor block a piece exactly where
+# Tetris.fits does. Pieces kicked above the grid land in the empty top rows.
+BOARD_STRIDE = 16
+BOARD_TOP = 8
+BOARD_FLOOR = 4
+BOARD_WALLS = ((1 << BOARD_STRIDE) - 1) & ~(FULL_ROW << 1)
+
+
+def _collision_board(rows):
+    board = 0
+    for y in range(BOARD_TOP):
+        board |= BOARD_WALLS << y * BOARD_STRIDE
+    for y, row in enumerate(rows, BOARD_TOP):
+        board |= (row << 1 | BOARD_WALLS) << y * BOARD_STRIDE
+    for y in range(BOARD_TOP + GRID_HEIGHT, BOARD_TOP + GRID_HEIGHT + BOARD_FLOOR):
+        board |= ((1 << BOARD_STRIDE) - 1) << y * BOARD_STRIDE
+    return board
+
+
+def _piece_bits(masks):
+    return sum(mask << i * BOARD_STRIDE for i, mask in enumerate(masks))
+
+
+# Board offsets of every rotation state and of every kick, indexed like PIECE_MASKS
+PIECE_BITS = tuple(tuple(_piece_bits(masks) for masks in rotations) for rotations in PIECE_MASKS)
+KICK_OFFSETS = tuple(tuple(dx + dy * BOARD_STRIDE for dx, dy in kicks) for kicks in PIECE_KICKS)
+
+
+def _land(rows, masks, x, y):
+    # Lock masks into a copy of rows and clear full lines;
+    # returns the new rows and the number of lines cleared
+    new_rows = rows[:]
+    for i, mask in enumerate(masks):
+        if y + i >= 0:
+            new_rows[y + i] |= mask << x
+    kept = [row for row in new_rows if row != FULL_ROW]
+    lines = GRID_HEIGHT - len(kept)
+    return [0] * lines + kept, lines
+
+
+def _row_states(board, piece_bits, kicks, start):
+    # States reachable from start by moving sideways and rotating in a row
+    # where only the walls can block the piece (a kick upwards never fits
+    # there, since staying put would have fit first)
+    seen = {start}
+    frontier = [start]
+    while frontier:
+        next_frontier = []
+        for state in frontier:
+            offset, rotation = divmod(state, 4)
+            bits = piece_bits[rotation]
+            moves = []
+            if not board & bits << offset - 1:
+                moves.append(state - 4)
+            if not board & bits << offset + 1:
+                moves.append(state + 4)
+            turned = (rotation + 1) % 4
+            turned_bits = piece_bits[turned]
+            for kick in kicks:
+                if not board & turned_bits << offset + kick:
+                    moves.append((offset + kick) * 4 + turned)
+                    break
+            for move in moves:
+                if move not in seen:
+                    seen.add(move)
+                    next_frontier.append(move)
+        frontier = next_frontier
+    return list(seen)
+
+
+def enumerate_placements(game, piece=None, weights=DEFAULT_WEIGHTS):
+    # Every placement the piece can reach from where it is with the game's
+    # own moves: left, right, down and a clockwise rotation that takes the
+    # first of its PIECE_KICKS that fits, as in Tetris.rotate_piece. A
+    # breadth-first search over (x, y, rotation) keeps the states the piece
+    # cannot fall out of, so tucks and slides under overhangs are included.
+    # The live game is never modified.
+    if piece is None:
+        piece = game.current_piece
+    shape_idx = piece['type']
+    piece_masks = PIECE_MASKS[shape_idx]
+    piece_bits = PIECE_BITS[shape_idx]
+    kicks = KICK_OFFSETS[shape_idx]
+    rows = game.rows
+    board = _collision_board(rows)
+    placements = []
+
+    # A state is its bit offset on the collision board times four plus the
+    # rotation; moving the piece is adding to the offset
+    offset = (piece['y'] + BOARD_TOP) * BOARD_STRIDE + piece['x'] + 1
+    start = offset * 4 + piece['rotation']
+    if piece['y'] < 1 - BOARD_TOP or board & piece_bits[piece['rotation']] << offset:
+        return placements
+
+    # Rows down to sky are above the stack for every rotation. There only
+    # the walls block the piece, so it reaches the same columns and
+    # rotations in every such row: find them in its own row and start the
+    # search from all of them in the lowest one
+    top = next((y for y, row in enumerate(rows) if row), GRID_HEIGHT)
+    sky = top - max(len(masks) for masks in piece_masks)
+    if piece['y'] < sky:
+        frontier = _row_states(board, piece_bits, kicks, start)
+        drop = 4 * BOARD_STRIDE * (sky - piece['y'])
+        frontier = [state + drop for state in frontier]
+    else:
+        frontier = [start]
+
+    seen = set(frontier)
+    # Symmetric pieces repeat rotation states, so landings are told apart by
+    # the cells they fill
+    landed = set()
+    while frontier:
+        next_frontier = []
+        for state in frontier:
+            offset, rotation = divmod(state, 4)
+            bits = piece_bits[rotation]
+            moves = []
+            if not board & bits << offset - 1:
+                moves.append(state - 4)
+            if not board & bits << offset + 1:
+                moves.append(state + 4)
+            if not board & bits << offset + BOARD_STRIDE:
+                moves.append(state + 4 * BOARD_STRIDE)
+            else:
+                masks = piece_masks[rotation]
+                y, x = divmod(offset, BOARD_STRIDE)
+                x -= 1
+                y -= BOARD_TOP
+                if (masks, x, y) not in landed:
+                    landed.add((masks, x, y))
+                    new_rows, lines = _land(rows, masks, x, y)
+                    # Height of the piece's middle above the floor
+                    landing_height = GRID_HEIGHT - y - (len(masks) + 1) / 2
+                    placement = Placement(x, y, rotation, landing_height, lines,
+                                          *board_features(new_rows))
+                    placement.evaluate(weights)
+                    placements.append(placement)
+
+            turned = (rotation + 1) % 4
+            turned_bits = piece_bits[turned]
+            for kick in kicks:
+                if offset + kick >= BOARD_STRIDE and not board & turned_bits << offset + kick:
+                    moves.append((offset + kick) * 4 + turned)
+                    break
+
+            for move in moves:
+                if move not in seen:
+                    seen.add(move)
+                    next_frontier.append(move)
+        frontier = next_frontier
+
+    return placements
+
+
+class TetrisBot:
+    # Plays a Tetris game by locking each piece at its best-scoring placement
+
+    def __init__(self, game, weights=DEFAULT_WEIGHTS):
+        self.game = game
+        self.weights = weights
+        self.decisions = 0
+        self.decision_time = 0.0
+
+    def best_placement(self):
+        start = time.perf_counter()
+        placements = enumerate_placements(self.game, weights=self.weights)
+        best = max(placements, key=lambda placement: placement.score, default=None)
+        self.decisions += 1
+        self.decision_time += time.perf_counter() - start
+        return best
+
+    def step(self):
+        # Place the current piece; returns False once the game is over
+        if self.game.game_over:
+            return False
+        placement = self.best_placement()
+        if placement is None:
+            self.game.game_over = True
+            return False
+
+        piece = self.game.current_piece
+        piece['rotation'] = placement.rotation
+        piece['shape'] = PIECE_ROTATIONS[piece['type']][placement.rotation]
+        piece['x'] = placement.x
+        piece['y'] = placement.y
+        self.game.lock_piece(piece)
+        return True
+
+    def play(self, max_pieces=None):
+        pieces = 0
+        while max_pieces is None or pieces < max_pieces:
+            if not self.step():
+                break
+            pieces += 1
+        return pieces
+
+    def average_decision_ms(self):
+        return self.decision_time / self.decisions * 1000 if self.decisions else 0.0
+
+
+if __name__ == "__main__":
+    game = Tetris(headless=True)
+    bot = TetrisBot(game)
+    pieces = bot.play(max_pieces=1000)
+    print(f"Pieces: {pieces}, lines: {game.lines_cleared}, score: {game.score}")
+    print(f"Average decision time: {bot.average_decision_ms():.3f} ms")